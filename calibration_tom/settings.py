@@ -65,6 +65,7 @@ INSTALLED_APPS = [
     'nres_calibrations',
     'photometric_standards',
     'calibrations',
+    'configdb',
 ]
 
 SITE_ID = 1
@@ -263,6 +264,26 @@ TOM_CADENCE_STRATEGIES = [
     'calibrations.cadences.nres_cadence.NRESCadenceStrategy',
     'calibrations.cadences.photometric_standards_cadence.PhotometricStandardsCadenceStrategy'
 ]
+# runcalibrationcadences runs this many cadences at once, and no more than the facility's limit
+# (or CADENCE_RUNNER_FACILITY_DEFAULT_LIMIT) of them against any one facility
+CADENCE_RUNNER_WORKERS = int(os.getenv('CADENCE_RUNNER_WORKERS', 8))
+CADENCE_RUNNER_FACILITY_LIMITS = {}  # e.g. {'LCO Calibrations': 2}
+CADENCE_RUNNER_FACILITY_DEFAULT_LIMIT = int(os.getenv('CADENCE_RUNNER_FACILITY_DEFAULT_LIMIT', 4))
+# a runner's leases on the cadences it runs can be taken over by another runner once they are this old
+CADENCE_RUNNER_LEASE_TIMEOUT = int(os.getenv('CADENCE_RUNNER_LEASE_TIMEOUT', 3600))  # seconds
+# the optional cadencescheduler process checks pending cadences at least every CADENCE_SCHEDULER_POLL_INTERVAL,
+# and whether anything woke it up every CADENCE_SCHEDULER_WAKE_INTERVAL
+CADENCE_SCHEDULER_POLL_INTERVAL = int(os.getenv('CADENCE_SCHEDULER_POLL_INTERVAL', 900))  # seconds
+CADENCE_SCHEDULER_WAKE_INTERVAL = int(os.getenv('CADENCE_SCHEDULER_WAKE_INTERVAL', 5))  # seconds
+# observation statuses are looked up in the observation portal this many observations per request
+OBSERVATION_STATUS_BATCH_SIZE = int(os.getenv('OBSERVATION_STATUS_BATCH_SIZE', 50))
+# and each of those requests gives up after these (connect, read) timeouts, rather than stalling the updates
+OBSERVATION_STATUS_CONNECT_TIMEOUT = float(os.getenv('OBSERVATION_STATUS_CONNECT_TIMEOUT', 5.0))  # seconds
+OBSERVATION_STATUS_READ_TIMEOUT = float(os.getenv('OBSERVATION_STATUS_READ_TIMEOUT', 30.0))  # seconds
+# the observation portal's instruments and proposals are fetched again when they are PORTAL_METADATA_CACHE_TIMEOUT
+# old, and refreshed in the background once they are PORTAL_METADATA_REFRESH_AFTER old
+PORTAL_METADATA_CACHE_TIMEOUT = int(os.getenv('PORTAL_METADATA_CACHE_TIMEOUT', 6 * 60 * 60))  # seconds
+PORTAL_METADATA_REFRESH_AFTER = int(os.getenv('PORTAL_METADATA_REFRESH_AFTER', 30 * 60))  # seconds
 
 BROKER_CREDENTIALS = {}
 
@@ -305,6 +326,7 @@ OPEN_URLS = []
 HOOKS = {
     'target_post_save': 'tom_common.hooks.target_post_save',
     'instrument_post_save': 'network.hooks.instrument_post_save',
+    'instrument_post_bulk_save': 'network.hooks.instrument_post_bulk_save',
     # 'observation_change_state': 'tom_common.hooks.observation_change_state',
     'observation_change_state': 'calibrations.hooks.observation_change_state',
     'data_product_post_upload': 'tom_dataproducts.hooks.data_product_post_upload',
@@ -318,6 +340,22 @@ THUMBNAIL_DEFAULT_SIZE = (200, 200)
 
 #CONFIGDB_URL = os.getenv('CONFIGDB_URL', 'http://configdb-dev.lco.gtn')
 CONFIGDB_URL = os.getenv('CONFIGDB_URL', 'http://configdb.lco.gtn')
+# HTTP client settings for ConfigDB requests (see configdb.client)
+CONFIGDB_CONNECT_TIMEOUT = float(os.getenv('CONFIGDB_CONNECT_TIMEOUT', 5.0))  # seconds
+CONFIGDB_READ_TIMEOUT = float(os.getenv('CONFIGDB_READ_TIMEOUT', 30.0))  # seconds
+CONFIGDB_MAX_RETRIES = int(os.getenv('CONFIGDB_MAX_RETRIES', 3))
+CONFIGDB_RETRY_BACKOFF = float(os.getenv('CONFIGDB_RETRY_BACKOFF', 0.5))  # seconds, doubled on each retry
+CONFIGDB_POOL_MAXSIZE = int(os.getenv('CONFIGDB_POOL_MAXSIZE', 10))
+# paginated ConfigDB endpoints (e.g. /instruments/) are fetched this many items per page, with this many workers
+CONFIGDB_PAGE_SIZE = int(os.getenv('CONFIGDB_PAGE_SIZE', 100))
+CONFIGDB_FETCH_WORKERS = int(os.getenv('CONFIGDB_FETCH_WORKERS', 4))
+# cached ConfigDB site info is refreshed in the background once it is older than the soft TTL,
+# and is never served once it is older than the hard TTL
+CONFIGDB_SITE_INFO_SOFT_TTL = int(os.getenv('CONFIGDB_SITE_INFO_SOFT_TTL', 300))  # seconds
+CONFIGDB_SITE_INFO_HARD_TTL = int(os.getenv('CONFIGDB_SITE_INFO_HARD_TTL', 3600))  # seconds
+# every successful ConfigDB fetch is saved in the database (see configdb.models.SavedSnapshot), to start from (or
+# survive ConfigDB outages with)
+CONFIGDB_SNAPSHOT_ENABLED = os.getenv('CONFIGDB_SNAPSHOT_ENABLED', 'true').lower() == 'true'
 
 PHOTOMETRIC_STANDARDS_SITES = ('coj', 'cpt', 'tfn', 'lsc', 'elp', 'ogg')
 
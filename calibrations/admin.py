@@ -1,9 +1,10 @@
 from django.contrib import admin
-from .models import Filter, FilterSet, Instrument, InstrumentFilterSet
+from .models import Filter, FilterSet, Instrument, InstrumentFilterSet, LastCalibration
 
 # Register your models here
 admin.site.register(Filter)
 admin.site.register(FilterSet)
 admin.site.register(Instrument)
 #admin.site.register(InstrumentFilter)
-admin.site.register(InstrumentFilterSet)
\ No newline at end of file
+admin.site.register(InstrumentFilterSet)
+admin.site.register(LastCalibration)
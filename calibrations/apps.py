@@ -1,5 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class CalibrationsConfig(AppConfig):
     name = 'calibrations'
+
+    def ready(self):
+        from tom_targets.models import TargetExtra
+
+        from calibrations.seasons import target_extra_changed
+
+        # keep the TargetSeasonMonth index up to date with the seasonal_start and seasonal_end extras
+        post_save.connect(target_extra_changed, sender=TargetExtra, dispatch_uid='calibrations_target_season_save')
+        post_delete.connect(target_extra_changed, sender=TargetExtra, dispatch_uid='calibrations_target_season_delete')
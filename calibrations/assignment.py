@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from astropy import units as u
+from astropy.coordinates import AltAz, EarthLocation, SkyCoord, get_sun
+from astropy.time import Time
+from astropy.utils import iers
+from dateutil.relativedelta import relativedelta
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from tom_targets.models import Target
+
+from configdb.configdb_connections import get_configdb
+
+logger = logging.getLogger(__name__)
+
+MIN_ALTITUDE = 30.0  # degrees; airmass 2, the max_airmass of NRES calibrations
+NIGHT_SUN_ALTITUDE = -12.0  # degrees; nautical twilight
+
+
+def site_locations(site_codes: Iterable[str]) -> Dict[str, Tuple[float, float]]:
+    """The (latitude, longitude) of each of these sites that ConfigDB knows, longitude east-positive"""
+    site_codes = set(site_codes)
+    return {site['code']: (site['lat'], site['long']) for site in get_configdb().site_info
+            if site['code'] in site_codes}
+
+
+def observable_hours(locations: List[Tuple[float, float]], ras: np.ndarray, decs: np.ndarray, start: datetime,
+                     months: int, step_hours: float = 1.0) -> np.ndarray:
+    """
+    The number of hours each target is above MIN_ALTITUDE at night, at each site, between start and ``months``
+    months later: an array with a row for each (latitude, longitude) and a column for each target's RA and Dec.
+
+    The sky is sampled every ``step_hours``, for all the targets of a site at once.
+    """
+    steps = int((start + relativedelta(months=months) - start) / timedelta(hours=step_hours))
+    hours = np.zeros((len(locations), len(ras)))
+    # the cluster has no egress, so the bundled IERS-B table is used instead of downloading the latest IERS
+    # tables; past its end, UT1-UTC is taken as 0, which is far below the precision needed here
+    with iers.conf.set_temp('auto_download', False), iers.conf.set_temp('iers_degraded_accuracy', 'ignore'):
+        times = Time(start) + np.arange(steps) * step_hours * u.hour
+        sun = get_sun(times)
+        targets = SkyCoord(ra=ras * u.deg, dec=decs * u.deg)[:, None]  # (targets, 1), broadcast against the times
+        for row, (latitude, longitude) in enumerate(locations):
+            frame = AltAz(obstime=times, location=EarthLocation(lat=latitude * u.deg, lon=longitude * u.deg))
+            night = sun.transform_to(frame).alt < NIGHT_SUN_ALTITUDE * u.deg  # (times,)
+            up = targets.transform_to(frame).alt >= MIN_ALTITUDE * u.deg  # (targets, times)
+            hours[row] = (up & night).sum(axis=1) * step_hours
+    return hours
+
+
+def assign_targets(site_codes: List[str], target_ids: List[int], now: datetime, months: int,
+                   excluded: Optional[Dict[str, int]] = None,
+                   locations: Optional[Dict[str, Tuple[float, float]]] = None) -> Dict[str, int]:
+    """
+    Assign a different target to each site, maximizing the total hours the targets can be observed over the next
+    ``months`` months (see ``observable_hours``), and return the target id of each site.
+
+    ``excluded`` is a target that each site may not be assigned (e.g. the one it has just finished with). Sites
+    whose location ConfigDB doesn't know aren't assigned a target, nor are sites left over when there are fewer
+    targets than sites, nor sites that can't observe any of the targets left to them.
+    """
+    excluded = excluded or {}
+    locations = site_locations(site_codes) if locations is None else locations
+    for site in site_codes:
+        if site not in locations:
+            logger.warning(f'Site {site} was not found in ConfigDB, so it will not be assigned a target')
+    site_codes = [site for site in site_codes if site in locations]
+    if not site_codes or not target_ids:
+        return {}
+
+    coordinates = Target.objects.in_bulk(target_ids)
+    target_ids = [target_id for target_id in target_ids if target_id in coordinates]
+    ras = np.array([coordinates[target_id].ra for target_id in target_ids], dtype=float)
+    decs = np.array([coordinates[target_id].dec for target_id in target_ids], dtype=float)
+    scores = observable_hours([locations[site] for site in site_codes], ras, decs, now, months)
+    for row, site in enumerate(site_codes):
+        scores[row, [column for column, target_id in enumerate(target_ids) if target_id == excluded.get(site)]] = -1
+
+    rows, columns = linear_sum_assignment(scores, maximize=True)
+    assignments = {}
+    for row, column in zip(rows, columns):
+        if scores[row, column] <= 0:
+            logger.warning(f'Site {site_codes[row]} cannot observe any target it could be assigned')
+            continue
+        assignments[site_codes[row]] = target_ids[column]
+        logger.info(f'Assigned target {target_ids[column]} to site {site_codes[row]}: '
+                    f'{scores[row, column]:.0f} hours observable in the next {months} months')
+    return assignments
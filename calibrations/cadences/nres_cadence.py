@@ -5,6 +5,7 @@ import logging
 from crispy_forms.layout import Column, Div, HTML, Layout, Row
 from django import forms
 from django.conf import settings
+from django.db import DatabaseError, transaction
 
 from tom_observations.cadence import BaseCadenceForm
 from tom_observations.cadences.resume_cadence_after_failure import ResumeCadenceAfterFailureStrategy
@@ -12,6 +13,9 @@ from tom_observations.facility import get_service_class
 from tom_observations.models import ObservationRecord
 from tom_targets.models import Target
 
+from calibrations.extras import TargetExtrasCache
+from calibrations.status import update_observation_statuses
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
@@ -49,6 +53,11 @@ class NRESCadenceStrategy(ResumeCadenceAfterFailureStrategy):
                      the same cadence."""
     form = NRESCadenceForm
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # a CadenceRunner replaces this with the cache it shares between the cadences it runs
+        self.target_extras = TargetExtrasCache()
+
     def update_observation_payload(self, observation_payload):
         logger.log(msg='Updating observation_payload', level=logging.INFO)
         observation_payload['target_id'] = self.dynamic_cadence.cadence_parameters['target_id']
@@ -58,14 +67,20 @@ class NRESCadenceStrategy(ResumeCadenceAfterFailureStrategy):
         # gets the most recent observation because the next observation is just going to modify these parameters
         last_obs = self.dynamic_cadence.observation_group.observation_records.order_by('-created').first()
         target = Target.objects.get(pk=self.dynamic_cadence.cadence_parameters['target_id'])
+        extras = self.target_extras.get(target)
 
         logger.debug(f'NRESCadenceStrategy.run() last_obs: {last_obs}')
 
+        # If the observation hasn't finished, do nothing (before validating a form for the next one, which calls
+        # the observation portal)
+        if last_obs is not None and not last_obs.terminal:
+            return
+
         if last_obs is not None:
             # Make a call to the facility to get the current status of the observation
             facility = get_service_class(last_obs.facility)()
             form_class = facility.observation_forms['NRES']
-            standard_type = target.targetextra_set.filter(key='standard_type').first().value
+            standard_type = extras.standard_type
             site = self.dynamic_cadence.cadence_parameters['site']
 
             form_data = {
@@ -80,14 +95,13 @@ class NRESCadenceStrategy(ResumeCadenceAfterFailureStrategy):
                 'proposal': 'NRES standards',
                 'ipp_value': 1.0,
                 'filter': 'air',
-                'exposure_time': target.targetextra_set.filter(key='exp_time').first().value,
-                'exposure_count': target.targetextra_set.filter(key='exp_count').first().value,
+                'exposure_time': extras.exp_time,
+                'exposure_count': extras.exp_count,
                 'max_airmass': 2,
                 'start': datetime.now()
             }
-            min_lunar_distance = target.targetextra_set.filter(key='min_lunar_distance').first()
-            if min_lunar_distance is not None:
-                form_data['min_lunar_distance'] = min_lunar_distance.value
+            if extras.min_lunar_distance is not None:
+                form_data['min_lunar_distance'] = extras.min_lunar_distance
 
             # add the form_data to the form_class: form = form_class instanciated with form_data
             form = form_class(data=form_data)
@@ -112,10 +126,7 @@ class NRESCadenceStrategy(ResumeCadenceAfterFailureStrategy):
         start_keyword, end_keyword = facility.get_start_end_keywords()
 
         # Cadence logic
-        # If the observation hasn't finished, do nothing
-        if last_obs is not None and not last_obs.terminal:
-            return
-        elif last_obs is not None and last_obs.failed:  # If the observation failed
+        if last_obs is not None and last_obs.failed:  # If the observation failed
             # Submit next observation to be taken as soon as possible with the same window length
             window_length = parse(observation_payload[end_keyword]) - parse(observation_payload[start_keyword])
             observation_payload[start_keyword] = datetime.now().isoformat()
@@ -147,33 +158,41 @@ class NRESCadenceStrategy(ResumeCadenceAfterFailureStrategy):
                          }})
             raise Exception(f'Unable to submit next cadenced observation due form.errors: {form.errors.as_data()}')
 
-        # Creation of corresponding ObservationRecord objects for the observations
+        # Creation of corresponding ObservationRecord objects for the observations, committed as soon as they have
+        # been submitted, whatever happens next
         new_observations = []
-        for observation_id in observation_ids:
-            # Create Observation record
-            record = ObservationRecord.objects.create(
-                target=target,
-                facility=facility.name,
-                parameters=observation_payload,
-                observation_id=observation_id
-            )
-            # Add ObservationRecords to the DynamicCadence
-            self.dynamic_cadence.observation_group.observation_records.add(record)
-            self.dynamic_cadence.observation_group.save()
-            new_observations.append(record)
-
-        # Update the status of the ObservationRecords in the DB
-        for observation in new_observations:
-            logger.info(f'Updating new cadence observation status for {observation}',
-                        extra={'tags': {
-                            'dynamic_cadence_id': self.dynamic_cadence.id,
-                            'target': target.name,
-                            'observation_id': observation.observation_id,
-                        }})
-            try:
-                facility = get_service_class(observation.facility)()
-                facility.update_observation_status(observation.observation_id)
-            except Exception as e:
-                logger.error(msg=f'Unable to update observation status for {observation}. Error: {e}')
+        try:
+            with transaction.atomic():
+                for observation_id in observation_ids:
+                    # Create Observation record
+                    record = ObservationRecord.objects.create(
+                        target=target,
+                        facility=facility.name,
+                        parameters=observation_payload,
+                        observation_id=observation_id
+                    )
+                    # Add ObservationRecords to the DynamicCadence
+                    self.dynamic_cadence.observation_group.observation_records.add(record)
+                    self.dynamic_cadence.observation_group.save()
+                    new_observations.append(record)
+        except DatabaseError:
+            logger.error(f'Observations {observation_ids} were submitted for cadence {self.dynamic_cadence.id}, but '
+                         f'could not be recorded', extra={'tags': {'dynamic_cadence_id': self.dynamic_cadence.id,
+                                                                   'target': target.name}})
+            raise
+
+        # Update the status of the ObservationRecords in the DB, with as few portal requests as possible
+        logger.info(f'Updating the status of {len(new_observations)} new cadence observations',
+                    extra={'tags': {
+                        'dynamic_cadence_id': self.dynamic_cadence.id,
+                        'target': target.name,
+                        'observation_ids': [observation.observation_id for observation in new_observations],
+                    }})
+        try:
+            _, failed = update_observation_statuses(new_observations)
+        except Exception as e:
+            failed = [(observation.observation_id, str(e)) for observation in new_observations]
+        for observation_id, error in failed:
+            logger.error(msg=f'Unable to update observation status for {observation_id}. Error: {error}')
 
         return new_observations
@@ -0,0 +1,82 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from tom_observations.models import DynamicCadence
+
+from calibrations.models import Instrument
+
+
+class CadencePartition(object):
+    """
+    The slice of the network's cadences that one cadence runner owns, so that several runners can share the work.
+
+    A cadence belongs to the partition if its site is in ``sites``, its telescope class (e.g. '1m0') is
+    ``telescope_class`` and its id falls in shard ``shard`` of ``shard_count``; each criterion that isn't given
+    matches every cadence. The site and telescope of an NRES cadence come from its ``site`` cadence parameter and
+    settings.NRES_INSTRUMENT_TYPE; those of an imager cadence from the calibrations Instrument of its
+    ``instrument_code``.
+    """
+
+    def __init__(self, sites: Optional[Iterable[str]] = None, telescope_class: Optional[str] = None,
+                 shard: int = 0, shard_count: int = 1) -> None:
+        if not 0 <= shard < shard_count:
+            raise ValueError(f'Shard {shard} is not one of the {shard_count} shards')
+        self.sites = {site.lower() for site in sites} if sites else None
+        self.telescope_class = telescope_class.lower() if telescope_class else None
+        self.shard = shard
+        self.shard_count = shard_count
+        self._instruments: Optional[Dict[str, Tuple[str, str]]] = None
+
+    @classmethod
+    def from_options(cls, sites: Optional[str] = None, telescope_class: Optional[str] = None,
+                     shard: Optional[str] = None) -> 'CadencePartition':
+        """A partition from command-line options: a comma-separated site list, a telescope class and 'index/count'"""
+        shard_index, shard_count = 0, 1
+        if shard:
+            try:
+                shard_index, shard_count = (int(part) for part in shard.split('/'))
+            except ValueError:
+                raise ValueError(f'A shard is given as index/count, e.g. 0/3, not {shard}')
+        return cls(sites=[site for site in (sites or '').split(',') if site], telescope_class=telescope_class,
+                   shard=shard_index, shard_count=shard_count)
+
+    @property
+    def is_everything(self) -> bool:
+        return self.sites is None and self.telescope_class is None and self.shard_count == 1
+
+    def location(self, cadence: DynamicCadence) -> Tuple[Optional[str], Optional[str]]:
+        """The (site, telescope class) of a cadence, or None for what isn't known"""
+        parameters = cadence.cadence_parameters or {}
+        if 'instrument_code' in parameters:
+            if self._instruments is None:
+                self._instruments = {code: (site, telescope[:3]) for code, site, telescope in
+                                     Instrument.objects.values_list('code', 'site', 'telescope')}
+            return self._instruments.get(parameters['instrument_code'], (None, None))
+        if 'site' in parameters:
+            return parameters['site'], settings.NRES_INSTRUMENT_TYPE[:3]
+        return None, None
+
+    def matches(self, cadence: DynamicCadence) -> bool:
+        if self.shard_count > 1 and cadence.id % self.shard_count != self.shard:
+            return False
+        if self.sites is None and self.telescope_class is None:
+            return True
+        site, telescope_class = self.location(cadence)
+        if self.sites is not None and (site or '').lower() not in self.sites:
+            return False
+        return self.telescope_class is None or (telescope_class or '').lower() == self.telescope_class
+
+    def filter(self, cadences: Iterable[DynamicCadence]) -> List[DynamicCadence]:
+        return [cadence for cadence in cadences if self.matches(cadence)]
+
+    def __str__(self) -> str:
+        if self.is_everything:
+            return 'all cadences'
+        criteria = []
+        if self.sites is not None:
+            criteria.append(f'sites {",".join(sorted(self.sites))}')
+        if self.telescope_class is not None:
+            criteria.append(f'{self.telescope_class} telescopes')
+        if self.shard_count > 1:
+            criteria.append(f'shard {self.shard}/{self.shard_count}')
+        return ', '.join(criteria)
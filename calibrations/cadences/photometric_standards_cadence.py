@@ -4,16 +4,16 @@ import logging
 import traceback
 
 from django import forms
-from django.conf import settings
-import requests
+from django.db import DatabaseError, transaction
 from tom_observations.cadence import BaseCadenceForm
 from tom_observations.cadences.resume_cadence_after_failure import ResumeCadenceAfterFailureStrategy
 from tom_observations.facility import get_service_class
 from tom_observations.models import ObservationRecord
 from tom_targets.models import Target
 
-from configdb.configdb_connections import ConfigDBInterface
+from configdb.configdb_connections import get_configdb
 from calibrations.models import Filter, FilterSet, Instrument, InstrumentFilterSet
+from calibrations.status import update_observation_statuses
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -31,7 +31,10 @@ class PhotometricStandardsCadenceForm(BaseCadenceForm):
 class PhotometricStandardsCadenceStrategy(ResumeCadenceAfterFailureStrategy):
     name = 'Photometric Standards Cadence Strategy'
     form = PhotometricStandardsCadenceForm
-    config_db = ConfigDBInterface(settings.CONFIGDB_URL)
+
+    @property
+    def config_db(self):
+        return get_configdb()
 
     def update_observation_payload(self, observation_payload):
         logger.log(msg='Updating observation_payload', level=logging.INFO)
@@ -42,18 +45,20 @@ class PhotometricStandardsCadenceStrategy(ResumeCadenceAfterFailureStrategy):
         logger.info(msg='Updating observation_payload filters')
         instrument = Instrument.objects.get(code=self.dynamic_cadence.cadence_parameters['instrument_code'])
         #logger.info(msg=f'instrument : {instrument}')
+        instrument_filters = instrument.instrumentfilter_set.with_last_calibration_age(
+            observation_group=self.dynamic_cadence.observation_group)
+        logger.info(msg=f'instrumentfilter_set : {instrument_filters}')
         filter_dates = []
-        logger.info(msg=f'instrumentfilter_set : {instrument.instrumentfilter_set.all()}')
-        for inst_filter in instrument.instrumentfilter_set.all():
+        for inst_filter in instrument_filters:
             logger.info(msg=f'inst_filter : {inst_filter}')
-            filter_dates.append([inst_filter, inst_filter.get_last_calibration_age(self.dynamic_cadence.observation_group)])  # TODO: explore an annotation instead
-        
+            filter_dates.append([inst_filter, inst_filter.last_calibration_age])
+
         # float('inf') returns infinity, thus guaranteeing that filters with calibration age of None will be considered
         # as the oldest calibrations
         filter_dates.sort(key=lambda filters: filters[1] if filters[1] is not None else float('inf'), reverse=True)
         filters_by_calib_age = filter_dates[:3]  # change the name of "new filters" to "filter_by_age"
 
-        for inst_filter in instrument.instrumentfilter_set.all():
+        for inst_filter in instrument_filters:
             observation_payload[f'{inst_filter.filter.name}_selected'] = False
 
         for f in filters_by_calib_age:
@@ -66,12 +71,14 @@ class PhotometricStandardsCadenceStrategy(ResumeCadenceAfterFailureStrategy):
         instrument = Instrument.objects.get(code=self.dynamic_cadence.cadence_parameters['instrument_code'])
         #logger.info(msg=f'instrument : {instrument}')
 
-        filterset_dates = [] 
-        logger.info(msg=f'instrumentfilterset_set : {instrument.instrumentfilterset_set.all()}')
-        for filter_set in instrument.instrumentfilterset_set.all(): # iterate through all filtersets on this instrument
+        instrument_filter_sets = instrument.instrumentfilterset_set.with_last_calibration_age(
+            observation_group=self.dynamic_cadence.observation_group)
+        logger.info(msg=f'instrumentfilterset_set : {instrument_filter_sets}')
+        filterset_dates = []
+        for filter_set in instrument_filter_sets:  # iterate through all filtersets on this instrument
             logger.info(msg=f'filter_set : {filter_set}')
-            filterset_dates.append((filter_set, filter_set.get_last_instrumentfilterset_age(self.dynamic_cadence.observation_group)))  
-            # Above: each element in the filterset_dates list is a tuple with element 1 = filterset, element 2 = age determined by get_last_instrumentfilterset_age
+            filterset_dates.append((filter_set, filter_set.last_calibration_age))
+            # Above: each element in the filterset_dates list is a tuple with element 1 = filterset, element 2 = age determined by with_last_calibration_age
 
         filterset_dates.sort(key=lambda filterset: filterset[1] if filterset[1] is not None else float('inf'), reverse=True) # sorts by age
         # Above: float('inf') returns infinity, thus guaranteeing that filters with calibration age of None will be considered the oldest calibrations
@@ -79,7 +86,7 @@ class PhotometricStandardsCadenceStrategy(ResumeCadenceAfterFailureStrategy):
         oldest_instrumentfilterset, age = filterset_dates[0]  # select only the oldest filterset
         #logger.info(f'oldest_instrumentfilterset : {oldest_instrumentfilterset} is {age} days old.')
 
-        for instrument_filter_set in instrument.instrumentfilterset_set.all(): # iterate through all filtersets on this instrument
+        for instrument_filter_set in instrument_filter_sets: # iterate through all filtersets on this instrument
             
             for filter in instrument_filter_set.filter_set.filter_combination.all():
                 observation_payload[f'{filter.name}_selected'] = False # De-select each filter in each instrument_filter_set
@@ -99,23 +106,27 @@ class PhotometricStandardsCadenceStrategy(ResumeCadenceAfterFailureStrategy):
         if last_obs is not None:
 
             # Make sure the observation status hasn't changed at the facility since the last time we checked
+            # (observations that are already in a terminal state aren't looked up again)
             facility = get_service_class(last_obs.facility)()
             try:
-                facility.update_observation_status(last_obs.observation_id)
-            except requests.exceptions.HTTPError as e:
+                _, failed = update_observation_statuses([last_obs])
+            except Exception as e:
+                failed = [(last_obs.observation_id, f'{type(e)} {e}')]
+                logger.warning(traceback.format_exc())
+            for observation_id, error in failed:
                 # We didn't find an observation with the given observation_id at the facility.
                 # This is proably a new cadence for a new instrument with a placeholder observation_id
                 # So, just log the warning and continue.
-                logger.warning(f'Could not find Observation with id:  {last_obs.observation_id}')
-                logger.warning(f'Error updating observation status for {last_obs}: {type(e)} {e}')
+                logger.warning(f'Could not find Observation with id:  {observation_id}')
+                logger.warning(f'Error updating observation status for {last_obs}: {error}')
                 logger.warning(f'Continuing with most recent observation values from {last_obs.modified}')
-            except Exception as e:
-                logger.warning(f'Error updating observation status for {last_obs}: {type(e)} {e}')
-                logger.warning(traceback.format_exc())
-                logger.warning(f'Coninuing with most recent observation values from {last_obs.modified}')
 
             last_obs.refresh_from_db()
 
+            if not last_obs.terminal:
+                # If the observation hasn't finished, do nothing
+                return
+
             observation_payload = last_obs.parameters  # copy the parameters from the previous observation
 
             # These boilerplate values have changed since initial observations were submitted, so we hardcode new ones
@@ -207,11 +218,8 @@ class PhotometricStandardsCadenceStrategy(ResumeCadenceAfterFailureStrategy):
                                     })
                 raise forms.ValidationError(f'Unable to submit initial calibration for cadence {self.dynamic_cadence}')
 
-        # Cadence logic
-        if last_obs is not None and not last_obs.terminal:
-            # If the observation hasn't finished, do nothing
-            return
-        elif last_obs is not None and last_obs.failed:
+        # Cadence logic (the observation has finished, if there is one)
+        if last_obs is not None and last_obs.failed:
             # If the observation failed,
             # then Submit next observation to be taken as soon as possible with the same window length
             window_length = parse(observation_payload[end_keyword]) - parse(observation_payload[start_keyword])
@@ -258,33 +266,41 @@ class PhotometricStandardsCadenceStrategy(ResumeCadenceAfterFailureStrategy):
                          }})
             raise Exception(f'Unable to submit next cadenced observation: {form.errors.as_data()}')
 
-        # Creation of corresponding ObservationRecord objects for the observations
+        # Creation of corresponding ObservationRecord objects for the observations, committed as soon as they have
+        # been submitted, whatever happens next
         new_observations = []
-        for observation_id in observation_ids:
-            # Create Observation record
-            record = ObservationRecord.objects.create(
-                target=target,
-                facility=facility.name,
-                parameters=observation_payload,
-                observation_id=observation_id
-            )
-            # Add ObservationRecords to the DynamicCadence
-            self.dynamic_cadence.observation_group.observation_records.add(record)
-            self.dynamic_cadence.observation_group.save()
-            new_observations.append(record)
-
-        # Update the status of the ObservationRecords in the DB
-        for observation in new_observations:
-            logger.info(f'Updating new cadence observation status for {observation}',
-                        extra={'tags': {
-                            'dynamic_cadence_id': self.dynamic_cadence.id,
-                            'target': target.name,
-                            'observation_id': observation.observation_id,
-                        }})
-            try:
-                facility = get_service_class(observation.facility)()#(facility_settings=OCSSettings('LCO'))
-                facility.update_observation_status(observation.observation_id)
-            except Exception as e:
-                logger.error(msg=f'Unable to update observation status for {observation}. Error: {e}')
+        try:
+            with transaction.atomic():
+                for observation_id in observation_ids:
+                    # Create Observation record
+                    record = ObservationRecord.objects.create(
+                        target=target,
+                        facility=facility.name,
+                        parameters=observation_payload,
+                        observation_id=observation_id
+                    )
+                    # Add ObservationRecords to the DynamicCadence
+                    self.dynamic_cadence.observation_group.observation_records.add(record)
+                    self.dynamic_cadence.observation_group.save()
+                    new_observations.append(record)
+        except DatabaseError:
+            logger.error(f'Observations {observation_ids} were submitted for cadence {self.dynamic_cadence.id}, but '
+                         f'could not be recorded', extra={'tags': {'dynamic_cadence_id': self.dynamic_cadence.id,
+                                                                   'target': target.name}})
+            raise
+
+        # Update the status of the ObservationRecords in the DB, with as few portal requests as possible
+        logger.info(f'Updating the status of {len(new_observations)} new cadence observations',
+                    extra={'tags': {
+                        'dynamic_cadence_id': self.dynamic_cadence.id,
+                        'target': target.name,
+                        'observation_ids': [observation.observation_id for observation in new_observations],
+                    }})
+        try:
+            _, failed = update_observation_statuses(new_observations)
+        except Exception as e:
+            failed = [(observation.observation_id, str(e)) for observation in new_observations]
+        for observation_id, error in failed:
+            logger.error(msg=f'Unable to update observation status for {observation_id}. Error: {error}')
 
         return new_observations
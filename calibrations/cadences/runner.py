@@ -0,0 +1,257 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import chain, zip_longest
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import uuid
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from tom_observations.cadence import get_cadence_strategy
+from tom_observations.facility import get_service_class
+from tom_observations.models import DynamicCadence, ObservationRecord
+
+from calibrations.cadences.partition import CadencePartition
+from calibrations.extras import TargetExtrasCache
+from calibrations.models import CadenceLease
+from calibrations.status import update_observation_statuses
+
+logger = logging.getLogger(__name__)
+
+
+class CadenceRunResult(object):
+    """
+    The outcome of running one DynamicCadence: 'updated', 'unchanged', 'failed', 'idle' if it wasn't due, or
+    'claimed' if another runner was already running it
+    """
+
+    def __init__(self, cadence: DynamicCadence, facility: str) -> None:
+        self.cadence = cadence
+        self.facility = facility
+        self.status = 'unchanged'
+        self.new_observations = 0
+        self.error: Optional[str] = None
+        self.duration = 0.0
+
+    def __str__(self) -> str:
+        outcome = f'{self.new_observations} new observations' if self.status == 'updated' else self.status
+        if self.error:
+            outcome += f': {self.error}'
+        return f'{self.cadence.id:>5} {self.cadence.cadence_strategy:<40} {self.facility:<25} ' \
+               f'{self.duration:7.2f}s {outcome}'
+
+
+class CadenceRunner(object):
+    """
+    Runs the strategies of DynamicCadences concurrently, on a pool of ``max_workers`` threads.
+
+    Each cadence talks to the facility of its most recent observation (or, without one, is counted against its
+    cadence strategy), and no more than ``facility_limits[facility]`` cadences (``default_facility_limit`` for
+    facilities that aren't listed) run against a facility at once. A cadence that fails is logged and reported in
+    its result; it doesn't stop the others.
+
+    Cadences whose last observation is still pending aren't due, and are skipped without running their strategy
+    (see ``due_cadences``).
+
+    Several runners can share the cadences: each only runs those in its ``partition``, and takes a CadenceLease on
+    the cadences it is about to run, so a cadence that another runner is running is skipped instead of being
+    submitted twice. The leases are taken and given back in short transactions of their own; no transaction is held
+    open while a strategy submits observations.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, facility_limits: Optional[Dict[str, int]] = None,
+                 default_facility_limit: Optional[int] = None, partition: Optional[CadencePartition] = None) -> None:
+        self.max_workers = max_workers or settings.CADENCE_RUNNER_WORKERS
+        self.facility_limits = settings.CADENCE_RUNNER_FACILITY_LIMITS if facility_limits is None \
+            else facility_limits
+        self.default_facility_limit = default_facility_limit or settings.CADENCE_RUNNER_FACILITY_DEFAULT_LIMIT
+        self.partition = partition or CadencePartition()
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._terminal_states: Dict[str, List[str]] = {}
+        self.target_extras = TargetExtrasCache()
+        self.results: List[CadenceRunResult] = []
+        self.runner_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+    def _semaphore(self, facility: str) -> threading.BoundedSemaphore:
+        if facility not in self._semaphores:
+            self._semaphores[facility] = threading.BoundedSemaphore(
+                self.facility_limits.get(facility, self.default_facility_limit))
+        return self._semaphores[facility]
+
+    @staticmethod
+    def active_cadences() -> Iterable[DynamicCadence]:
+        """
+        The active DynamicCadences, each annotated with the ``facility``, ``last_record_id``, ``last_status``,
+        ``last_created``, ``last_scheduled_end`` and ``last_modified`` of its most recent observation
+        """
+        last_records = ObservationRecord.objects.filter(observationgroup=OuterRef('observation_group')) \
+            .order_by('-created')
+        return DynamicCadence.objects.filter(active=True).annotate(
+            facility=Subquery(last_records.values('facility')[:1]),
+            last_record_id=Subquery(last_records.values('id')[:1]),
+            last_status=Subquery(last_records.values('status')[:1]),
+            last_created=Subquery(last_records.values('created')[:1]),
+            last_scheduled_end=Subquery(last_records.values('scheduled_end')[:1]),
+            last_modified=Subquery(last_records.values('modified')[:1]),
+        ).order_by('id')
+
+    def is_due(self, cadence: DynamicCadence) -> bool:
+        """
+        Whether a cadence annotated by ``active_cadences`` needs its strategy to run: both strategies only submit
+        a new observation once the last one is over, so a cadence is due if it has no observation yet or its last
+        one is in a terminal state. Cadences that aren't annotated are always due.
+        """
+        if getattr(cadence, 'last_record_id', None) is None:
+            return True
+        if cadence.facility not in self._terminal_states:
+            self._terminal_states[cadence.facility] = \
+                get_service_class(cadence.facility)().get_terminal_observing_states()
+        return cadence.last_status in self._terminal_states[cadence.facility]
+
+    def due_cadences(self, cadences: Iterable[DynamicCadence]) -> Tuple[List[DynamicCadence], List[DynamicCadence]]:
+        """
+        Split annotated cadences into those that are due and those that are idle.
+
+        The last observations that aren't terminal yet are first brought up to date, all at once, with
+        ``update_observation_statuses``, so that only the cadences whose observations are really still pending at
+        the facility are skipped.
+        """
+        cadences = list(cadences)
+        pending = {cadence.last_record_id: cadence for cadence in cadences if not self.is_due(cadence)}
+        if pending:
+            try:
+                update_observation_statuses(ObservationRecord.objects.filter(id__in=pending.keys()))
+            except Exception as e:
+                logger.error(f'Unable to update the status of the last observation of {len(pending)} cadences: {e}')
+            for record_id, status in ObservationRecord.objects.filter(id__in=pending.keys()).values_list('id',
+                                                                                                         'status'):
+                pending[record_id].last_status = status
+
+        due = [cadence for cadence in cadences if self.is_due(cadence)]
+        idle = [cadence for cadence in cadences if not self.is_due(cadence)]
+        return due, idle
+
+    def run(self, cadences: Optional[Iterable[DynamicCadence]] = None,
+            skip_idle: bool = True) -> List[CadenceRunResult]:
+        """
+        Run each cadence in the partition (by default, every active one) and return their results, in the order
+        given. With ``skip_idle``, the cadences that aren't due (see ``due_cadences``) are reported as 'idle'
+        instead of being run.
+        """
+        if cadences is None:
+            cadences = self.active_cadences()
+        cadences = self.partition.filter(cadences)
+        idle_ids = {cadence.id for cadence in self.due_cadences(cadences)[1]} if skip_idle else set()
+
+        results = [CadenceRunResult(cadence, getattr(cadence, 'facility', None) or cadence.cadence_strategy)
+                   for cadence in cadences]
+        for result in results:
+            if result.cadence.id in idle_ids:
+                result.status = 'idle'
+        leased_ids = self._claim([result.cadence for result in results if result.status != 'idle'])
+        for result in results:
+            if result.status != 'idle' and result.cadence.id not in leased_ids:
+                result.status = 'claimed'
+                logger.info(f'Dynamic cadence {result.cadence} is being run by another runner')
+        to_run = [result for result in results if result.cadence.id in leased_ids]
+        try:
+            self._run_all(to_run)
+        finally:
+            self._release()
+        self.results = results
+        return results
+
+    def _run_all(self, to_run: List[CadenceRunResult]) -> None:
+        """Run the strategies of these (leased) cadences on the thread pool"""
+        # load the extras of every target the cadences observe at once, for the strategies to share
+        self.target_extras = TargetExtrasCache(result.cadence.cadence_parameters['target_id'] for result in to_run
+                                               if (result.cadence.cadence_parameters or {}).get('target_id'))
+
+        # create the semaphores before any thread needs one, then interleave the facilities, so the pool's threads
+        # aren't all waiting on the same facility while there is work for another one
+        by_facility: Dict[str, List[CadenceRunResult]] = {}
+        for result in to_run:
+            self._semaphore(result.facility)
+            by_facility.setdefault(result.facility, []).append(result)
+        interleaved = [result for result in chain.from_iterable(zip_longest(*by_facility.values())) if result]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(self._run_cadence, interleaved))
+
+    def _run_cadence(self, result: CadenceRunResult) -> None:
+        cadence = result.cadence
+        start = time.perf_counter()
+        try:
+            # the strategy saves the observations it submits in transactions of its own, as soon as it has
+            # submitted them, so nothing it submitted is rolled back if it fails afterwards
+            with self._semaphore(result.facility):
+                strategy = get_cadence_strategy(cadence.cadence_strategy)(cadence)
+                if hasattr(strategy, 'target_extras'):
+                    strategy.target_extras = self.target_extras
+                new_observations = strategy.run()
+            if new_observations:
+                result.status = 'updated'
+                result.new_observations = len(new_observations)
+                logger.info(f'Cadence update completed for dynamic cadence {cadence}, '
+                            f'{len(new_observations)} new observations created.')
+            else:
+                logger.info(f'No changes from dynamic cadence {cadence}')
+        except Exception as e:
+            self._failed(result, e)
+        finally:
+            result.duration = time.perf_counter() - start
+            # each worker thread has its own database connections; don't leave them open when the pool exits
+            connections.close_all()
+
+    def _claim(self, cadences: List[DynamicCadence]) -> Set[int]:
+        """
+        Take a lease on each of these cadences that no other runner holds an unexpired lease on, and return the ids
+        of the cadences leased. Two runners claiming the same cadences at once can't both lease one: only one of
+        their inserts of its CadenceLease succeeds.
+        """
+        cadence_ids = [cadence.id for cadence in cadences]
+        if not cadence_ids:
+            return set()
+        now = timezone.now()
+        with transaction.atomic():
+            CadenceLease.objects.filter(cadence_id__in=cadence_ids, expires__lte=now).delete()
+            CadenceLease.objects.bulk_create(
+                [CadenceLease(cadence_id=cadence_id, runner=self.runner_id,
+                              expires=now + timedelta(seconds=settings.CADENCE_RUNNER_LEASE_TIMEOUT))
+                 for cadence_id in cadence_ids],
+                ignore_conflicts=True)
+        return set(CadenceLease.objects.filter(cadence_id__in=cadence_ids, runner=self.runner_id)
+                   .values_list('cadence_id', flat=True))
+
+    def _release(self) -> None:
+        """Give back the leases of this runner"""
+        try:
+            CadenceLease.objects.filter(runner=self.runner_id).delete()
+        except Exception as e:
+            logger.error(f'Unable to release the cadence leases of {self.runner_id}, which will expire instead: {e}')
+
+    @staticmethod
+    def _failed(result: CadenceRunResult, error: Exception) -> None:
+        result.status = 'failed'
+        result.error = f'{type(error).__name__}: {error}'
+        logger.error(f'Unable to run dynamic cadence {result.cadence} with id {result.cadence.id} '
+                     f'due to error: {error}')
+        logger.error(traceback.format_exc())
+
+    def summary(self) -> str:
+        counts = {status: sum(1 for result in self.results if result.status == status)
+                  for status in ('updated', 'unchanged', 'failed', 'idle', 'claimed')}
+        lines = [f'Partition: {self.partition}'] + [str(result) for result in self.results]
+        totals = f'{len(self.results)} cadences: {counts["updated"]} updated, {counts["unchanged"]} unchanged, ' \
+                 f'{counts["failed"]} failed, {counts["idle"]} idle'
+        if counts['claimed']:
+            totals += f', {counts["claimed"]} claimed by another runner'
+        lines.append(totals)
+        return '\n'.join(lines)
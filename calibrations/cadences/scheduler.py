@@ -0,0 +1,148 @@
+from datetime import datetime, timedelta, timezone
+import heapq
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Max
+from tom_observations.models import DynamicCadence, ObservationRecord
+
+from calibrations.cadences.runner import CadenceRunner
+
+logger = logging.getLogger(__name__)
+
+
+class CadenceScheduler(object):
+    """
+    Runs each active DynamicCadence when it is next due, instead of polling them all from a CronJob.
+
+    A priority queue holds the next due time of every active cadence (see ``next_due_time``). The scheduler sleeps
+    until the earliest one, runs the cadences that are due with a ``CadenceRunner``, and rebuilds the queue. While
+    it sleeps, it checks every ``wake_interval`` seconds whether the last ObservationRecord of a queued cadence, or
+    any DynamicCadence, has been modified since the queue was built: observations change state in other processes
+    (updatestatus, the web server), so that is how an observation that has just completed wakes the scheduler up
+    early.
+    """
+
+    def __init__(self, runner: Optional[CadenceRunner] = None, poll_interval: Optional[float] = None,
+                 wake_interval: Optional[float] = None, sleep: Callable[[float], None] = time.sleep,
+                 now: Callable[[], datetime] = lambda: datetime.now(timezone.utc)) -> None:
+        self.runner = runner or CadenceRunner()
+        self.poll_interval = timedelta(seconds=poll_interval or settings.CADENCE_SCHEDULER_POLL_INTERVAL)
+        self.wake_interval = wake_interval or settings.CADENCE_SCHEDULER_WAKE_INTERVAL
+        self.sleep = sleep
+        self.now = now
+        self.queue: List[Tuple[datetime, int]] = []
+        self._watermark = None
+        self._watched_record_ids: List[int] = []
+        self._last_run: Dict[int, tuple] = {}  # cadence id -> (when it last ran, its last observation's id and status)
+
+    def next_due_time(self, cadence: DynamicCadence, now: datetime) -> datetime:
+        """
+        When a cadence annotated by ``CadenceRunner.active_cadences`` is next due.
+
+        A cadence with no observation, or whose last observation is over, is due now. Otherwise its last
+        observation can't finish later than the end of its window (its scheduled_end, or ``cadence_frequency``
+        hours after it was created if it hasn't been scheduled), so the cadence is due then. Its status is checked
+        at least every ``poll_interval`` in case the observation finishes early without waking the scheduler.
+
+        A cadence that was run and whose last observation hasn't changed since (e.g. because its strategy failed)
+        isn't due again until ``poll_interval`` after that run.
+        """
+        if self.runner.is_due(cadence):
+            due = now
+        else:
+            window_end = cadence.last_scheduled_end
+            if window_end is None and cadence.last_created is not None:
+                window_end = cadence.last_created + timedelta(hours=float(
+                    cadence.cadence_parameters.get('cadence_frequency') or 0))
+            if window_end is None:
+                due = now + self.poll_interval
+            else:
+                due = max(now, min(window_end, now + self.poll_interval))
+
+        last_run = self._last_run.get(cadence.id)
+        if last_run is not None and last_run[1:] == (cadence.last_record_id, cadence.last_status):
+            due = max(due, last_run[0] + self.poll_interval)
+        return due
+
+    def watermark(self) -> tuple:
+        """
+        Changes whenever the last ObservationRecord of a queued cadence, or any DynamicCadence, is saved.
+
+        Only those ObservationRecords are read, by primary key: ``modified`` isn't indexed, so the latest one of the
+        whole table would be a scan of its largest table every ``wake_interval``.
+        """
+        records_modified = None
+        if self._watched_record_ids:
+            records_modified = ObservationRecord.objects.filter(id__in=self._watched_record_ids) \
+                .aggregate(modified=Max('modified'))['modified']
+        return records_modified, self._cadences_modified()
+
+    @staticmethod
+    def _cadences_modified() -> Optional[datetime]:
+        return DynamicCadence.objects.aggregate(modified=Max('modified'))['modified']
+
+    def build_queue(self) -> List[DynamicCadence]:
+        """Rebuild the priority queue of next due times; returns the active cadences, keyed into it by id"""
+        now = self.now()
+        cadences_modified = self._cadences_modified()  # read first, so that a change while the queue is built wakes
+        cadences = self.runner.partition.filter(self.runner.active_cadences())
+        self.queue = [(self.next_due_time(cadence, now), cadence.id) for cadence in cadences]
+        heapq.heapify(self.queue)
+        # the watermark the last observations are compared with is the one they were read with
+        self._watched_record_ids = [cadence.last_record_id for cadence in cadences
+                                    if cadence.last_record_id is not None]
+        self._watermark = (max((cadence.last_modified for cadence in cadences if cadence.last_record_id is not None),
+                               default=None), cadences_modified)
+        return cadences
+
+    def run_due(self) -> int:
+        """Run the cadences that are due now; returns how many were run"""
+        cadences = {cadence.id: cadence for cadence in self.build_queue()}
+        now = self.now()
+        due = []
+        while self.queue and self.queue[0][0] <= now:
+            _, cadence_id = heapq.heappop(self.queue)
+            due.append(cadences[cadence_id])
+        if due:
+            self.runner.run(due)
+            logger.info(self.runner.summary())
+            for cadence in due:
+                self._last_run[cadence.id] = (now, cadence.last_record_id, cadence.last_status)
+            self.build_queue()
+        return len(due)
+
+    def seconds_until_next(self) -> float:
+        if not self.queue:
+            return self.poll_interval.total_seconds()
+        return max(0.0, (self.queue[0][0] - self.now()).total_seconds())
+
+    def wait(self) -> bool:
+        """
+        Sleep until the earliest next due time, or until something changes. Returns whether the scheduler was
+        woken early.
+        """
+        remaining = self.seconds_until_next()
+        while remaining > 0:
+            step = min(self.wake_interval, remaining)
+            self.sleep(step)
+            remaining -= step
+            if self.watermark() != self._watermark:
+                logger.info('Woken up by a change to an observation or cadence')
+                return True
+        return False
+
+    def run_forever(self, max_cycles: Optional[int] = None) -> None:
+        cycles = 0
+        while max_cycles is None or cycles < max_cycles:
+            close_old_connections()  # this process lives much longer than the database connection may
+            try:
+                self.run_due()
+            except Exception as e:
+                logger.exception(f'Cadence scheduler cycle failed: {e}')
+            cycles += 1
+            if max_cycles is None or cycles < max_cycles:
+                self.wait()
@@ -0,0 +1,93 @@
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Union
+
+from dateutil.parser import parse
+from tom_targets.models import Target, TargetExtra
+
+# the type of each of settings.EXTRA_FIELDS that the calibration code reads
+EXTRA_FIELD_TYPES = {
+    'seasonal_start': int,  # month number
+    'seasonal_end': int,  # month number
+    'exp_time': float,
+    'exp_count': int,
+    'observing_frequency': float,
+    'observing_period': float,
+    'nres_active_target': bool,
+    'cadence_expiration_date': datetime,
+    'expected_rv': float,
+    'standard_type': str,
+    'min_lunar_distance': float,
+    'calibration_type': str,
+}
+
+
+def _convert(value: str, value_type: type):
+    if value_type is bool:
+        return value.strip().lower() in ('true', '1', 'yes')
+    if value_type is int:
+        return int(float(value))  # extras saved from number fields look like '4.0'
+    if value_type is datetime:
+        return parse(value)
+    return value_type(value)
+
+
+class TargetExtras(object):
+    """
+    The TargetExtras of one target, as typed attributes: ``extras.seasonal_start`` is an int, ``extras.exp_time`` a
+    float, and so on (see EXTRA_FIELD_TYPES). An extra the target doesn't have is None.
+    """
+
+    def __init__(self, values: Dict[str, str]) -> None:
+        self._values = values
+
+    def __getattr__(self, key: str):
+        if key not in EXTRA_FIELD_TYPES:
+            raise AttributeError(f'{key} is not a calibration target extra')
+        return self.get(key)
+
+    def get(self, key: str, default=None):
+        value = self._values.get(key)
+        if value is None or value in ('', 'None'):
+            return default
+        return _convert(value, EXTRA_FIELD_TYPES.get(key, str))
+
+    @classmethod
+    def for_target(cls, target: Union[Target, int]) -> 'TargetExtras':
+        """The extras of a single target, with one query"""
+        return TargetExtrasCache().get(target)
+
+
+class TargetExtrasCache(object):
+    """
+    The TargetExtras of many targets, loaded with one query per ``load`` and kept for the life of the cache: create
+    one for a request or a cadence run, and look every target's extras up in it.
+    """
+
+    def __init__(self, targets: Optional[Iterable[Union[Target, int]]] = None) -> None:
+        self._extras: Dict[int, TargetExtras] = {}
+        if targets is not None:
+            self.load(targets)
+
+    @staticmethod
+    def _target_id(target: Union[Target, int]) -> int:
+        return target.pk if isinstance(target, Target) else int(target)
+
+    def load(self, targets: Iterable[Union[Target, int]]) -> None:
+        """Load the extras of the targets that haven't been loaded yet"""
+        target_ids = {self._target_id(target) for target in targets} - self._extras.keys()
+        if not target_ids:
+            return
+        values = {target_id: {} for target_id in target_ids}
+        for target_id, key, value in TargetExtra.objects.filter(target_id__in=target_ids) \
+                .values_list('target_id', 'key', 'value'):
+            values[target_id][key] = value
+        self._extras.update({target_id: TargetExtras(target_values) for target_id, target_values in values.items()})
+
+    def get(self, target: Union[Target, int]) -> TargetExtras:
+        target_id = self._target_id(target)
+        if target_id not in self._extras:
+            self.load([target_id])
+        return self._extras[target_id]
+
+    def __getitem__(self, target: Union[Target, int]) -> TargetExtras:
+        return self.get(target)
@@ -8,12 +8,14 @@ from tom_observations.facilities.lco import LCOOldStyleObservationForm, LCOFacil
 from tom_targets.models import Target
 
 import configdb.site
+from calibrations.extras import TargetExtras
+from calibrations.portal import PortalMetadataFormMixin
 
 logger = logging.getLogger(__name__)
 logger.level = logging.DEBUG
 
 
-class LCOCalibrationForm(LCOOldStyleObservationForm):
+class LCOCalibrationForm(PortalMetadataFormMixin, LCOOldStyleObservationForm):
     # TODO: make a proper super-class out of this LCOCalibrationForm
 
     VALID_INSTRUMENT_CODES = ['1M0-NRES-SCICAM']  # TODO: Should this be in settings.py?
@@ -40,17 +42,15 @@ class LCOCalibrationForm(LCOOldStyleObservationForm):
         self.fields['cadence_frequency'] = forms.IntegerField(required=False, help_text='in hours', initial=120)
         self.fields['ipp_value'].initial = 1.05
 
-        exposure_time = target.targetextra_set.filter(key='exp_time').first()
-        if exposure_time:
-            self.fields['exposure_time'].initial = exposure_time.value
+        extras = TargetExtras.for_target(target)
+        if extras.exp_time:
+            self.fields['exposure_time'].initial = extras.exp_time
 
-        exposure_count = target.targetextra_set.filter(key='exp_count').first()
-        if exposure_count:
-            self.fields['exposure_count'].initial = exposure_count.value
+        if extras.exp_count:
+            self.fields['exposure_count'].initial = extras.exp_count
 
-        min_lunar_distance = target.targetextra_set.filter(key='min_lunar_distance').first()
-        if min_lunar_distance is not None:
-            self.fields['min_lunar_distance'].initial = min_lunar_distance.value
+        if extras.min_lunar_distance is not None:
+            self.fields['min_lunar_distance'].initial = extras.min_lunar_distance
 
         self.fields['max_airmass'].initial = 2
         self.fields['start'].initial = datetime.now()
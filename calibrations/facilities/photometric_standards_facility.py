@@ -3,15 +3,15 @@ import logging
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import ButtonHolder, Column, HTML, Layout, Row, Submit
 from django import forms
-from django.conf import settings
 from tom_observations.facilities.lco import (LCOFacility, LCOSettings,
                                              LCOFullObservationForm)
 
 from tom_targets.models import Target
 
-from configdb.configdb_connections import ConfigDBInterface
+from configdb.configdb_connections import get_configdb
 from calibrations.fields import FilterMultiValueField
 from calibrations.models import Filter
+from calibrations.portal import PortalMetadataFormMixin
 
 logger = logging.getLogger(__name__)
 
@@ -26,12 +26,11 @@ def enum_to_choices(emum_class) -> [()]:
 # TODO: according to doc, photometric standards window is open at a certain time
 #  --should this be pre-filled into the form?
 
-class PhotometricStandardsManualSubmissionForm(LCOFullObservationForm):
+class PhotometricStandardsManualSubmissionForm(PortalMetadataFormMixin, LCOFullObservationForm):
     """Form for submission of photometric standards to imagers.
 
     This is loosely based on the options to the calibration_util submit_calibration script.
     """
-    config_db = ConfigDBInterface(settings.CONFIGDB_URL)
     # set up the self.fields dict of form.xFields; dict key is property name (i.e. 'target_id')
     site = forms.ChoiceField(required=True,
                             #  choices=enum_to_choices(SiteCode),
@@ -43,6 +42,10 @@ class PhotometricStandardsManualSubmissionForm(LCOFullObservationForm):
 
     instrument = forms.ChoiceField(choices=[])  # TODO: populate instrument choices from telescope choice
 
+    @property
+    def config_db(self):
+        return get_configdb()
+
     narrowbands = forms.ChoiceField(
         label='Force narrowbands in', required=False,
         choices=[(True, 'True'), (False, 'False')], initial=False)
@@ -0,0 +1,59 @@
+from datetime import datetime, timezone
+from typing import Optional
+
+from django.core.cache import cache
+
+from calibrations.models import Instrument, InstrumentFilter
+
+HEATMAP_CACHE_KEY = 'calibration_age_heatmap'
+# ages are in whole days, so an hour-old heatmap is at most one day off even if nothing invalidates it
+HEATMAP_CACHE_TIMEOUT = 60 * 60
+
+
+def build_heatmap(as_of: Optional[datetime] = None) -> dict:
+    """
+    The calibration age of every filter on every instrument in the network, as one JSON-serializable document:
+
+        {'generated': '2024-06-30T00:00:00+00:00',
+         'sites': {'cpt': {'instruments': ['fa14', 'fa16'],
+                           'filters': ['B', 'U'],
+                           'ages': [[10, ''], [3, None]]}}}
+
+    ``ages`` has a row for each filter and a column for each instrument at the site. A cell is the age in days of
+    the filter's last calibration on the instrument, None if it was never calibrated, or '' if the instrument
+    doesn't have the filter. The whole network is read with three queries.
+    """
+    as_of = as_of or datetime.now(timezone.utc)
+
+    sites = {}
+    for site, code in Instrument.objects.order_by('site', 'id').values_list('site', 'code'):
+        sites.setdefault(site, {'instruments': [], 'filters': set(), 'ages': {}})['instruments'].append(code)
+
+    for instrument_filter in InstrumentFilter.objects.with_last_calibration_age(as_of=as_of):
+        site = sites.get(instrument_filter.instrument.site)
+        if site is None or instrument_filter.instrument.code not in site['instruments']:
+            continue  # the instrument was added after it was read above
+        site['filters'].add(instrument_filter.filter.name)
+        site['ages'][(instrument_filter.instrument.code, instrument_filter.filter.name)] = \
+            instrument_filter.last_calibration_age
+
+    for site in sites.values():
+        site['filters'] = sorted(site['filters'])
+        site['ages'] = [[site['ages'].get((code, filter_name), '') for code in site['instruments']]
+                        for filter_name in site['filters']]
+
+    return {'generated': as_of.isoformat(), 'sites': sites}
+
+
+def get_heatmap() -> dict:
+    """The cached ``build_heatmap`` document, rebuilding it if it has expired or been invalidated"""
+    heatmap = cache.get(HEATMAP_CACHE_KEY)
+    if heatmap is None:
+        heatmap = build_heatmap()
+        cache.set(HEATMAP_CACHE_KEY, heatmap, timeout=HEATMAP_CACHE_TIMEOUT)
+    return heatmap
+
+
+def invalidate_heatmap() -> None:
+    """Drop the cached heatmap, e.g. because a calibration completed or the instrument filters changed"""
+    cache.delete(HEATMAP_CACHE_KEY)
@@ -4,6 +4,9 @@ from tom_observations.facility import get_service_class
 from tom_observations.models import ObservationRecord
 from tom_dataproducts.data_processor import run_data_processor
 
+from calibrations.heatmap import invalidate_heatmap
+from calibrations.ledger import record_completed_calibration
+
 logger = logging.getLogger(__name__)
 
 
@@ -14,6 +17,14 @@ def observation_change_state(observation: ObservationRecord, previous_state):
     # NOTE: this could be extracted into a method if desired
 
     if observation.status == 'COMPLETED':
+        # keep the last calibration of each of the observation's filters up to date, without letting a failure
+        # there stop the observation's data from being processed
+        try:
+            record_completed_calibration(observation)
+        except Exception as e:
+            logger.exception(f'Could not record observation {observation} in the LastCalibration ledger: {e}')
+        invalidate_heatmap()
+
         # the LCO facility knows about the data associated with this observation
         facility_class = get_service_class(observation.facility)
         facility = facility_class()
@@ -0,0 +1,118 @@
+import logging
+from typing import Dict, Iterable, Tuple
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from tom_observations.models import ObservationRecord
+
+from calibrations.models import LastCalibration
+
+logger = logging.getLogger(__name__)
+
+LedgerKey = Tuple[str, str, str]  # (instrument_code, filter_name, calibration_type)
+
+LEDGER_WRITE_ATTEMPTS = 3
+
+
+def ledger_keys(parameters: dict) -> Iterable[LedgerKey]:
+    """
+    The LastCalibration entries a COMPLETED observation with these parameters counts as a calibration for.
+
+    There is one for each ``{filter}_selected`` filter, or a single one with an empty filter name when the
+    observation selects no filters (e.g. NRES). Observations without an instrument code aren't calibrations.
+    """
+    instrument_code = parameters.get('instrument')
+    if not instrument_code:
+        return []
+    calibration_type = parameters.get('observation_type') or ''
+    filter_names = [key[:-len('_selected')] for key, value in parameters.items()
+                    if key.endswith('_selected') and value is True]
+    return [(instrument_code, filter_name, calibration_type) for filter_name in filter_names or ['']]
+
+
+def _is_later(scheduled_end, than) -> bool:
+    """Whether a calibration ending at ``scheduled_end`` replaces one ending at ``than``; unknown ends are oldest"""
+    if than is None:
+        return True
+    return scheduled_end is not None and scheduled_end > than
+
+
+def update_ledger(records: Iterable[ObservationRecord]) -> Tuple[int, int]:
+    """
+    Record these COMPLETED ObservationRecords in the LastCalibration ledger, where they are later than the
+    calibrations already recorded there.
+
+    The existing entries are read in one query, locked until they are replaced; new entries are then created with
+    one ``bulk_create`` and the replaced ones updated with one ``bulk_update``. If another process creates one of
+    the new entries first (the status hook and the cadence runner both update the ledger), the entries are read
+    again and only replaced by later calibrations. Returns the number of entries created and updated.
+    """
+    latest: Dict[LedgerKey, ObservationRecord] = {}
+    for record in records:
+        for key in ledger_keys(record.parameters or {}):
+            if key not in latest or _is_later(record.scheduled_end, latest[key].scheduled_end):
+                latest[key] = record
+    if not latest:
+        return 0, 0
+
+    for attempt in range(LEDGER_WRITE_ATTEMPTS):
+        try:
+            return _write_ledger(latest)
+        except IntegrityError:
+            if attempt == LEDGER_WRITE_ATTEMPTS - 1:
+                raise
+            logger.info('LastCalibration entries were created concurrently; updating them instead')
+
+
+def _write_ledger(latest: Dict[LedgerKey, ObservationRecord]) -> Tuple[int, int]:
+    with transaction.atomic():
+        existing = {(entry.instrument_code, entry.filter_name, entry.calibration_type): entry
+                    for entry in LastCalibration.objects.select_for_update().filter(
+                        instrument_code__in={instrument_code for instrument_code, _, _ in latest})}
+
+        now = timezone.now()
+        created = []
+        updated = []
+        for key, record in latest.items():
+            entry = existing.get(key)
+            if entry is None:
+                instrument_code, filter_name, calibration_type = key
+                created.append(LastCalibration(instrument_code=instrument_code, filter_name=filter_name,
+                                               calibration_type=calibration_type,
+                                               scheduled_end=record.scheduled_end, observation_record=record))
+            elif entry.observation_record_id != record.id and _is_later(record.scheduled_end, entry.scheduled_end):
+                entry.scheduled_end = record.scheduled_end
+                entry.observation_record = record
+                entry.modified = now  # bulk_update doesn't apply auto_now
+                updated.append(entry)
+
+        LastCalibration.objects.bulk_create(created)
+        LastCalibration.objects.bulk_update(updated, ['scheduled_end', 'observation_record', 'modified'])
+    return len(created), len(updated)
+
+
+def record_completed_calibration(observation: ObservationRecord) -> None:
+    """Record a calibration observation that has just reached COMPLETED in the LastCalibration ledger"""
+    created, updated = update_ledger([observation])
+    logger.debug(f'Observation {observation.id} created {created} and updated {updated} LastCalibration entries')
+
+
+def rebuild_ledger(batch_size: int = 1000) -> Tuple[int, int]:
+    """
+    Rebuild the LastCalibration ledger from every COMPLETED ObservationRecord, ``batch_size`` records at a time.
+    Existing entries are locked while they are replaced, and only by later calibrations, and entries created
+    concurrently are retried as updates (see ``update_ledger``), so this can run while the hook is updating the
+    ledger. Returns the total number of entries created and updated.
+    """
+    records = ObservationRecord.objects.filter(status='COMPLETED')
+
+    total_created = total_updated = 0
+    batch = []
+    for record in records.only('id', 'parameters', 'scheduled_end').iterator(chunk_size=batch_size):
+        batch.append(record)
+        if len(batch) == batch_size:
+            created, updated = update_ledger(batch)
+            total_created, total_updated = total_created + created, total_updated + updated
+            batch = []
+    created, updated = update_ledger(batch)
+    return total_created + created, total_updated + updated
@@ -0,0 +1,38 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from calibrations.cadences.runner import CadenceRunner
+from calibrations.cadences.scheduler import CadenceScheduler
+from calibrations.management.commands.runcalibrationcadences import add_partition_arguments, partition_from_options
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Runs dynamic cadences as they become due, as a long-running process (see
+    calibrations.cadences.scheduler.CadenceScheduler). This replaces the runcalibrationcadences CronJob.
+    """
+
+    help = 'Run dynamic cadences as they become due, until interrupted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help='Number of cadences to run at once')
+        parser.add_argument('--poll-interval', type=int,
+                            help='Longest time, in seconds, between checks of a pending cadence')
+        parser.add_argument('--wake-interval', type=int,
+                            help='Time, in seconds, between checks for changed observations while sleeping')
+        parser.add_argument('--once', action='store_true', help='Run the cadences that are due now, then exit')
+        add_partition_arguments(parser)
+
+    def handle(self, *args, **options):
+        runner = CadenceRunner(max_workers=options['workers'], partition=partition_from_options(options))
+        scheduler = CadenceScheduler(runner=runner,
+                                     poll_interval=options['poll_interval'],
+                                     wake_interval=options['wake_interval'])
+        if options['once']:
+            self.stdout.write(f'Ran {scheduler.run_due()} due cadences')
+            return
+        logger.info('Starting the cadence scheduler')
+        scheduler.run_forever()
@@ -5,6 +5,7 @@ from tom_observations.models import DynamicCadence, ObservationGroup
 from tom_targets.models import Target
 
 from calibrations.models import Instrument
+from calibrations.seasons import in_season
 
 logger = logging.getLogger(__name__)
 
@@ -17,12 +18,9 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         logger.setLevel(options['verbosity'])
 
-        target = None
-        for t in Target.objects.filter(targetextra__key='calibration_type', targetextra__value='IMAGER'):
-            if t.target_is_in_season():
-                target = t
-                break
-        else:
+        target = in_season(Target.objects.filter(targetextra__key='calibration_type', targetextra__value='IMAGER')) \
+            .first()
+        if target is None:
             raise Exception('No imager targets in season')
 
         for inst in Instrument.objects.all():
@@ -0,0 +1,26 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from calibrations.ledger import rebuild_ledger
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the LastCalibration ledger from the history of COMPLETED ObservationRecords.
+
+    The observation_change_state hook keeps the ledger up to date as observations complete; run this once after
+    the ledger is first deployed, or whenever it may have missed observations.
+    """
+
+    help = 'Rebuild the last calibration of each instrument filter from the completed ObservationRecords'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of ObservationRecords to read and record at a time')
+
+    def handle(self, *args, **options):
+        created, updated = rebuild_ledger(batch_size=options['batch_size'])
+        self.stdout.write(f'Created {created} and updated {updated} LastCalibration entries')
@@ -0,0 +1,43 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from calibrations.cadences.partition import CadencePartition
+from calibrations.cadences.runner import CadenceRunner
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Runs the strategy of every active DynamicCadence, like tom_observations' runcadencestrategies, but runs
+    independent cadences concurrently (see calibrations.cadences.runner.CadenceRunner). Several of these can run at
+    once, each on its own partition of the cadences, e.g. ``--shard 0/3``, ``--shard 1/3`` and ``--shard 2/3``.
+    """
+
+    help = 'Run the cadence strategies of all active dynamic cadences concurrently'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help='Number of cadences to run at once')
+        parser.add_argument('--all', action='store_true',
+                            help='Run every active cadence, including those whose last observation is still pending')
+        add_partition_arguments(parser)
+
+    def handle(self, *args, **options):
+        runner = CadenceRunner(max_workers=options['workers'], partition=partition_from_options(options))
+        runner.run(skip_idle=not options['all'])
+        self.stdout.write(runner.summary())
+
+
+def add_partition_arguments(parser):
+    parser.add_argument('--sites', help='Only run the cadences at these sites, e.g. cpt,lsc')
+    parser.add_argument('--telescope-class', help='Only run the cadences on this class of telescope, e.g. 1m0')
+    parser.add_argument('--shard', help='Only run this shard of the cadences, given as index/count, e.g. 0/3')
+
+
+def partition_from_options(options) -> CadencePartition:
+    try:
+        return CadencePartition.from_options(sites=options['sites'], telescope_class=options['telescope_class'],
+                                             shard=options['shard'])
+    except ValueError as e:
+        raise CommandError(e)
@@ -1,146 +1,103 @@
-import calendar
-from datetime import datetime, timedelta
 import logging
-import random
 
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.db.models import DateTimeField, ExpressionWrapper, F
+from django.utils import timezone
 
-from tom_targets.models import Target, TargetExtra
-from tom_observations.models import DynamicCadence, ObservationGroup, ObservationRecord
+from tom_targets.models import Target
+from tom_observations.models import DynamicCadence
 
+from calibrations.assignment import assign_targets
+from calibrations.seasons import rank_eligible_targets
 
-CADENCE_DURATION = 3
+
+CADENCE_DURATION = 3  # months
 
 logger = logging.getLogger(__name__)
 
 
 class Command(BaseCommand):
     """
-    Intended to be run monthly, this command creates the new cadence for a site.
+    Intended to be run monthly, this command creates the new cadence for each NRES site whose cadence has expired,
+    assigning the sites their new targets all together (see calibrations.assignment.assign_targets).
     """
 
     help = 'Trigger an event at a specific site.'
 
     def add_arguments(self, parser):
-        parser.add_argument('-s', '--site', required=True)
-
-    def get_eligible_targets(self, target_ids_to_exclude=[]):
-        """
-        Gets targets eligible to be selected for the next cadence window
+        parser.add_argument('-s', '--site', default='all', choices=('all',) + tuple(settings.NRES_SITES),
+                            help='The NRES site whose cadence to rotate, or all of them')
 
-        :param target_ids_to_exclude: List of target IDs to omit from the result
-        :type target_ids_to_exclude: list of ints
+    def get_expired_cadence(self, site, now):
         """
-
-        now = datetime.now()
-        cadence_end_datestamp = now + timedelta(month=CADENCE_DURATION)
-
-        eligible_targets = []
-        for target in Target.objects.exclude(
-                                        id__in=target_ids_to_exclude
-                                    ).filter(
-                                        targetextra__key='nres_active_target', value=True
-                                    ):
-            # TODO: validate that there's only one of each TargetExtra
-            target_seasonal_start = target.targetextra_set.filter(key='seasonal_start').first().float_value
-            seasonal_start_year = now.year if now.month >= target_seasonal_start else now.year - 1
-            seasonal_start_date = datetime(year=seasonal_start_year, month=target_seasonal_start, day=1)
-
-            target_seasonal_end = target.targetextra_set.filter(key='seasonal_end').first().float_value
-            seasonal_end_year = now.year if now.month <= target_seasonal_end else now.year + 1
-            visible_window_length = datetime(
-                year=seasonal_end_year,
-                month=target_seasonal_end,
-                day=calendar.monthrange(cadence_end_datestamp.year, target_seasonal_end)
-            )[1] - now
-
-            if seasonal_start_date <= now and visible_window_length > CADENCE_DURATION:
-                eligible_targets.append(target)
-
-        return eligible_targets
-
-    def get_new_target(self, target_ids_to_exclude=[]):
-        """
-        Selects a target visible at the given site that will be visible for the next three months.
-
-        :param target_ids_to_exclude: List of target IDs to omit from the result
-        :type target_ids_to_exclude: list of ints
+        The active DynamicCadence of a site if it is due to be rotated onto a new target, and a message saying why
+        or why not.
         """
-
-        # seasonal_start must be in current month or prior
-        # remaining time in the visibility window > CADENCE_DURATION
-        # remaining time = seasonal_end - now >= CADENCE_DURATION
-
-        # visible_window_length = ExpressionWrapper(
-        #     datetime(year=now.year if now.month <= F('seasonal_end') else now.year + 1,
-        #              month=F('seasonal_end'),
-        #              day=calendar.monthrange(cadence_end_datestamp.year, F('seasonal_end'))[1]
-        #              ) - datetime.now()
-        # )
-
-        # seasonal_end_date = ExpressionWrapper(
-        #     datetime(year=now.year if now.month <= F('seasonal_end') else now.year + 1,
-        #              month=F('seasonal_end'),
-        #              day=calendar.monthrange(cadence_end_datestamp.year, F('seasonal_end'))[1]
-        #              )
-        # )
-
-        # current date 6/1/2020
-        # seasonal_end 11/30/2020 -> should be visible window length of 5 months
-        # CADENCE_DURATION 7 months
-        # 11/30/2021 -> actual visible window length = 17 months
-        # should be invalid target, becomes eligible target
-
-        # seasonal_end_dates = TargetExtra.objects.filter(key='seasonal_end')
-
-        # eligible_targets = Target.objects.exclude(
-        #                                     targets_to_exclude
-        #                                 ).filter(
-        #                                     targetextra__in=TargetExtra.objects.filter(key='nres_active_target', value=True)
-        #                                 ).filter(
-        #                                     targetextra__in=TargetExtra.objects.filter(key='seasonal_end')   
-        #                                 )
-
-        eligible_targets = self.get_eligible_targets(target_ids_to_exclude=target_ids_to_exclude)
-
-        return random.choice(eligible_targets)
-
-    def handle(self, *args, **options):
-        logger.log(msg='trigger received', level=logging.INFO)
-
         # Identify and get the correct DynamicCadence for a site
         # TODO: add "last_run" as a property for DynamicCadence
-        cadence_for_site = DynamicCadence.objects.filter(cadence_parameters__site=options['site'], active=True)
+        cadence_for_site = DynamicCadence.objects.filter(cadence_parameters__site=site, active=True)
         if len(cadence_for_site) == 0:
-            msg = f"No active cadence was found for site {options['site']}"
-            logger.log(msg=msg, level=logging.WARNING)
-            return msg
+            return None, f"No active cadence was found for site {site}"
         elif len(cadence_for_site) > 1:
-            msg = f"More than one active cadence was found for site {options['site']}"
-            logger.log(msg=msg, level=logging.WARNING)
-            return msg
+            return None, f"More than one active cadence was found for site {site}"
         else:
             cadence_for_site = cadence_for_site.first()
 
-        # Check if the cadence is still valid
-        # Check if the first run of the cadence was less than 3 months ago
-        cadence_expired = (datetime.now - cadence_for_site.created) >= timedelta(month=CADENCE_DURATION)
+        # Check if the first run of the cadence was less than CADENCE_DURATION months ago
+        if cadence_for_site.created + relativedelta(months=CADENCE_DURATION) > now:
+            return None, f'The cadence for site {site} is still valid'
+        return cadence_for_site, f'The cadence for site {site} has expired'
+
+    def rotate_cadence(self, cadence, new_target):
+        """Replace a site's cadence with one observing new_target"""
+        DynamicCadence.objects.create(
+            cadence_strategy=cadence.cadence_strategy,
+            cadence_parameters={**cadence.cadence_parameters, 'target_id': new_target.id},
+            observation_group=cadence.observation_group,
+            active=True
+        )
+        cadence.active = False
+        cadence.save()
 
-        # If the cadence is still valid, do nothing
-        if not cadence_expired:
-            pass
-        else:
-            # If the cadence is no longer valid:
-            # Find next target and create new cadence
-            old_target = cadence_for_site.observation_group.observation_set.first().target
-            new_target = self.get_new_target([old_target.id])
-            new_dynamic_cadence = DynamicCadence.objects.create(
-                cadence_strategy=cadence_for_site.cadence_strategy,
-                cadence_parameters={'target_id': new_target.id},
-                observation_group=cadence_for_site.observation_group,
-                active=True
-            )
-            # TODO: log nice message summarizing result of this run
-            cadence_for_site.active = False
-            cadence_for_site.save()
+    def handle(self, *args, **options):
+        logger.log(msg='trigger received', level=logging.INFO)
+        now = timezone.now()
+        sites = settings.NRES_SITES if options['site'] == 'all' else [options['site']]
+
+        expired_cadences = {}
+        for site in sites:
+            cadence, msg = self.get_expired_cadence(site, now)
+            if cadence is not None:
+                expired_cadences[site] = cadence
+            else:
+                logger.log(msg=msg, level=logging.INFO)
+                self.stdout.write(msg)
+        if not expired_cadences:
+            return
+
+        # the targets of the cadences that stay on aren't available; the rest are assigned to the expired sites
+        # together, so that each site gets the target it can observe best without two sites getting the same one
+        # the NRES forms store target_id as a string, so they are compared as ints with the targets' primary keys
+        current_target_ids = {int(cadence.cadence_parameters['target_id']) for cadence in
+                              DynamicCadence.objects.filter(cadence_strategy='NRESCadenceStrategy', active=True)
+                              .exclude(pk__in=[cadence.pk for cadence in expired_cadences.values()])
+                              if cadence.cadence_parameters.get('target_id')}
+        target_ids = [target_id for target_id, _ in rank_eligible_targets(now=now, cadence_months=CADENCE_DURATION,
+                                                                          exclude_target_ids=current_target_ids)]
+        excluded = {site: int(cadence.cadence_parameters['target_id'])
+                    for site, cadence in expired_cadences.items() if cadence.cadence_parameters.get('target_id')}
+        assignments = assign_targets(list(expired_cadences), target_ids, now, CADENCE_DURATION, excluded=excluded)
+        new_targets = Target.objects.in_bulk(assignments.values())
+
+        for site, cadence in expired_cadences.items():
+            old_target_id = cadence.cadence_parameters.get('target_id')
+            if site not in assignments:
+                msg = f'No target could be assigned to replace target {old_target_id} at site {site}'
+                logger.log(msg=msg, level=logging.WARNING)
+            else:
+                new_target = new_targets[assignments[site]]
+                self.rotate_cadence(cadence, new_target)
+                msg = f'The cadence for site {site} now observes {new_target.name} instead of target {old_target_id}'
+                logger.log(msg=msg, level=logging.INFO)
+            self.stdout.write(msg)
@@ -0,0 +1,40 @@
+import logging
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.management.base import BaseCommand
+from tom_observations.models import ObservationRecord
+from tom_targets.models import Target
+
+from calibrations.status import terminal_observing_states, update_observation_statuses
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Updates the status of each observation request in the TOM that isn't in a terminal state, like
+    tom_observations' updatestatus, but looks them up in the observation portal in batches
+    (see calibrations.status.ObservationStatusUpdater).
+    """
+
+    help = 'Updates the status of each pending observation request in the TOM, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target_id', help='Update observation statuses for a single target')
+        parser.add_argument('--instrument_code', help='Update observation statuses for a single instrument')
+        parser.add_argument('--batch-size', type=int, help='Number of observations to look up per request')
+
+    def handle(self, *args, **options):
+        records = ObservationRecord.objects.exclude(status__in=terminal_observing_states())
+        if options['target_id']:
+            try:
+                records = records.filter(target=Target.objects.get(pk=options['target_id']))
+            except ObjectDoesNotExist:
+                raise Exception('Invalid target id provided')
+        if options['instrument_code']:
+            records = records.filter(parameters__instrument=options['instrument_code'])
+
+        changed, failed = update_observation_statuses(records, batch_size=options['batch_size'])
+        if failed:
+            return f'Update completed with errors: {failed}'
+        return f'Update completed successfully: {len(changed)} observations changed status'
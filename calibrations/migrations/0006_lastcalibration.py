@@ -0,0 +1,31 @@
+# Generated by Django 4.2.10 on 2026-10-17 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tom_observations', '0012_auto_20210205_1819'),
+        ('calibrations', '0005_rename_filter_set_code_filterset_filter_combination'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LastCalibration',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('instrument_code', models.CharField(max_length=20)),
+                ('filter_name', models.CharField(blank=True, default='', max_length=100)),
+                ('calibration_type', models.CharField(blank=True, default='', max_length=50)),
+                ('scheduled_end', models.DateTimeField(blank=True, null=True)),
+                ('modified', models.DateTimeField(auto_now=True, help_text='The time which this ledger entry was changed in the TOM database.', verbose_name='Last Modified')),
+                ('observation_record', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='tom_observations.observationrecord')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='lastcalibration',
+            constraint=models.UniqueConstraint(fields=('instrument_code', 'filter_name', 'calibration_type'), name='unique_last_calibration'),
+        ),
+    ]
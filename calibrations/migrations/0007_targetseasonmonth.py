@@ -0,0 +1,27 @@
+# Generated by Django 4.2.10 on 2026-10-17 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tom_targets', '0021_rename_target_basetarget_alter_basetarget_options'),
+        ('calibrations', '0006_lastcalibration'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TargetSeasonMonth',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.PositiveSmallIntegerField(db_index=True)),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='season_months', to='tom_targets.basetarget')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='targetseasonmonth',
+            constraint=models.UniqueConstraint(fields=('target', 'month'), name='unique_target_season_month'),
+        ),
+    ]
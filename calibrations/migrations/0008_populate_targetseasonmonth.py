@@ -0,0 +1,46 @@
+# Generated by Django 4.2.10 on 2026-10-17 12:00
+
+from django.db import migrations
+
+
+def season_months(seasonal_start, seasonal_end):
+    # a copy of calibrations.models.season_months, as it was when this migration was written
+    if seasonal_start is None or seasonal_end is None or not (1 <= seasonal_start <= 12 and 1 <= seasonal_end <= 12):
+        return []
+    if seasonal_start > seasonal_end:
+        seasonal_end += 12
+    return [(month - 1) % 12 + 1 for month in range(seasonal_start, seasonal_end + 1)]
+
+
+def populate_target_season_months(apps, schema_editor):
+    TargetExtra = apps.get_model('tom_targets', 'TargetExtra')
+    TargetSeasonMonth = apps.get_model('calibrations', 'TargetSeasonMonth')
+
+    seasons = {}
+    for target_id, key, value in TargetExtra.objects.filter(key__in=['seasonal_start', 'seasonal_end']) \
+            .values_list('target_id', 'key', 'value'):
+        try:
+            seasons.setdefault(target_id, {})[key] = int(float(value))
+        except (TypeError, ValueError):
+            continue
+
+    TargetSeasonMonth.objects.bulk_create([
+        TargetSeasonMonth(target_id=target_id, month=month) for target_id, season in seasons.items()
+        for month in season_months(season.get('seasonal_start'), season.get('seasonal_end'))
+    ], batch_size=1000)
+
+
+def clear_target_season_months(apps, schema_editor):
+    apps.get_model('calibrations', 'TargetSeasonMonth').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tom_targets', '0021_rename_target_basetarget_alter_basetarget_options'),
+        ('calibrations', '0007_targetseasonmonth'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_target_season_months, clear_target_season_months),
+    ]
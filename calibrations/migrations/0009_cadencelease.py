@@ -0,0 +1,24 @@
+# Generated by Django 4.2.10 on 2026-10-17 19:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tom_observations', '0012_auto_20210205_1819'),
+        ('calibrations', '0008_populate_targetseasonmonth'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CadenceLease',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('runner', models.CharField(max_length=100)),
+                ('expires', models.DateTimeField()),
+                ('cadence', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='lease', to='tom_observations.dynamiccadence')),
+            ],
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.10 on 2026-10-17 12:00
+
+from django.db import migrations
+
+
+def ledger_keys(parameters):
+    # a copy of calibrations.ledger.ledger_keys, as it was when this migration was written
+    instrument_code = parameters.get('instrument')
+    if not instrument_code:
+        return []
+    calibration_type = parameters.get('observation_type') or ''
+    filter_names = [key[:-len('_selected')] for key, value in parameters.items()
+                    if key.endswith('_selected') and value is True]
+    return [(instrument_code, filter_name, calibration_type) for filter_name in filter_names or ['']]
+
+
+def populate_last_calibrations(apps, schema_editor):
+    # the same ledger as calibrations.ledger.rebuild_ledger builds, from every COMPLETED ObservationRecord
+    ObservationRecord = apps.get_model('tom_observations', 'ObservationRecord')
+    LastCalibration = apps.get_model('calibrations', 'LastCalibration')
+
+    latest = {}
+    for record_id, parameters, scheduled_end in ObservationRecord.objects.filter(status='COMPLETED') \
+            .values_list('id', 'parameters', 'scheduled_end').iterator(chunk_size=1000):
+        for key in ledger_keys(parameters or {}):
+            # unknown ends are the oldest
+            if key not in latest or (scheduled_end is not None and
+                                     (latest[key][1] is None or scheduled_end > latest[key][1])):
+                latest[key] = (record_id, scheduled_end)
+
+    existing = set(LastCalibration.objects.values_list('instrument_code', 'filter_name', 'calibration_type'))
+    LastCalibration.objects.bulk_create([
+        LastCalibration(instrument_code=instrument_code, filter_name=filter_name, calibration_type=calibration_type,
+                        scheduled_end=scheduled_end, observation_record_id=record_id)
+        for (instrument_code, filter_name, calibration_type), (record_id, scheduled_end) in latest.items()
+        if (instrument_code, filter_name, calibration_type) not in existing
+    ], batch_size=1000)
+
+
+def clear_last_calibrations(apps, schema_editor):
+    apps.get_model('calibrations', 'LastCalibration').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tom_observations', '0012_auto_20210205_1819'),
+        ('calibrations', '0009_cadencelease'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_last_calibrations, clear_last_calibrations),
+    ]
@@ -1,29 +1,35 @@
+from collections import defaultdict
 from datetime import datetime, timezone
+from typing import List, Optional
 
 from django.db import models
-from tom_observations.models import ObservationRecord
+from tom_observations.models import DynamicCadence, ObservationRecord
 from tom_targets.models import Target
 
+from calibrations.extras import TargetExtras
+
+
+def season_months(seasonal_start: Optional[int], seasonal_end: Optional[int]) -> List[int]:
+    """The month numbers from seasonal_start to seasonal_end, inclusive, rolling over the end of the year"""
+    if seasonal_start is None or seasonal_end is None or not (1 <= seasonal_start <= 12 and 1 <= seasonal_end <= 12):
+        return []
+    if seasonal_start > seasonal_end:
+        seasonal_end += 12  # end of year roll-over
+    return [(month - 1) % 12 + 1 for month in range(seasonal_start, seasonal_end + 1)]
+
 
 # this is an extension to tom_targets.models.Target class
 #
-def target_is_in_season(self, query_date: datetime = datetime.utcnow()):
-    """"Returns True if query_date is between target's seasonal_start and seasonal_end
+def target_is_in_season(self, query_date: Optional[datetime] = None, extras: Optional[TargetExtras] = None):
+    """"Returns True if query_date (by default, now) is between target's seasonal_start and seasonal_end
     Note: seasonal_start and seasonal_end are month numbers (1=January, etc).
 
+    To find the targets in season among many, use calibrations.seasons.in_season instead.
+
     This method will be added to the Target class with setattr (that's why it has a self argument).
     """
-    seasonal_start = int(self.targetextra_set.filter(key='seasonal_start').first().float_value)
-    seasonal_end = int(self.targetextra_set.filter(key='seasonal_end').first().float_value)
-    current_month = query_date.month
-
-    # Adjust months in case of end of year roll-over
-    if seasonal_start > seasonal_end:
-        seasonal_end += 12
-        if current_month < seasonal_start:
-            current_month += 12
-
-    return seasonal_start <= current_month <= seasonal_end
+    extras = extras or TargetExtras.for_target(self)
+    return (query_date or datetime.utcnow()).month in season_months(extras.seasonal_start, extras.seasonal_end)
 
 setattr(Target, 'target_is_in_season', target_is_in_season)  # noqa - add method to Target class
 
@@ -79,63 +85,196 @@ class Instrument(models.Model):
         return f'{self.site}.{self.enclosure}.{self.telescope}.{self.code}'
 
 
-class InstrumentFilter(models.Model):
-    instrument = models.ForeignKey(Instrument, on_delete=models.CASCADE)
-    filter = models.ForeignKey(Filter, on_delete=models.CASCADE)
-    max_age = models.IntegerField(default=5)
+class LastCalibration(models.Model):
+    """
+    The last COMPLETED calibration of a filter on an instrument, for each type of calibration.
 
-    def get_last_calibration_age(self, observation_group=None):
-        if not observation_group:
-            records = ObservationRecord.objects.all()
-        else:
-            records = observation_group.observation_records.all()
+    This is a ledger kept up to date by the ``observation_change_state`` hook (see ``calibrations.ledger``), so
+    that the age of a calibration can be read from this table instead of by searching every ObservationRecord.
+    Calibrations that don't select any filters are recorded with an empty ``filter_name``.
+    """
+    instrument_code = models.CharField(max_length=20)
+    filter_name = models.CharField(max_length=100, blank=True, default='')
+    calibration_type = models.CharField(max_length=50, blank=True, default='')
+    scheduled_end = models.DateTimeField(null=True, blank=True)
+    observation_record = models.ForeignKey(ObservationRecord, null=True, blank=True, on_delete=models.SET_NULL)
+    modified = models.DateTimeField(
+        auto_now=True, verbose_name='Last Modified',
+        help_text='The time which this ledger entry was changed in the TOM database.'
+    )
 
-        kwargs = {f'parameters__{self.filter.name}_selected': True,
-                  'parameters__instrument': self.instrument.code,
-                  'status': 'COMPLETED'}
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['instrument_code', 'filter_name', 'calibration_type'],
+                                    name='unique_last_calibration')
+        ]
 
-        last_calibration = records.order_by('-created').filter(**kwargs).first()
+    def __str__(self):
+        return f'{self.instrument_code} - {self.filter_name} ({self.calibration_type}): {self.scheduled_end}'
 
-        if last_calibration and last_calibration.scheduled_end:
-            return (datetime.now(timezone.utc) - last_calibration.scheduled_end).days
+
+class TargetSeasonMonth(models.Model):
+    """
+    A month in which a target is in season: one row for each month from the target's seasonal_start to its
+    seasonal_end TargetExtras.
+
+    This is an index kept up to date whenever those TargetExtras are saved (see ``calibrations.seasons``), so that
+    the targets in season on a date can be found with one indexed query instead of checking each target.
+    """
+    target = models.ForeignKey(Target, on_delete=models.CASCADE, related_name='season_months')
+    month = models.PositiveSmallIntegerField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['target', 'month'], name='unique_target_season_month')
+        ]
 
     def __str__(self):
-        return f'{self.instrument.code} - {self.filter.name}'
+        return f'{self.target}: {self.month}'
 
-class InstrumentFilterSet(models.Model):
+
+class CadenceLease(models.Model):
+    """
+    A cadence runner's claim on a DynamicCadence while it runs the cadence's strategy (see
+    ``calibrations.cadences.runner``), so that other runners sharing the cadences skip it instead of submitting its
+    observations twice.
+
+    A lease is taken and given back in short transactions of its own, not held open while the strategy talks to the
+    observation portal. A lease still there after ``expires``, e.g. because its runner was killed, can be taken over.
+    """
+    cadence = models.OneToOneField(DynamicCadence, on_delete=models.CASCADE, related_name='lease')
+    runner = models.CharField(max_length=100)
+    expires = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.cadence_id}: {self.runner} until {self.expires}'
+
+
+def _last_calibration_ends(instrument_filter_names, observation_group=None):
+    """
+    Find the scheduled_end of the last COMPLETED calibration of each (instrument code, filter name) pair.
+
+    Without an ``observation_group`` this is one indexed read of the LastCalibration ledger, taking the latest
+    calibration of any type. Within an ``observation_group``, the group's matching ObservationRecords are read in
+    one query, newest first, and the first one found for each pair wins. A pair that was never calibrated isn't in
+    the returned dictionary; its value is None if its last calibration has no scheduled_end.
+    """
+    filter_names = defaultdict(set)
+    for instrument_code, filter_name in instrument_filter_names:
+        filter_names[instrument_code].add(filter_name)
+    if not filter_names:
+        return {}
+
+    if not observation_group:
+        last_ends = {}
+        for instrument_code, filter_name, scheduled_end in LastCalibration.objects.filter(
+                instrument_code__in=list(filter_names.keys())).values_list(
+                    'instrument_code', 'filter_name', 'scheduled_end'):
+            key = (instrument_code, filter_name)
+            if filter_name not in filter_names[instrument_code]:
+                continue
+            if key not in last_ends or (scheduled_end and (not last_ends[key] or scheduled_end > last_ends[key])):
+                last_ends[key] = scheduled_end
+        return last_ends
+
+    records = (observation_group.observation_records
+               .filter(status='COMPLETED', parameters__instrument__in=list(filter_names.keys()))
+               .order_by('-created')
+               .values_list('parameters', 'scheduled_end'))
+
+    wanted = sum(len(names) for names in filter_names.values())
+    last_ends = {}
+    for parameters, scheduled_end in records.iterator():
+        instrument_code = parameters.get('instrument')
+        for filter_name in filter_names.get(instrument_code, ()):
+            key = (instrument_code, filter_name)
+            if key not in last_ends and parameters.get(f'{filter_name}_selected') is True:
+                last_ends[key] = scheduled_end
+        if len(last_ends) == wanted:
+            break
+    return last_ends
+
+
+def _age_in_days(as_of, scheduled_end):
+    if scheduled_end:
+        return (as_of - scheduled_end).days
+
+
+class InstrumentFilterQuerySet(models.QuerySet):
+    def with_last_calibration_age(self, as_of=None, observation_group=None):
+        """
+        Returns the InstrumentFilters in this queryset, each with a ``last_calibration_age``: the age in days (at
+        ``as_of``, by default now) of its last completed calibration, or None if it has none.
+
+        The ages of every InstrumentFilter are found with a single read of the LastCalibration ledger, or with a
+        single ObservationRecord query within an ``observation_group`` (see ``_last_calibration_ends``).
+        """
+        as_of = as_of or datetime.now(timezone.utc)
+        instrument_filters = list(self.select_related('instrument', 'filter'))
+        last_ends = _last_calibration_ends(
+            {(instrument_filter.instrument.code, instrument_filter.filter.name)
+             for instrument_filter in instrument_filters},
+            observation_group)
+
+        for instrument_filter in instrument_filters:
+            instrument_filter.last_calibration_age = _age_in_days(
+                as_of, last_ends.get((instrument_filter.instrument.code, instrument_filter.filter.name)))
+        return instrument_filters
+
+
+class InstrumentFilter(models.Model):
     instrument = models.ForeignKey(Instrument, on_delete=models.CASCADE)
-    filter_set = models.ForeignKey(FilterSet, on_delete=models.CASCADE)
+    filter = models.ForeignKey(Filter, on_delete=models.CASCADE)
     max_age = models.IntegerField(default=5)
 
-    def get_last_instrumentfilterset_age(self, observation_group=None):
-        if not observation_group:
-            records = ObservationRecord.objects.all()
-        else:
-            records = observation_group.observation_records.all()
+    objects = InstrumentFilterQuerySet.as_manager()
 
-        ages = []
-        filterset = self.filter_set.filter_combination.all()
-        #print('filterset = ', filterset)
+    def get_last_calibration_age(self, observation_group=None):
+        last_ends = _last_calibration_ends({(self.instrument.code, self.filter.name)}, observation_group)
+        return _age_in_days(datetime.now(timezone.utc), last_ends.get((self.instrument.code, self.filter.name)))
 
-        for filter in filterset: # loop through each filter in set
+    def __str__(self):
+        return f'{self.instrument.code} - {self.filter.name}'
 
-            kwargs = {f'parameters__{filter.name}_selected': True,
-                  'parameters__instrument': self.instrument.code,
-                  'status': 'COMPLETED'}
 
-            last_calibration = records.order_by('-created').filter(**kwargs).first()
-            #print('last_calibration = ', last_calibration)
-            #print('last_calibration.scheduled_end = ', last_calibration.scheduled_end)
+class InstrumentFilterSetQuerySet(models.QuerySet):
+    def with_last_calibration_age(self, as_of=None, observation_group=None):
+        """
+        Returns the InstrumentFilterSets in this queryset, each with a ``last_calibration_age``: the age in days
+        (at ``as_of``, by default now) of the oldest last calibration of the filters in its set. Filters that
+        were never calibrated count as 0 days old.
+
+        The ages of every InstrumentFilterSet are found with a single read of the LastCalibration ledger, or with a
+        single ObservationRecord query within an ``observation_group`` (see ``_last_calibration_ends``).
+        """
+        as_of = as_of or datetime.now(timezone.utc)
+        instrument_filter_sets = list(self.select_related('instrument')
+                                      .prefetch_related('filter_set__filter_combination'))
+        last_ends = _last_calibration_ends(
+            {(instrument_filter_set.instrument.code, filter.name)
+             for instrument_filter_set in instrument_filter_sets
+             for filter in instrument_filter_set.filter_set.filter_combination.all()},
+            observation_group)
+
+        for instrument_filter_set in instrument_filter_sets:
+            ages = [_age_in_days(as_of, last_ends.get((instrument_filter_set.instrument.code, filter.name))) or 0
+                    for filter in instrument_filter_set.filter_set.filter_combination.all()]
+            # only the age of the oldest filter in the set counts
+            instrument_filter_set.last_calibration_age = max(ages) if ages else None
+        return instrument_filter_sets
 
-            age = 0
-            if last_calibration and last_calibration.scheduled_end:
-                age = (datetime.now(timezone.utc) - last_calibration.scheduled_end).days
 
-            ages.append(age) # create list of filter ages in set
+class InstrumentFilterSet(models.Model):
+    instrument = models.ForeignKey(Instrument, on_delete=models.CASCADE)
+    filter_set = models.ForeignKey(FilterSet, on_delete=models.CASCADE)
+    max_age = models.IntegerField(default=5)
 
-        filterset_age = max(ages) # return only the age of the oldest filter in the set
+    objects = InstrumentFilterSetQuerySet.as_manager()
 
-        return filterset_age
+    def get_last_instrumentfilterset_age(self, observation_group=None):
+        instrument_filter_set, = InstrumentFilterSet.objects.filter(pk=self.pk).with_last_calibration_age(
+            observation_group=observation_group)
+        return instrument_filter_set.last_calibration_age
 
     def __str__(self):
         ic = self.instrument.code
@@ -0,0 +1,143 @@
+from datetime import datetime, timezone
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.core.cache import cache
+from tom_observations.facilities.ocs import ImproperCredentialsException, make_request
+
+logger = logging.getLogger(__name__)
+
+
+class PortalMetadataCache(object):
+    """
+    The instruments and proposals of an observation portal, shared by every form and facility of the TOM's
+    processes, so that building or validating a form doesn't wait on the portal.
+
+    There is one cache per facility settings name (see ``for_facility``), kept in two layers: a process-local one,
+    which the worker threads of a process share, and the Django cache, which the processes share. An entry is
+    fetched from the portal when there is none or it is older than ``timeout`` seconds. Once it is older than
+    ``refresh_after`` seconds, it is still served, while a background thread fetches a new one. If the portal can't
+    be reached, an expired entry is served rather than none.
+    """
+
+    _caches: Dict[str, 'PortalMetadataCache'] = {}
+    _caches_lock = threading.Lock()
+
+    def __init__(self, facility_settings, timeout: Optional[int] = None, refresh_after: Optional[int] = None) -> None:
+        self.facility_settings = facility_settings
+        self.timeout = timeout or settings.PORTAL_METADATA_CACHE_TIMEOUT
+        self.refresh_after = refresh_after or settings.PORTAL_METADATA_REFRESH_AFTER
+        self._local: Dict[str, Tuple[datetime, object]] = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_facility(cls, facility_settings) -> 'PortalMetadataCache':
+        """The process's cache for the portal of these facility settings"""
+        with cls._caches_lock:
+            name = facility_settings.facility_name
+            if name not in cls._caches:
+                cls._caches[name] = cls(facility_settings)
+            return cls._caches[name]
+
+    def cache_key(self, name: str) -> str:
+        return f'portal_metadata_{self.facility_settings.facility_name}_{name}'
+
+    def instruments(self) -> dict:
+        """The portal's /api/instruments/, keyed by instrument type"""
+        return self.get('instruments')
+
+    def proposals(self) -> list:
+        """(id, display name) choices of the current proposals of the TOM's portal account"""
+        return self.get('proposals')
+
+    def get(self, name: str):
+        entry = self._local.get(name)
+        if entry is None:
+            entry = cache.get(self.cache_key(name))
+            if entry is not None:
+                self._local[name] = entry
+        if entry is None:
+            return self.refresh(name)
+
+        fetched, value = entry
+        age = (datetime.now(timezone.utc) - fetched).total_seconds()
+        if age >= self.timeout:
+            try:
+                return self.refresh(name)
+            except Exception as e:
+                logger.warning(f'Could not refresh the {name} of {self.facility_settings.facility_name}, '
+                               f'using those from {fetched}: {e}')
+                return value
+        if age >= self.refresh_after:
+            self.refresh_in_background(name)
+        return value
+
+    def refresh(self, name: str):
+        """Fetch ``name`` from the portal and cache it in both layers"""
+        value = getattr(self, f'_fetch_{name}')()
+        entry = (datetime.now(timezone.utc), value)
+        cache.set(self.cache_key(name), entry, timeout=self.timeout)
+        self._local[name] = entry
+        return value
+
+    def refresh_in_background(self, name: str) -> None:
+        with self._lock:
+            if name in self._refreshing:
+                return
+            self._refreshing.add(name)
+
+        def refresh():
+            try:
+                self.refresh(name)
+            except Exception as e:
+                logger.warning(f'Could not refresh the {name} of {self.facility_settings.facility_name}: {e}')
+            finally:
+                with self._lock:
+                    self._refreshing.discard(name)
+
+        threading.Thread(target=refresh, name=f'refresh-{self.cache_key(name)}', daemon=True).start()
+
+    def invalidate(self) -> None:
+        for name in ('instruments', 'proposals'):
+            self._local.pop(name, None)
+            cache.delete(self.cache_key(name))
+
+    def _get(self, path: str):
+        return make_request(
+            'GET',
+            urljoin(self.facility_settings.get_setting('portal_url'), path),
+            headers={'Authorization': 'Token {0}'.format(self.facility_settings.get_setting('api_key'))}
+        ).json()
+
+    def _fetch_instruments(self) -> dict:
+        logger.info(f'Fetching the instruments of {self.facility_settings.facility_name}')
+        try:
+            return self._get('/api/instruments/')
+        except ImproperCredentialsException:
+            return self.facility_settings.default_instrument_config
+
+    def _fetch_proposals(self) -> list:
+        logger.info(f'Fetching the proposals of {self.facility_settings.facility_name}')
+        try:
+            profile = self._get('/api/profile/')
+        except ImproperCredentialsException:
+            return [(0, 'No proposals found')]
+        return [(proposal['id'], '{} ({})'.format(proposal['title'], proposal['id']))
+                for proposal in profile['proposals'] if proposal['current']]
+
+
+class PortalMetadataFormMixin(object):
+    """
+    For OCSBaseForm subclasses: reads the portal's instruments (and so the instrument, filter and mode choices
+    derived from them) and proposals from the PortalMetadataCache instead of the observation portal.
+    """
+
+    def _get_instruments(self):
+        return PortalMetadataCache.for_facility(self.facility_settings).instruments()
+
+    def proposal_choices(self):
+        return PortalMetadataCache.for_facility(self.facility_settings).proposals()
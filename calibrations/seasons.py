@@ -0,0 +1,93 @@
+from collections import defaultdict
+from datetime import datetime
+import logging
+from typing import Iterable, List, Optional, Tuple
+
+from dateutil.relativedelta import relativedelta
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+import numpy as np
+from tom_targets.models import Target, TargetExtra
+
+from calibrations.extras import TargetExtras, TargetExtrasCache
+from calibrations.models import TargetSeasonMonth, season_months
+
+logger = logging.getLogger(__name__)
+
+SEASON_KEYS = ('seasonal_start', 'seasonal_end')
+
+
+def _season(target_id: int, extras: TargetExtras) -> Tuple[Optional[int], Optional[int]]:
+    """A target's (seasonal_start, seasonal_end); a target whose season extras aren't numbers has no season"""
+    try:
+        return extras.seasonal_start, extras.seasonal_end
+    except (TypeError, ValueError) as e:
+        logger.warning(f'Target {target_id} has no season: its season extras are not months: {e}')
+        return None, None
+
+
+def in_season(targets: Optional[QuerySet] = None, query_date: Optional[datetime] = None) -> QuerySet:
+    """
+    The targets (by default, all of them) that are in season on query_date (by default, now), with one indexed
+    query of the TargetSeasonMonth index. This is the queryset equivalent of Target.target_is_in_season.
+    """
+    targets = Target.objects.all() if targets is None else targets
+    return targets.filter(season_months__month=(query_date or datetime.utcnow()).month)
+
+
+def update_target_seasons(target_ids: Iterable[int]) -> int:
+    """Rebuild the TargetSeasonMonth index of these targets from their extras; returns the number of rows"""
+    target_ids = set(target_ids)
+    target_extras = TargetExtrasCache(target_ids)
+    rows = [TargetSeasonMonth(target_id=target_id, month=month) for target_id in target_ids
+            for month in season_months(*_season(target_id, target_extras[target_id]))]
+    with transaction.atomic():
+        TargetSeasonMonth.objects.filter(target_id__in=target_ids).delete()
+        TargetSeasonMonth.objects.bulk_create(rows)
+    return len(rows)
+
+
+def target_extra_changed(sender, instance: TargetExtra, **kwargs) -> None:
+    """post_save and post_delete receiver for TargetExtra, connected in CalibrationsConfig.ready"""
+    if instance.key in SEASON_KEYS and Target.objects.filter(pk=instance.target_id).exists():
+        update_target_seasons([instance.target_id])
+
+
+def rank_eligible_targets(now: Optional[datetime] = None, cadence_months: int = 3,
+                          exclude_target_ids: Iterable[int] = ()) -> List[Tuple[int, int]]:
+    """
+    The active NRES targets (``nres_active_target``) that are in season now and stay in season for at least
+    another ``cadence_months``, as (target id, days of the season left), most days left first.
+
+    The extras of every candidate are read with one query, and the season of each is then worked out for all of
+    them at once, in months since the epoch: the current season started ``(this month - seasonal_start) % 12``
+    months ago, lasts ``(seasonal_end - seasonal_start) % 12 + 1`` months, and ends at the start of the month
+    after seasonal_end.
+    """
+    now = now or timezone.now()
+    values = defaultdict(dict)
+    for target_id, key, value in TargetExtra.objects.filter(key__in=('nres_active_target',) + SEASON_KEYS) \
+            .exclude(target_id__in=list(exclude_target_ids)).values_list('target_id', 'key', 'value'):
+        values[target_id][key] = value
+    candidates = []
+    for target_id, target_values in values.items():
+        extras = TargetExtras(target_values)
+        seasonal_start, seasonal_end = _season(target_id, extras)
+        if extras.nres_active_target and season_months(seasonal_start, seasonal_end):
+            candidates.append((target_id, seasonal_start, seasonal_end))
+    if not candidates:
+        return []
+
+    target_ids, seasonal_starts, seasonal_ends = (np.array(column) for column in zip(*candidates))
+    months_since_start = (now.month - seasonal_starts) % 12
+    season_length = (seasonal_ends - seasonal_starts) % 12 + 1
+    season_end = (np.datetime64(now.strftime('%Y-%m'), 'M') - months_since_start + season_length) \
+        .astype('datetime64[D]')
+    days_left = (season_end - np.datetime64(now.date(), 'D')).astype(int)
+    eligible = (months_since_start < season_length) & \
+        (season_end >= np.datetime64(now.date() + relativedelta(months=cadence_months), 'D'))
+
+    target_ids, days_left = target_ids[eligible], days_left[eligible]
+    order = np.lexsort((target_ids, -days_left))
+    return list(zip(target_ids[order].tolist(), days_left[order].tolist()))
@@ -0,0 +1,184 @@
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import urlencode, urljoin
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from tom_common.hooks import run_hook
+from tom_observations.facility import get_service_class, get_service_classes
+from tom_observations.models import ObservationRecord
+
+logger = logging.getLogger(__name__)
+
+STATUS_FIELDS = ['status', 'scheduled_start', 'scheduled_end', 'modified']
+
+
+def _as_datetime(value):
+    return parse_datetime(value) if isinstance(value, str) else value
+
+
+def _current_block(blocks: Iterable[dict]) -> Optional[dict]:
+    """The block a request's scheduled times come from: its first COMPLETED block, otherwise its last PENDING one"""
+    current_block = None
+    for block in blocks:
+        if block['state'] == 'COMPLETED':
+            return block
+        elif block['state'] == 'PENDING':
+            current_block = block
+    return current_block
+
+
+class ObservationStatusUpdater(object):
+    """
+    Updates the status of many ObservationRecords with a few observation portal requests.
+
+    The records of each facility are looked up ``batch_size`` at a time: one request for the state of the portal
+    Requests and one for their observation blocks (and one more for each further page of either), as
+    ``OCSFacility.get_observation_status`` does for a single record. Records the portal doesn't return in a batch,
+    and every record of a batch the portal didn't filter on its ids, fall back to ``get_observation_status``. The
+    new statuses are then saved with one ``bulk_update``, and ``observation_change_state`` is run for the records
+    whose status changed, as ``ObservationRecord.save`` would. Each portal request has a bounded (connect, read)
+    ``timeout``.
+    """
+
+    def __init__(self, batch_size: Optional[int] = None, timeout: Optional[Tuple[float, float]] = None) -> None:
+        self.batch_size = batch_size or settings.OBSERVATION_STATUS_BATCH_SIZE
+        self.timeout = timeout or (settings.OBSERVATION_STATUS_CONNECT_TIMEOUT,
+                                   settings.OBSERVATION_STATUS_READ_TIMEOUT)
+
+    def _get_results(self, url: str, headers: dict, key: Callable[[dict], str], expected: Set[str]) -> List[dict]:
+        """
+        The results of every page of a paginated portal endpoint, following its ``next`` links.
+
+        The ``key`` of every result must be one of the ``expected`` ids the query filtered on. A portal that
+        ignored the filter would have every request or observation on the account paged through, so paging stops
+        at the first page with anything else, with a ValueError.
+        """
+        results = []
+        while url:
+            response = requests.get(url, headers=headers, timeout=self.timeout)
+            response.raise_for_status()
+            page = response.json()
+            unexpected = {key(result) for result in page.get('results', [])} - expected
+            if unexpected:
+                raise ValueError(f'The portal returned {len(unexpected)} results that were not asked for from {url}')
+            results.extend(page.get('results', []))
+            url = page.get('next')
+        return results
+
+    def fetch_statuses(self, facility, observation_ids: List[str]) -> Dict[str, dict]:
+        """
+        The status of each of these observation ids that the facility's portal returned, keyed by id. Raises a
+        ValueError if the portal returns observations that weren't asked for (see ``_get_results``).
+        """
+        portal_url = facility.facility_settings.get_setting('portal_url')
+        headers = facility._portal_headers()
+
+        query = urlencode({'id': ','.join(observation_ids), 'limit': len(observation_ids)})
+        states = {str(request['id']): request['state']
+                  for request in self._get_results(urljoin(portal_url, f'/api/requests/?{query}'), headers,
+                                                   key=lambda request: str(request['id']),
+                                                   expected=set(observation_ids))}
+        if not states:
+            return {}
+
+        query = urlencode({'request_id': ','.join(states), 'limit': 1000})
+        blocks = {}
+        for block in self._get_results(urljoin(portal_url, f'/api/observations/?{query}'), headers,
+                                       key=lambda block: str(block['request']['id']), expected=set(states)):
+            blocks.setdefault(str(block['request']['id']), []).append(block)
+
+        statuses = {}
+        for observation_id, state in states.items():
+            current_block = _current_block(blocks.get(observation_id, []))
+            statuses[observation_id] = {
+                'state': state,
+                'scheduled_start': current_block['start'] if current_block else None,
+                'scheduled_end': current_block['end'] if current_block else None,
+            }
+        return statuses
+
+    def _facility_statuses(self, facility, observation_ids: List[str]) -> Tuple[Dict[str, dict], List[tuple]]:
+        statuses = {}
+        failed = []
+        for start in range(0, len(observation_ids), self.batch_size):
+            batch = observation_ids[start:start + self.batch_size]
+            try:
+                statuses.update(self.fetch_statuses(facility, batch))
+            except Exception as e:
+                logger.warning(f'Could not get the status of {len(batch)} {facility.name} observations at once: {e}')
+            for observation_id in batch:
+                if observation_id in statuses:
+                    continue
+                try:
+                    statuses[observation_id] = facility.get_observation_status(observation_id)
+                except Exception as e:
+                    failed.append((observation_id, str(e)))
+        return statuses, failed
+
+    def update(self, records: Iterable[ObservationRecord]) -> Tuple[List[ObservationRecord], List[tuple]]:
+        """
+        Update the status of these ObservationRecords, skipping those that are already in a terminal state.
+
+        Returns the records whose status changed, and the (observation id, error) of those that couldn't be
+        updated.
+        """
+        by_facility: Dict[str, List[ObservationRecord]] = {}
+        for record in records:
+            by_facility.setdefault(record.facility, []).append(record)
+
+        updated = []
+        changed = []
+        failed = []
+        for facility_name, facility_records in by_facility.items():
+            facility = get_service_class(facility_name)()
+            terminal_states = facility.get_terminal_observing_states()
+            facility_records = [record for record in facility_records if record.status not in terminal_states]
+            statuses, facility_failed = self._facility_statuses(
+                facility, list(dict.fromkeys(record.observation_id for record in facility_records)))
+            failed.extend(facility_failed)
+
+            for record in facility_records:
+                status = statuses.get(record.observation_id)
+                if status is None:
+                    continue
+                new_values = (status['state'], _as_datetime(status['scheduled_start']),
+                              _as_datetime(status['scheduled_end']))
+                if new_values == (record.status, record.scheduled_start, record.scheduled_end):
+                    continue
+                if record.status != status['state']:
+                    changed.append((record, record.status))
+                record.status, record.scheduled_start, record.scheduled_end = new_values
+                record.modified = timezone.now()
+                updated.append(record)
+
+        with transaction.atomic():
+            ObservationRecord.objects.bulk_update(updated, STATUS_FIELDS)
+        logger.info(f'Updated {len(updated)} observation records, {len(changed)} of which changed status')
+
+        for record, previous_status in changed:
+            run_hook('observation_change_state', record, previous_status)
+        return [record for record, _ in changed], failed
+
+
+def terminal_observing_states() -> set:
+    """The observing states that are terminal at any of the TOM's facilities"""
+    states = set()
+    for facility_class in get_service_classes().values():
+        states.update(facility_class().get_terminal_observing_states())
+    return states
+
+
+def update_observation_statuses(records: Optional[Iterable[ObservationRecord]] = None,
+                                batch_size: Optional[int] = None) -> Tuple[List[ObservationRecord], List[tuple]]:
+    """
+    Update the status of these ObservationRecords (by default, every one that isn't in a terminal state) with an
+    ObservationStatusUpdater. Returns the records whose status changed and the (observation id, error) of those
+    that couldn't be updated.
+    """
+    if records is None:
+        records = ObservationRecord.objects.exclude(status__in=terminal_observing_states())
+    return ObservationStatusUpdater(batch_size=batch_size).update(records)
@@ -0,0 +1,79 @@
+import logging
+from typing import Dict, Iterable, Tuple
+
+from django.db import transaction
+
+from calibrations.heatmap import invalidate_heatmap
+from calibrations.models import Filter, Instrument, InstrumentFilter
+
+logger = logging.getLogger(__name__)
+
+INSTRUMENT_FIELDS = ('site', 'enclosure', 'telescope', 'type')
+
+
+def sync_instruments(instruments: Dict[str, dict]) -> Dict[str, int]:
+    """
+    Create or update calibrations Instruments in bulk.
+
+    ``instruments`` maps instrument codes to their site, enclosure, telescope and type. Existing rows are read in
+    one query; missing rows are then created with one ``bulk_create`` and changed rows updated with one
+    ``bulk_update``. Returns the id of every instrument in ``instruments``, keyed by code.
+    """
+    existing = {instrument.code: instrument for instrument in Instrument.objects.filter(code__in=instruments.keys())}
+
+    created = []
+    updated = []
+    for code, fields in instruments.items():
+        instrument = existing.get(code)
+        if instrument is None:
+            created.append(Instrument(code=code, **fields))
+        elif any(getattr(instrument, field) != value for field, value in fields.items()):
+            for field, value in fields.items():
+                setattr(instrument, field, value)
+            updated.append(instrument)
+
+    with transaction.atomic():
+        Instrument.objects.bulk_create(created)
+        Instrument.objects.bulk_update(updated, INSTRUMENT_FIELDS)
+    logger.info(f'Created {len(created)} and updated {len(updated)} instruments')
+    if created or updated:
+        invalidate_heatmap()
+
+    if not created:
+        return {code: instrument.id for code, instrument in existing.items()}
+    return dict(Instrument.objects.filter(code__in=instruments.keys()).values_list('code', 'id'))
+
+
+def sync_instrument_filters(instrument_filters: Dict[int, Iterable[str]], prune: bool = False) -> Tuple[int, int]:
+    """
+    Make sure there is an InstrumentFilter for each filter in each instrument's filter wheel.
+
+    ``instrument_filters`` maps instrument ids to the names of the filters installed on them; names that don't
+    match a ``Filter`` are ignored. The Filter name -> id map and the existing (instrument, filter) pairs are each
+    read in one query, and only the missing pairs are inserted, with one ``bulk_create``. With ``prune``, the
+    InstrumentFilters of these instruments whose filter is no longer installed are deleted as well.
+
+    Returns the number of InstrumentFilters created and deleted.
+    """
+    filter_ids = dict(Filter.objects.values_list('name', 'id'))
+    desired = {(instrument_id, filter_ids[name])
+               for instrument_id, names in instrument_filters.items()
+               for name in names if name in filter_ids}
+
+    existing = {(instrument_id, filter_id): instrument_filter_id
+                for instrument_filter_id, instrument_id, filter_id in InstrumentFilter.objects.filter(
+                    instrument_id__in=instrument_filters.keys()).values_list('id', 'instrument_id', 'filter_id')}
+
+    missing = [InstrumentFilter(instrument_id=instrument_id, filter_id=filter_id)
+               for instrument_id, filter_id in sorted(desired - existing.keys())]
+    stale = [existing[pair] for pair in existing.keys() - desired] if prune else []
+
+    with transaction.atomic():
+        InstrumentFilter.objects.bulk_create(missing)
+        if stale:
+            InstrumentFilter.objects.filter(id__in=stale).delete()
+    logger.info(f'Created {len(missing)} and deleted {len(stale)} instrument filters')
+    if missing or stale:
+        invalidate_heatmap()
+
+    return len(missing), len(stale)
@@ -2,10 +2,9 @@ from datetime import datetime
 
 from django import template
 from django.db.models import F
-from django.conf import settings
 from guardian.shortcuts import get_objects_for_user
 
-from configdb.configdb_connections import ConfigDBInterface
+from configdb.configdb_connections import get_configdb
 
 register = template.Library()
 
@@ -36,8 +35,7 @@ def observation_count(target, observation_status):
 
 @register.inclusion_tag('calibrations/partials/sitecode_tag.html')
 def sitecode_tag(instrument_code):
-    configdb = ConfigDBInterface(settings.CONFIGDB_URL)
-    instrument_data = configdb.get_matching_instrument(instrument_name=instrument_code)
+    instrument_data = get_configdb().get_matching_instrument(instrument_name=instrument_code)
     return {
         'instrument_code': instrument_code,
         'site': instrument_data["site"]
@@ -1,13 +1,75 @@
+from datetime import datetime, timedelta, timezone
+
 from django.test import TestCase
+from tom_observations.models import ObservationRecord
 
 # for TestCadenceTargetSelection
-from tom_targets.models import Target
+from io import StringIO
+from django.core.management import call_command
+from tom_targets.models import Target, TargetExtra
+from calibrations.seasons import rank_eligible_targets
+
+# for TestTargetAssignment
+import numpy as np
+from calibrations.assignment import assign_targets, observable_hours
 
 # for TestFacilityConfiguration
 from calibrations.facilities.photometric_standards_facility import PhotometricStandardsFacility
 from calibrations.facilities.lco_calibration_facility import LCOCalibrationFacility
 from django.conf import settings
 
+# for TestInstrumentFilterSync
+from calibrations.models import Filter, FilterSet, Instrument, InstrumentFilter, InstrumentFilterSet, LastCalibration
+from calibrations.sync import sync_instrument_filters, sync_instruments
+
+# for TestCalibrationLedger
+from calibrations.ledger import ledger_keys, rebuild_ledger, update_ledger
+from django.db import IntegrityError
+from importlib import import_module
+from django.apps import apps
+
+# for TestCalibrationAgeHeatmap
+from django.contrib.auth.models import User
+from django.urls import reverse
+from calibrations.heatmap import build_heatmap, get_heatmap, invalidate_heatmap
+
+# for TestCadenceRunner
+import threading
+import time
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from tom_observations.models import DynamicCadence, ObservationGroup
+from unittest import mock
+from calibrations.cadences.partition import CadencePartition
+from calibrations.cadences.runner import CadenceRunner
+from calibrations.cadences.scheduler import CadenceScheduler
+from calibrations.models import CadenceLease
+
+# for TestObservationStatusUpdater
+import json
+import re
+from urllib.parse import parse_qs, urlparse
+import requests
+import responses
+from calibrations.status import update_observation_statuses
+
+# for TestPortalMetadataCache
+from tom_observations.facilities.lco import LCOSettings
+from calibrations.facilities.lco_calibration_facility import LCOCalibrationForm
+from calibrations.portal import PortalMetadataCache
+
+# for TestTargetExtras
+from calibrations.extras import TargetExtras, TargetExtrasCache
+from nres_calibrations.forms import NRESCadenceSubmissionForm
+
+# for TestTargetSeasons
+from calibrations.models import TargetSeasonMonth, season_months
+from calibrations.seasons import in_season, update_target_seasons
+
+
+SITE_INFO = [{'code': 'cpt', 'lat': -32.38, 'long': 20.81}, {'code': 'elp', 'lat': 30.68, 'long': -104.02},
+             {'code': 'lsc', 'lat': -30.17, 'long': -70.80}, {'code': 'tlv', 'lat': 30.60, 'long': 34.76}]
 
 test_targets = [
     # Name, RA, Dec, seasonal_start, seasonal_end
@@ -31,34 +93,91 @@ test_targets = [
 ]
 
 
-# TODO: end-to-end test settargets.py management command
+def create_nres_targets():
+    targets = []
+    for target in test_targets:
+        targets.append(Target.objects.create(
+            name=target[0], type='SIDEREAL', ra=target[1],
+            dec=target[2]))
+
+        # add target_extras
+        for key, value in (('seasonal_start', target[3]), ('seasonal_end', target[4]),
+                           ('nres_active_target', True)):
+            TargetExtra.objects.create(target=targets[-1], key=key, value=value)
+    return targets
+
+
 class TestSetTargets(TestCase):
     def setUp(self):
-        pass
+        self.targets = {target.name: target for target in create_nres_targets()}
+        self.now = datetime(2024, 6, 15, tzinfo=timezone.utc)
+
+    def create_cadence(self, site, target, months_old, target_id=None):
+        cadence = DynamicCadence.objects.create(
+            observation_group=ObservationGroup.objects.create(name=f'NRES RV calibration for {site.upper()}'),
+            cadence_strategy='NRESCadenceStrategy', active=True,
+            cadence_parameters={'site': site, 'target_id': target.id if target_id is None else target_id,
+                                'cadence_frequency': 120})
+        DynamicCadence.objects.filter(pk=cadence.pk).update(created=self.now - timedelta(days=31 * months_old))
+        return cadence
+
+    def test_expired_cadences_are_rotated(self):
+        expired = self.create_cadence('cpt', self.targets['HR9087'], months_old=4)
+        valid = self.create_cadence('lsc', self.targets['HD173818'], months_old=1)
+
+        with mock.patch('calibrations.management.commands.settargets.timezone.now', return_value=self.now), \
+                mock.patch('calibrations.assignment.get_configdb') as get_configdb:
+            get_configdb.return_value.site_info = SITE_INFO
+            call_command('settargets', stdout=StringIO())
+
+        expired.refresh_from_db()
+        self.assertFalse(expired.active)
+        # of the eligible targets, HR9087 was the old one and HD173818 is still observed at lsc
+        new_cadence = DynamicCadence.objects.get(active=True, cadence_parameters__site='cpt')
+        self.assertEqual(new_cadence.cadence_parameters, {'site': 'cpt', 'target_id': self.targets['HR7596'].id,
+                                                          'cadence_frequency': 120})
+        self.assertEqual(new_cadence.observation_group, expired.observation_group)
+
+        valid.refresh_from_db()
+        self.assertTrue(valid.active)
+
+    def test_target_ids_from_the_forms_are_excluded(self):
+        # the NRES forms store target_id as a string; with HR7596 out, the only eligible targets are the two in use
+        expired = self.create_cadence('cpt', self.targets['HR9087'], months_old=4,
+                                      target_id=str(self.targets['HR9087'].id))
+        self.create_cadence('lsc', self.targets['HD173818'], months_old=1, target_id=str(self.targets['HD173818'].id))
+        TargetExtra.objects.filter(target__name='HR7596', key='nres_active_target').update(value='False')
+
+        with mock.patch('calibrations.management.commands.settargets.timezone.now', return_value=self.now), \
+                mock.patch('calibrations.assignment.get_configdb') as get_configdb:
+            get_configdb.return_value.site_info = SITE_INFO
+            call_command('settargets', stdout=StringIO())
+
+        self.assertEqual(DynamicCadence.objects.get(active=True, cadence_parameters__site='cpt'), expired)
 
 
-# TODO: write tests
 class TestCadenceTargetSelection(TestCase):
     def setUp(self):
-        self.targets = []
-        for target in test_targets:
-            self.targets.append(Target.objects.create(
-                name=target[0], type='SIDEREAL', ra=target[1],
-                dec=target[2]))
-
-            # TODO: add target_extras to these targets
-            # add target_extras
-            # seasonal_start=target[3], seasonal_end=target[4]
+        self.targets = create_nres_targets()
 
     def test_get_eligible_targets(self):
-        pass
+        # in season in June and for at least another three months, the longest remaining season first
+        now = datetime(2024, 6, 15, tzinfo=timezone.utc)
+        with self.assertNumQueries(1):
+            ranking = rank_eligible_targets(now=now, cadence_months=3)
+        names = dict(Target.objects.values_list('id', 'name'))
+        self.assertEqual([(names[target_id], days_left) for target_id, days_left in ranking],
+                         [('HR9087', 231), ('HD173818', 139), ('HR7596', 139)])
+
+        # seasons that roll over the end of the year
+        ranking = rank_eligible_targets(now=datetime(2024, 12, 1, tzinfo=timezone.utc), cadence_months=3,
+                                        exclude_target_ids=[self.targets[1].id])  # GJ2066
+        self.assertEqual([names[target_id] for target_id, _ in ranking], ['HR3454', 'HD76151', 'HD36395', 'HR1544'])
 
-        # valid seasonal end, current year
-        # invalid seasonal end, current year, after current month
-        # invalid seasonal end, current year, before current month
-        # valid seasonal end, next year
-        # invalid seasonal end, next year
-        # test seasonal start as well
+    def test_inactive_targets_are_not_eligible(self):
+        TargetExtra.objects.filter(target__name='HR9087', key='nres_active_target').update(value='False')
+        ranking = rank_eligible_targets(now=datetime(2024, 6, 15, tzinfo=timezone.utc), cadence_months=3)
+        self.assertNotIn(Target.objects.get(name='HR9087').id, [target_id for target_id, _ in ranking])
 
 
 class TestFacilityConfiguration(TestCase):
@@ -86,3 +205,755 @@ class TestFacilityConfiguration(TestCase):
         nres_calibration_facility = LCOCalibrationFacility()
         actual = nres_calibration_facility.facility_settings.get_setting('portal_url')
         self.assertEqual(self.expected, actual)
+
+
+class TestInstrumentFilterSync(TestCase):
+    def setUp(self):
+        for name in ('U', 'B', 'V', 'rp'):
+            Filter.objects.create(name=name, exposure_time=10, exposure_count=1)
+        self.instrument_ids = sync_instruments({
+            'fa14': {'site': 'cpt', 'enclosure': 'doma', 'telescope': '1m0a', 'type': '1M0-SCICAM-SINISTRO'},
+            'kb98': {'site': 'lsc', 'enclosure': 'aqwa', 'telescope': '0m4a', 'type': '0M4-SCICAM-SBIG'},
+        })
+
+    def filter_names(self, code):
+        return sorted(InstrumentFilter.objects.filter(instrument__code=code).values_list('filter__name', flat=True))
+
+    def test_sync_instruments_updates_changed_rows(self):
+        instrument_ids = sync_instruments({'fa14': {'site': 'cpt', 'enclosure': 'domb', 'telescope': '1m0a'}})
+        self.assertEqual(instrument_ids, {'fa14': self.instrument_ids['fa14']})
+        self.assertEqual(Instrument.objects.get(code='fa14').enclosure, 'domb')
+
+    def test_sync_instrument_filters_uses_a_constant_number_of_queries(self):
+        # Filter map, existing pairs, and one insert (plus the transaction savepoint)
+        with self.assertNumQueries(5):
+            created, deleted = sync_instrument_filters({
+                self.instrument_ids['fa14']: ['U', 'B', 'V', 'ip'],  # there is no ip Filter
+                self.instrument_ids['kb98']: ['B', 'V', 'rp'],
+            })
+        self.assertEqual((created, deleted), (6, 0))
+        self.assertEqual(self.filter_names('fa14'), ['B', 'U', 'V'])
+
+        with self.assertNumQueries(4):
+            self.assertEqual(sync_instrument_filters({self.instrument_ids['kb98']: ['B', 'V', 'rp']}), (0, 0))
+
+    def test_sync_instrument_filters_prunes_removed_filters(self):
+        sync_instrument_filters({self.instrument_ids['fa14']: ['U', 'B', 'V']})
+
+        self.assertEqual(sync_instrument_filters({self.instrument_ids['fa14']: ['B', 'rp']}), (1, 0))
+        self.assertEqual(self.filter_names('fa14'), ['B', 'U', 'V', 'rp'])
+
+        self.assertEqual(sync_instrument_filters({self.instrument_ids['fa14']: ['B', 'rp']}, prune=True), (0, 2))
+        self.assertEqual(self.filter_names('fa14'), ['B', 'rp'])
+
+
+class TestLastCalibrationAge(TestCase):
+    def setUp(self):
+        self.now = datetime(2024, 6, 30, tzinfo=timezone.utc)
+        self.target = Target.objects.create(name='HD16160', type='SIDEREAL', ra=39.02, dec=6.89)
+        self.instrument = Instrument.objects.create(site='cpt', enclosure='doma', telescope='1m0a', code='fa14')
+        self.filters = {name: Filter.objects.create(name=name, exposure_time=10, exposure_count=1)
+                        for name in ('U', 'B', 'V')}
+        for f in self.filters.values():
+            InstrumentFilter.objects.create(instrument=self.instrument, filter=f)
+
+        self.add_record(['U', 'B'], days_ago=10)
+        self.add_record(['U'], days_ago=3)
+        self.add_record(['V'], days_ago=1, status='PENDING')
+
+    def add_record(self, filter_names, days_ago, status='COMPLETED'):
+        parameters = {'instrument': self.instrument.code}
+        parameters.update({f'{name}_selected': name in filter_names for name in self.filters})
+        ObservationRecord.objects.create(target=self.target, facility='Photometric Standards',
+                                         observation_id=str(days_ago), status=status, parameters=parameters,
+                                         scheduled_end=self.now - timedelta(days=days_ago, hours=1))
+
+    def test_instrument_filters_with_last_calibration_age(self):
+        with self.assertNumQueries(2):
+            ages = {inst_filter.filter.name: inst_filter.last_calibration_age
+                    for inst_filter in InstrumentFilter.objects.with_last_calibration_age(as_of=self.now)}
+        self.assertEqual(ages, {'U': 3, 'B': 10, 'V': None})
+
+    def test_get_last_calibration_age_matches_bulk_age(self):
+        inst_filter = InstrumentFilter.objects.get(filter__name='B')
+        self.assertEqual(inst_filter.get_last_calibration_age(),
+                         (datetime.now(timezone.utc) - (self.now - timedelta(days=10, hours=1))).days)
+        self.assertIsNone(InstrumentFilter.objects.get(filter__name='V').get_last_calibration_age())
+
+    def test_instrument_filter_sets_with_last_calibration_age(self):
+        for names in (('U', 'B'), ('U', 'V')):
+            filter_set = FilterSet.objects.create()
+            filter_set.filter_combination.set([self.filters[name] for name in names])
+            InstrumentFilterSet.objects.create(instrument=self.instrument, filter_set=filter_set)
+
+        ages = [instrument_filter_set.last_calibration_age
+                for instrument_filter_set in InstrumentFilterSet.objects.order_by('id').with_last_calibration_age(
+                    as_of=self.now)]
+        self.assertEqual(ages, [10, 3])  # an uncalibrated filter counts as 0 days old
+
+
+class TestCalibrationLedger(TestCase):
+    def setUp(self):
+        self.now = datetime(2024, 6, 30, tzinfo=timezone.utc)
+        self.target = Target.objects.create(name='HD16160', type='SIDEREAL', ra=39.02, dec=6.89)
+
+    def add_record(self, parameters, days_ago, status='COMPLETED'):
+        return ObservationRecord.objects.create(target=self.target, facility='Photometric Standards',
+                                                observation_id=str(days_ago), status=status,
+                                                parameters=dict(parameters, observation_type='PHOTOMETRIC_STANDARDS'),
+                                                scheduled_end=self.now - timedelta(days=days_ago))
+
+    def ledger(self):
+        return {(entry.instrument_code, entry.filter_name): entry.observation_record.observation_id
+                for entry in LastCalibration.objects.all()}
+
+    def test_ledger_keys(self):
+        self.assertEqual(sorted(ledger_keys({'instrument': 'fa14', 'observation_type': 'PHOTOMETRIC_STANDARDS',
+                                             'U_selected': True, 'B_selected': False, 'V_selected': True})),
+                         [('fa14', 'U', 'PHOTOMETRIC_STANDARDS'), ('fa14', 'V', 'PHOTOMETRIC_STANDARDS')])
+        self.assertEqual(list(ledger_keys({'instrument': 'nres01', 'observation_type': 'NRES'})),
+                         [('nres01', '', 'NRES')])
+        self.assertEqual(list(ledger_keys({'U_selected': True})), [])
+
+    def test_completed_observations_update_the_ledger(self):
+        pending = self.add_record({'instrument': 'fa14', 'U_selected': True}, days_ago=1, status='PENDING')
+        self.add_record({'instrument': 'fa14', 'U_selected': True, 'B_selected': True}, days_ago=5)
+        self.assertEqual(self.ledger(), {('fa14', 'U'): '5', ('fa14', 'B'): '5'})
+
+        pending.status = 'COMPLETED'
+        pending.save()
+        self.assertEqual(self.ledger(), {('fa14', 'U'): '1', ('fa14', 'B'): '5'})
+
+        # a calibration that completes late doesn't replace a later one
+        self.add_record({'instrument': 'fa14', 'U_selected': True, 'B_selected': True}, days_ago=3)
+        self.assertEqual(self.ledger(), {('fa14', 'U'): '1', ('fa14', 'B'): '3'})
+
+    def test_entries_created_concurrently_are_updated(self):
+        older = self.add_record({'instrument': 'fa14', 'U_selected': True}, days_ago=5, status='PENDING')
+        later = self.add_record({'instrument': 'fa14', 'U_selected': True}, days_ago=1, status='PENDING')
+        # another process creates the entry after the ledger was read, so the first read doesn't see it
+        entry = LastCalibration.objects.create(instrument_code='fa14', filter_name='U',
+                                               calibration_type='PHOTOMETRIC_STANDARDS',
+                                               scheduled_end=older.scheduled_end, observation_record=older)
+        select_for_update = LastCalibration.objects.select_for_update
+        reads = [LastCalibration.objects.none()]
+
+        with mock.patch.object(LastCalibration.objects, 'select_for_update',
+                               side_effect=lambda: reads.pop() if reads else select_for_update()):
+            self.assertEqual(update_ledger([later]), (0, 1))
+        self.assertEqual(self.ledger(), {('fa14', 'U'): '1'})
+        self.assertGreater(LastCalibration.objects.get().modified, entry.modified)
+
+    @mock.patch('calibrations.hooks.get_service_class')
+    @mock.patch('calibrations.hooks.record_completed_calibration', side_effect=IntegrityError)
+    def test_ledger_failures_do_not_stop_data_processing(self, record_completed_calibration, get_service_class):
+        get_service_class.return_value.return_value.save_data_products.return_value = []
+        self.add_record({'instrument': 'fa14', 'U_selected': True}, days_ago=1)
+        record_completed_calibration.assert_called_once()
+        get_service_class.return_value.return_value.save_data_products.assert_called_once()
+
+    def test_rebuild_ledger(self):
+        self.add_record({'instrument': 'fa14', 'U_selected': True}, days_ago=2)
+        self.add_record({'instrument': 'fa14', 'U_selected': True, 'B_selected': True}, days_ago=4)
+        self.add_record({'instrument': 'fa15', 'V_selected': True}, days_ago=1, status='FAILED')
+        expected = self.ledger()
+        LastCalibration.objects.all().delete()
+
+        created, _ = rebuild_ledger(batch_size=1)
+        self.assertEqual(created, 2)
+        self.assertEqual(self.ledger(), expected)
+        self.assertEqual(rebuild_ledger(), (0, 0))
+
+    def test_migration_backfills_the_ledger(self):
+        self.add_record({'instrument': 'fa14', 'U_selected': True}, days_ago=2)
+        self.add_record({'instrument': 'fa14', 'U_selected': True, 'B_selected': True}, days_ago=4)
+        self.add_record({'instrument': 'nres01'}, days_ago=3)
+        expected = self.ledger()
+        LastCalibration.objects.exclude(instrument_code='nres01').delete()
+
+        migration = import_module('calibrations.migrations.0010_populate_lastcalibration')
+        migration.populate_last_calibrations(apps, None)
+        self.assertEqual(self.ledger(), expected)
+
+
+class TestCalibrationAgeHeatmap(TestCase):
+    def setUp(self):
+        invalidate_heatmap()
+        self.now = datetime(2024, 6, 30, tzinfo=timezone.utc)
+        self.target = Target.objects.create(name='HD16160', type='SIDEREAL', ra=39.02, dec=6.89)
+        filters = {name: Filter.objects.create(name=name, exposure_time=10, exposure_count=1) for name in ('U', 'B')}
+        for site, code, filter_names in (('cpt', 'fa14', ['U', 'B']), ('cpt', 'fa16', ['B']), ('lsc', 'fa15', ['U'])):
+            instrument = Instrument.objects.create(site=site, enclosure='doma', telescope='1m0a', code=code)
+            for filter_name in filter_names:
+                InstrumentFilter.objects.create(instrument=instrument, filter=filters[filter_name])
+
+    def tearDown(self):
+        invalidate_heatmap()
+
+    def complete_calibration(self, instrument_code, filter_name, days_ago):
+        ObservationRecord.objects.create(target=self.target, facility='Photometric Standards',
+                                         observation_id=f'{instrument_code}-{filter_name}', status='COMPLETED',
+                                         parameters={'instrument': instrument_code, f'{filter_name}_selected': True},
+                                         scheduled_end=self.now - timedelta(days=days_ago, hours=1))
+
+    def test_build_heatmap(self):
+        self.complete_calibration('fa14', 'U', days_ago=3)
+        self.complete_calibration('fa16', 'B', days_ago=8)
+
+        with self.assertNumQueries(3):
+            heatmap = build_heatmap(as_of=self.now)
+        self.assertEqual(heatmap['sites'], {
+            'cpt': {'instruments': ['fa14', 'fa16'], 'filters': ['B', 'U'], 'ages': [[None, 8], [3, '']]},
+            'lsc': {'instruments': ['fa15'], 'filters': ['U'], 'ages': [[None]]},
+        })
+
+    def test_completed_calibrations_invalidate_the_cached_heatmap(self):
+        self.assertEqual(get_heatmap()['sites']['lsc']['ages'], [[None]])
+        with self.assertNumQueries(0):
+            get_heatmap()
+
+        self.now = datetime.now(timezone.utc)
+        self.complete_calibration('fa15', 'U', days_ago=0)
+        self.assertEqual(get_heatmap()['sites']['lsc']['ages'], [[0]])
+
+    def test_heatmap_view(self):
+        user = User.objects.create(username='test_user')
+        self.client.force_login(user)
+        response = self.client.get(reverse('calibrations:calibration_age_heatmap'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['sites']['cpt']['instruments'], ['fa14', 'fa16'])
+
+
+class FakeCadenceStrategy:
+    """Stands in for a cadence strategy, keeping track of how many run at once against each facility"""
+    lock = threading.Lock()
+    running = {}
+    max_running = {}
+
+    def __init__(self, dynamic_cadence):
+        self.dynamic_cadence = dynamic_cadence
+
+    def run(self):
+        facility = self.dynamic_cadence.facility
+        with self.lock:
+            self.running[facility] = self.running.get(facility, 0) + 1
+            self.max_running[facility] = max(self.max_running.get(facility, 0), self.running[facility])
+            self.max_running['all'] = max(self.max_running.get('all', 0), sum(self.running.values()))
+        time.sleep(0.05)
+        with self.lock:
+            self.running[facility] -= 1
+        if self.dynamic_cadence.cadence_parameters.get('fail'):
+            raise Exception('Observation portal is down')
+        return ['new observation'] * self.dynamic_cadence.cadence_parameters.get('new_observations', 0)
+
+
+@override_settings(TOM_CADENCE_STRATEGIES=['calibrations.tests.FakeCadenceStrategy'])
+class TestCadenceRunner(TestCase):
+    def setUp(self):
+        FakeCadenceStrategy.running.clear()
+        FakeCadenceStrategy.max_running.clear()
+
+    def create_cadence(self, facility, **cadence_parameters):
+        cadence = DynamicCadence.objects.create(observation_group=ObservationGroup.objects.create(name=facility),
+                                                cadence_strategy='FakeCadenceStrategy', active=True,
+                                                cadence_parameters=cadence_parameters)
+        cadence.facility = facility
+        return cadence
+
+    def test_facility_limits(self):
+        cadences = [self.create_cadence('LCO Calibrations') for _ in range(4)]
+        cadences += [self.create_cadence('Photometric Standards') for _ in range(4)]
+
+        runner = CadenceRunner(max_workers=6, facility_limits={'LCO Calibrations': 1}, default_facility_limit=3)
+        results = runner.run(cadences)
+
+        self.assertEqual([result.status for result in results], ['unchanged'] * 8)
+        self.assertEqual(FakeCadenceStrategy.max_running['LCO Calibrations'], 1)
+        self.assertLessEqual(FakeCadenceStrategy.max_running['Photometric Standards'], 3)
+        self.assertGreater(FakeCadenceStrategy.max_running['all'], 1)
+
+    def test_failures_are_isolated(self):
+        cadences = [self.create_cadence('LCO Calibrations', new_observations=1),
+                    self.create_cadence('LCO Calibrations', fail=True),
+                    self.create_cadence('LCO Calibrations')]
+
+        runner = CadenceRunner(max_workers=2)
+        results = runner.run(cadences)
+
+        self.assertEqual([result.status for result in results], ['updated', 'failed', 'unchanged'])
+        self.assertEqual(results[0].new_observations, 1)
+        self.assertEqual(results[1].error, 'Exception: Observation portal is down')
+        self.assertTrue(runner.summary().endswith('3 cadences: 1 updated, 1 unchanged, 1 failed, 0 idle'))
+
+    def test_active_cadences_are_annotated_with_their_facility(self):
+        cadence = self.create_cadence('Photometric Standards')
+        target = Target.objects.create(name='HD16160', type='SIDEREAL', ra=39.02, dec=6.89)
+        cadence.observation_group.observation_records.add(ObservationRecord.objects.create(
+            target=target, facility='Photometric Standards', observation_id='1', parameters={}))
+        self.create_cadence('LCO Calibrations')
+        DynamicCadence.objects.create(observation_group=ObservationGroup.objects.create(name='inactive'),
+                                      cadence_strategy='FakeCadenceStrategy', active=False, cadence_parameters={})
+
+        self.assertEqual([cadence.facility for cadence in CadenceRunner.active_cadences()],
+                         ['Photometric Standards', None])
+
+    def test_idle_cadences_are_skipped(self):
+        target = Target.objects.create(name='HD16160', type='SIDEREAL', ra=39.02, dec=6.89)
+        self.create_cadence('Photometric Standards')  # no observations yet
+        for observation_id, status in (('1', 'COMPLETED'), ('2', 'PENDING'), ('3', 'PENDING')):
+            cadence = self.create_cadence('Photometric Standards')
+            cadence.observation_group.observation_records.add(ObservationRecord.objects.create(
+                target=target, facility='Photometric Standards', observation_id=observation_id, status=status,
+                parameters={}))
+
+        def update_observation_statuses(records):
+            self.assertEqual(sorted(record.observation_id for record in records), ['2', '3'])
+            ObservationRecord.objects.filter(observation_id='3').update(status='WINDOW_EXPIRED')
+
+        with mock.patch('calibrations.cadences.runner.update_observation_statuses',
+                        side_effect=update_observation_statuses) as update:
+            runner = CadenceRunner(max_workers=2)
+            results = runner.run()
+
+        update.assert_called_once()
+        self.assertEqual([result.status for result in results], ['unchanged', 'unchanged', 'idle', 'unchanged'])
+        self.assertTrue(runner.summary().endswith('0 failed, 1 idle'))
+
+    def test_partition(self):
+        Instrument.objects.create(site='cpt', enclosure='doma', telescope='1m0a', code='fa14')
+        Instrument.objects.create(site='ogg', enclosure='clma', telescope='0m4b', code='sq31')
+        fa14 = self.create_cadence('Photometric Standards', instrument_code='fa14')
+        sq31 = self.create_cadence('Photometric Standards', instrument_code='sq31')
+        nres = self.create_cadence('LCO Calibrations', site='cpt')
+        cadences = [fa14, sq31, nres]
+
+        self.assertEqual(CadencePartition(sites=['cpt']).filter(cadences), [fa14, nres])
+        self.assertEqual(CadencePartition(telescope_class='0m4').filter(cadences), [sq31])
+        self.assertEqual(CadencePartition(sites=['cpt'], telescope_class='1m0').filter(cadences), [fa14, nres])
+        shards = [CadencePartition.from_options(shard=f'{shard}/2').filter(cadences) for shard in range(2)]
+        self.assertEqual(sorted(cadence.id for shard in shards for cadence in shard), [fa14.id, sq31.id, nres.id])
+        self.assertFalse(set(shards[0]) & set(shards[1]))
+        with self.assertRaises(ValueError):
+            CadencePartition.from_options(shard='3/3')
+
+        results = CadenceRunner(max_workers=2, partition=CadencePartition(sites=['ogg'])).run(cadences)
+        self.assertEqual([result.cadence for result in results], [sq31])
+
+    def test_claimed_cadences_are_skipped(self):
+        cadence = self.create_cadence('Photometric Standards', new_observations=1)
+        CadenceLease.objects.create(cadence=cadence, runner='another runner',
+                                    expires=datetime.now(timezone.utc) + timedelta(minutes=10))
+
+        runner = CadenceRunner(max_workers=1)
+        results = runner.run([cadence])
+
+        self.assertEqual(results[0].status, 'claimed')
+        self.assertNotIn('Photometric Standards', FakeCadenceStrategy.max_running)
+        self.assertTrue(runner.summary().endswith('0 idle, 1 claimed by another runner'))
+        self.assertEqual(CadenceLease.objects.get().runner, 'another runner')
+
+    def test_leases_are_released_and_expired_leases_taken_over(self):
+        cadences = [self.create_cadence('Photometric Standards', new_observations=1) for _ in range(2)]
+        CadenceLease.objects.create(cadence=cadences[0], runner='a killed runner',
+                                    expires=datetime.now(timezone.utc) - timedelta(minutes=1))
+
+        runner = CadenceRunner(max_workers=1)
+        leased_ids = runner._claim(cadences)
+        self.assertEqual(leased_ids, {cadences[0].id, cadences[1].id})
+        self.assertEqual(CadenceRunner(max_workers=1)._claim(cadences), set())  # a second runner gets none of them
+        runner._release()
+
+        results = CadenceRunner(max_workers=1).run(cadences)
+        self.assertEqual([result.status for result in results], ['updated', 'updated'])
+        self.assertFalse(CadenceLease.objects.exists())
+
+
+@override_settings(TOM_CADENCE_STRATEGIES=['calibrations.tests.FakeCadenceStrategy'])
+class TestCadenceScheduler(TestCase):
+    def setUp(self):
+        self.now = datetime.now(timezone.utc)
+        self.target = Target.objects.create(name='HD16160', type='SIDEREAL', ra=39.02, dec=6.89)
+        self.scheduler = CadenceScheduler(runner=CadenceRunner(max_workers=2), poll_interval=2 * 60 * 60,
+                                          wake_interval=5, now=lambda: self.now)
+
+    def create_cadence(self, status=None, scheduled_end=None):
+        cadence = DynamicCadence.objects.create(observation_group=ObservationGroup.objects.create(name='cadence'),
+                                                cadence_strategy='FakeCadenceStrategy', active=True,
+                                                cadence_parameters={'cadence_frequency': 24})
+        if status:
+            cadence.observation_group.observation_records.add(ObservationRecord.objects.create(
+                target=self.target, facility='Photometric Standards', observation_id=str(cadence.id),
+                status=status, scheduled_end=scheduled_end, parameters={}))
+        return cadence
+
+    def test_next_due_times(self):
+        cadences = [self.create_cadence(),
+                    self.create_cadence('COMPLETED'),
+                    self.create_cadence('PENDING', scheduled_end=self.now + timedelta(hours=1)),
+                    self.create_cadence('PENDING', scheduled_end=self.now + timedelta(hours=5)),
+                    self.create_cadence('PENDING')]  # not scheduled: due a cadence_frequency after it was created
+        self.scheduler.build_queue()
+
+        due = dict((cadence_id, due) for due, cadence_id in self.scheduler.queue)
+        self.assertEqual([due[cadence.id] - self.now for cadence in cadences],
+                         [timedelta(0), timedelta(0), timedelta(hours=1), timedelta(hours=2), timedelta(hours=2)])
+        self.assertEqual(self.scheduler.seconds_until_next(), 0)
+
+    @mock.patch('calibrations.cadences.runner.update_observation_statuses')
+    def test_run_due(self, update_observation_statuses):
+        self.create_cadence()
+        self.create_cadence('COMPLETED')
+        self.create_cadence('PENDING', scheduled_end=self.now + timedelta(hours=1))
+
+        self.assertEqual(self.scheduler.run_due(), 2)
+        # nothing changed for the cadences that just ran, so they aren't due again until the next poll
+        self.assertEqual(self.scheduler.run_due(), 0)
+        self.assertEqual(self.scheduler.seconds_until_next(), 60 * 60)
+
+        self.now += timedelta(hours=1)
+        self.assertEqual(self.scheduler.run_due(), 1)
+        update_observation_statuses.assert_called_once()
+
+    def test_wait_wakes_up_when_an_observation_changes(self):
+        self.create_cadence('PENDING', scheduled_end=self.now + timedelta(hours=1))
+        self.scheduler.build_queue()
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            if len(sleeps) == 3:
+                ObservationRecord.objects.update(status='COMPLETED', modified=self.now + timedelta(seconds=15))
+
+        self.scheduler.sleep = sleep
+        self.assertTrue(self.scheduler.wait())
+        self.assertEqual(sleeps, [5, 5, 5])
+
+    def test_only_the_last_observations_of_queued_cadences_are_watched(self):
+        self.create_cadence('PENDING', scheduled_end=self.now + timedelta(hours=1))
+        other = ObservationRecord.objects.create(target=self.target, facility='Photometric Standards',
+                                                 observation_id='other', status='PENDING', parameters={})
+        self.scheduler.build_queue()
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            if len(sleeps) == 1:
+                ObservationRecord.objects.filter(pk=other.pk).update(modified=self.now + timedelta(seconds=5))
+            if len(sleeps) == 3:
+                ObservationRecord.objects.exclude(pk=other.pk).update(modified=self.now + timedelta(seconds=15))
+
+        self.scheduler.sleep = sleep
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(self.scheduler.wait())
+        self.assertEqual(sleeps, [5, 5, 5])
+        # the observations are read by primary key, not by scanning the table for its latest modified time
+        watermarks = [query['sql'] for query in queries.captured_queries
+                      if 'tom_observations_observationrecord' in query['sql'] and 'MAX' in query['sql']]
+        self.assertEqual(len(watermarks), 3)
+        self.assertTrue(all(' IN (' in sql for sql in watermarks))
+
+
+class TestObservationStatusUpdater(TestCase):
+    def setUp(self):
+        self.portal_url = settings.FACILITIES['LCO']['portal_url']
+        self.target = Target.objects.create(name='HD16160', type='SIDEREAL', ra=39.02, dec=6.89)
+        self.records = {observation_id: ObservationRecord.objects.create(
+            target=self.target, facility='Photometric Standards', observation_id=observation_id, status=status,
+            parameters={'instrument': 'fa14', 'observation_type': 'PHOTOMETRIC_STANDARDS', 'U_selected': True})
+            for observation_id, status in (('101', 'PENDING'), ('102', 'PENDING'), ('103', 'PENDING'),
+                                           ('104', 'COMPLETED'))}
+
+    @staticmethod
+    def block(request_id, state, start, end):
+        return {'request': {'id': int(request_id)}, 'state': state, 'start': start, 'end': end}
+
+    def add_portal_responses(self):
+        def requests_callback(request):
+            ids = parse_qs(urlparse(request.url).query)['id'][0].split(',')
+            states = {'101': 'COMPLETED', '102': 'PENDING', '104': 'COMPLETED'}  # 103 is missing from the batch
+            results = [{'id': int(request_id), 'state': states[request_id]} for request_id in ids
+                       if request_id in states]
+            return 200, {}, json.dumps({'count': len(results), 'results': results})
+
+        def observations_callback(request):
+            results = [self.block('101', 'COMPLETED', '2024-06-29T01:00:00Z', '2024-06-29T01:30:00Z'),
+                       self.block('102', 'PENDING', '2024-07-01T01:00:00Z', '2024-07-01T01:30:00Z')]
+            return 200, {}, json.dumps({'count': len(results), 'results': results})
+
+        responses.add_callback(responses.GET, f'{self.portal_url}/api/requests/', callback=requests_callback)
+        responses.add_callback(responses.GET, f'{self.portal_url}/api/observations/', callback=observations_callback)
+        # the fallback for observations missing from the batch
+        responses.add(responses.GET, f'{self.portal_url}/api/requests/103', json={'state': 'WINDOW_EXPIRED'})
+        responses.add(responses.GET, f'{self.portal_url}/api/requests/103/observations/', json=[])
+
+    @responses.activate
+    def test_statuses_are_updated_in_batches(self):
+        self.add_portal_responses()
+
+        with mock.patch('calibrations.status.requests.get', wraps=requests.get) as get:
+            changed, failed = update_observation_statuses(list(self.records.values()))
+        self.assertEqual(get.call_args_list[0].kwargs['timeout'], (settings.OBSERVATION_STATUS_CONNECT_TIMEOUT,
+                                                                   settings.OBSERVATION_STATUS_READ_TIMEOUT))
+
+        self.assertEqual(sorted(record.observation_id for record in changed), ['101', '103'])
+        self.assertEqual(failed, [])
+        self.assertEqual(len(responses.calls), 4)  # one batch, plus two requests for the missing observation
+        self.assertEqual(parse_qs(urlparse(responses.calls[0].request.url).query)['id'], ['101,102,103'])
+
+        statuses = dict(ObservationRecord.objects.values_list('observation_id', 'status'))
+        self.assertEqual(statuses, {'101': 'COMPLETED', '102': 'PENDING', '103': 'WINDOW_EXPIRED',
+                                    '104': 'COMPLETED'})
+        self.assertEqual(ObservationRecord.objects.get(observation_id='102').scheduled_end,
+                         datetime(2024, 7, 1, 1, 30, tzinfo=timezone.utc))
+        # observation_change_state ran for the observation that completed
+        self.assertEqual(LastCalibration.objects.get(filter_name='U').observation_record.observation_id, '101')
+
+    @responses.activate
+    def test_every_page_of_blocks_is_read(self):
+        responses.add(responses.GET, f'{self.portal_url}/api/requests/',
+                      json={'count': 2, 'next': None, 'results': [{'id': 101, 'state': 'PENDING'},
+                                                                  {'id': 102, 'state': 'PENDING'}]})
+
+        def observations_callback(request):
+            # the portal returns fewer blocks than the limit asked for, and a link to the rest
+            if 'offset' in parse_qs(urlparse(request.url).query):
+                page = {'next': None,
+                        'results': [self.block('102', 'PENDING', '2024-07-01T01:00:00Z', '2024-07-01T01:30:00Z')]}
+            else:
+                page = {'next': f'{self.portal_url}/api/observations/?request_id=101,102&limit=1&offset=1',
+                        'results': [self.block('101', 'PENDING', '2024-06-29T01:00:00Z', '2024-06-29T01:30:00Z')]}
+            return 200, {}, json.dumps(dict(page, count=2))
+
+        responses.add_callback(responses.GET, f'{self.portal_url}/api/observations/', callback=observations_callback)
+
+        update_observation_statuses([self.records['101'], self.records['102']])
+
+        self.assertEqual(len(responses.calls), 3)
+        scheduled_ends = dict(ObservationRecord.objects.values_list('observation_id', 'scheduled_end'))
+        self.assertEqual(scheduled_ends['101'], datetime(2024, 6, 29, 1, 30, tzinfo=timezone.utc))
+        self.assertEqual(scheduled_ends['102'], datetime(2024, 7, 1, 1, 30, tzinfo=timezone.utc))
+
+    @responses.activate
+    def test_batches_fall_back_to_single_lookups_if_the_portal_ignores_the_filter(self):
+        # the portal returns every request on the account, a page at a time, whatever ids are asked for
+        responses.add(responses.GET, f'{self.portal_url}/api/requests/',
+                      json={'count': 1000, 'next': f'{self.portal_url}/api/requests/?offset=2',
+                            'results': [{'id': 101, 'state': 'PENDING'}, {'id': 999, 'state': 'PENDING'}]})
+        responses.add(responses.GET, f'{self.portal_url}/api/requests/101', json={'state': 'COMPLETED'})
+        responses.add(responses.GET, f'{self.portal_url}/api/requests/101/observations/', json=[])
+
+        changed, failed = update_observation_statuses([self.records['101']])
+
+        self.assertEqual([record.observation_id for record in changed], ['101'])
+        self.assertEqual(failed, [])
+        # no more pages were read once an observation that wasn't asked for came back
+        self.assertEqual([urlparse(call.request.url).path for call in responses.calls],
+                         ['/api/requests/', '/api/requests/101', '/api/requests/101/observations/'])
+
+    @responses.activate
+    def test_observations_that_cannot_be_found_are_reported(self):
+        responses.add(responses.GET, re.compile(f'{re.escape(self.portal_url)}/api/.*'), status=404)
+
+        changed, failed = update_observation_statuses([self.records['101']])
+
+        self.assertEqual(changed, [])
+        self.assertEqual([observation_id for observation_id, _ in failed], ['101'])
+        self.assertEqual(ObservationRecord.objects.get(observation_id='101').status, 'PENDING')
+
+
+class TestPortalMetadataCache(TestCase):
+    def setUp(self):
+        self.portal_url = settings.FACILITIES['LCO']['portal_url']
+        self.metadata = PortalMetadataCache.for_facility(LCOSettings('LCO'))
+        self.metadata.invalidate()
+        self.addCleanup(self.metadata.invalidate)
+        self.instruments = {'1M0-NRES-SCICAM': {'name': '1.0 meter NRES', 'class': '1m0', 'type': 'SPECTRA',
+                                                'optical_elements': {}, 'modes': {}},
+                            '0M4-SCICAM-SBIG': {'name': '0.4 meter SBIG', 'class': '0m4', 'type': 'IMAGE',
+                                                'optical_elements': {}, 'modes': {}}}
+        self.profile = {'proposals': [{'id': 'NRES standards', 'title': 'NRES', 'current': True},
+                                      {'id': 'KEY2020', 'title': 'Old', 'current': False}]}
+
+    def age_entry(self, name, seconds):
+        fetched, value = self.metadata._local[name]
+        self.metadata._local[name] = (fetched - timedelta(seconds=seconds), value)
+
+    @responses.activate
+    def test_metadata_is_fetched_once(self):
+        responses.add(responses.GET, f'{self.portal_url}/api/instruments/', json=self.instruments)
+        responses.add(responses.GET, f'{self.portal_url}/api/profile/', json=self.profile)
+        target = Target.objects.create(name='HD16160', type='SIDEREAL', ra=39.02, dec=6.89)
+
+        for _ in range(3):
+            form = LCOCalibrationForm(initial={'target_id': target.id})
+            self.assertEqual(form.instrument_choices(), [('1M0-NRES-SCICAM', '1.0 meter NRES')])
+            self.assertEqual(form.proposal_choices(), [('NRES standards', 'NRES (NRES standards)')])
+
+        self.assertEqual(sorted(call.request.url for call in responses.calls),
+                         [f'{self.portal_url}/api/instruments/', f'{self.portal_url}/api/profile/'])
+
+    @responses.activate
+    def test_stale_metadata_is_refreshed_in_the_background(self):
+        responses.add(responses.GET, f'{self.portal_url}/api/instruments/', json=self.instruments)
+        self.metadata.instruments()
+        self.age_entry('instruments', settings.PORTAL_METADATA_REFRESH_AFTER)
+
+        with mock.patch('calibrations.portal.threading.Thread') as thread:
+            self.assertEqual(self.metadata.instruments(), self.instruments)
+            self.metadata.instruments()
+        thread.assert_called_once()
+        self.assertEqual(len(responses.calls), 1)
+
+        thread.call_args.kwargs['target']()
+        self.assertEqual(len(responses.calls), 2)
+        fetched, _ = self.metadata._local['instruments']
+        self.assertLess((datetime.now(timezone.utc) - fetched).total_seconds(), 60)
+
+    @responses.activate
+    def test_expired_metadata_is_used_when_the_portal_is_down(self):
+        responses.add(responses.GET, f'{self.portal_url}/api/instruments/', json=self.instruments)
+        self.metadata.instruments()
+        self.age_entry('instruments', settings.PORTAL_METADATA_CACHE_TIMEOUT)
+        responses.replace(responses.GET, f'{self.portal_url}/api/instruments/', status=503)
+
+        self.assertEqual(self.metadata.instruments(), self.instruments)
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_metadata_is_shared_through_the_django_cache(self):
+        responses.add(responses.GET, f'{self.portal_url}/api/profile/', json=self.profile)
+        self.metadata.proposals()
+
+        other_process = PortalMetadataCache(LCOSettings('LCO'))
+        self.assertEqual(other_process.proposals(), [('NRES standards', 'NRES (NRES standards)')])
+        self.assertEqual(len(responses.calls), 1)
+
+
+class TestTargetExtras(TestCase):
+    def setUp(self):
+        self.targets = []
+        for name, ra, dec, seasonal_start, seasonal_end in test_targets[:4]:
+            target = Target.objects.create(name=name, type='SIDEREAL', ra=ra, dec=dec)
+            for key, value in (('seasonal_start', seasonal_start), ('seasonal_end', seasonal_end),
+                               ('exp_time', 120), ('exp_count', '2.0'), ('standard_type', 'RV'),
+                               ('calibration_type', 'NRES'), ('nres_active_target', 'False')):
+                TargetExtra.objects.create(target=target, key=key, value=value)
+            self.targets.append(target)
+
+    def test_extras_are_typed(self):
+        extras = TargetExtras.for_target(self.targets[0])
+
+        self.assertEqual((extras.seasonal_start, extras.seasonal_end), (4, 8))
+        self.assertEqual(extras.exp_time, 120.0)
+        self.assertEqual(extras.exp_count, 2)
+        self.assertEqual(extras.standard_type, 'RV')
+        self.assertIs(extras.nres_active_target, False)
+        self.assertIsNone(extras.min_lunar_distance)
+        with self.assertRaises(AttributeError):
+            extras.not_an_extra
+
+    def test_extras_are_loaded_at_once(self):
+        with self.assertNumQueries(1):
+            target_extras = TargetExtrasCache(self.targets)
+            self.assertEqual([target_extras[target].seasonal_start for target in self.targets], [4, 12, 8, 9])
+            self.assertEqual(target_extras[self.targets[1].id].seasonal_end, 3)
+
+    def test_target_is_in_season(self):
+        target_extras = TargetExtrasCache(self.targets)
+        in_season = [target.target_is_in_season(datetime(2024, 1, 15), extras=target_extras[target])
+                     for target in self.targets]
+        self.assertEqual(in_season, [False, True, False, True])
+        self.assertTrue(self.targets[0].target_is_in_season(datetime(2024, 6, 15)))
+
+    def test_submission_form_queries_do_not_grow_with_targets(self):
+        with CaptureQueriesContext(connection) as queries:
+            NRESCadenceSubmissionForm()
+        self.assertLessEqual(len(queries), 2)
+
+
+class TestTargetSeasons(TestCase):
+    def setUp(self):
+        self.targets = {}
+        for name, ra, dec, seasonal_start, seasonal_end in test_targets[:4]:
+            target = Target.objects.create(name=name, type='SIDEREAL', ra=ra, dec=dec)
+            TargetExtra.objects.create(target=target, key='seasonal_start', value=seasonal_start)
+            TargetExtra.objects.create(target=target, key='seasonal_end', value=seasonal_end)
+            self.targets[name] = target
+
+    def test_season_months(self):
+        self.assertEqual(season_months(4, 8), [4, 5, 6, 7, 8])
+        self.assertEqual(season_months(12, 3), [12, 1, 2, 3])
+        self.assertEqual(season_months(None, 3), [])
+
+    def test_index_follows_the_extras(self):
+        self.assertEqual(sorted(self.targets['GJ2066'].season_months.values_list('month', flat=True)), [1, 2, 3, 12])
+
+        TargetExtra.objects.filter(target=self.targets['GJ2066'], key='seasonal_end').first().delete()
+        self.assertFalse(self.targets['GJ2066'].season_months.exists())
+
+        TargetExtra.objects.create(target=self.targets['GJ2066'], key='seasonal_end', value='1')
+        self.assertEqual(sorted(self.targets['GJ2066'].season_months.values_list('month', flat=True)), [1, 12])
+
+    def test_malformed_seasons_are_not_indexed(self):
+        extra = TargetExtra.objects.get(target=self.targets['GJ2066'], key='seasonal_start')
+        extra.value = 'Dec'
+        extra.save()
+        self.assertFalse(self.targets['GJ2066'].season_months.exists())
+        self.assertEqual(update_target_seasons(target.id for target in self.targets.values()), 5 + 5 + 5)
+
+    def test_in_season(self):
+        with self.assertNumQueries(1):
+            names = sorted(in_season(query_date=datetime(2024, 1, 15)).values_list('name', flat=True))
+        self.assertEqual(names, ['GJ2066', 'HD16160'])
+        for target in Target.objects.all():
+            self.assertEqual(target.target_is_in_season(datetime(2024, 1, 15)), target.name in names)
+
+        self.assertEqual(list(in_season(Target.objects.filter(name='GJ699'), datetime(2024, 6, 1))),
+                         [self.targets['GJ699']])
+
+    def test_rebuild(self):
+        TargetSeasonMonth.objects.all().delete()
+        self.assertEqual(update_target_seasons(target.id for target in self.targets.values()), 5 + 4 + 5 + 5)
+        self.assertEqual(in_season(query_date=datetime(2024, 9, 1)).count(), 2)
+
+
+class TestTargetAssignment(TestCase):
+    def setUp(self):
+        self.now = datetime(2024, 6, 15, tzinfo=timezone.utc)
+        self.locations = {site['code']: (site['lat'], site['long']) for site in SITE_INFO}
+        # both on the meridian around midnight in the (northern) summer
+        self.south = Target.objects.create(name='southern', type='SIDEREAL', ra=270, dec=-60)
+        self.north = Target.objects.create(name='northern', type='SIDEREAL', ra=270, dec=50)
+
+    def test_observable_hours(self):
+        hours = observable_hours([self.locations['cpt'], self.locations['elp']], np.array([270.0, 270.0]),
+                                 np.array([-60.0, 50.0]), self.now, months=3)
+        self.assertEqual(hours.shape, (2, 2))
+        self.assertGreater(hours[0, 0], 92 * 5)  # most of the long southern winter nights
+        self.assertEqual(hours[0, 1], 0)  # never higher than 8 degrees
+        self.assertEqual(hours[1, 0], 0)  # never rises
+        self.assertGreater(hours[1, 1], 92 * 3)  # the short northern summer nights
+
+    @mock.patch('astropy.utils.data.download_file', side_effect=AssertionError('IERS tables were downloaded'))
+    def test_observable_hours_do_not_download_iers_tables(self, download_file):
+        # far past the end of the bundled IERS-B table
+        hours = observable_hours([self.locations['cpt']], np.array([270.0]), np.array([-60.0]),
+                                 datetime(2030, 6, 15, tzinfo=timezone.utc), months=1)
+        self.assertGreater(hours[0, 0], 30 * 5)
+        download_file.assert_not_called()
+
+    def test_each_site_gets_the_target_it_can_observe_best(self):
+        target_ids = [self.north.id, self.south.id]
+        for sites in (['cpt', 'elp'], ['elp', 'cpt']):
+            self.assertEqual(assign_targets(sites, target_ids, self.now, 3, locations=self.locations),
+                             {'cpt': self.south.id, 'elp': self.north.id})
+
+        # a site isn't given back the target it has just finished with
+        self.assertEqual(assign_targets(['cpt', 'elp'], target_ids, self.now, 3, excluded={'cpt': self.south.id},
+                                        locations=self.locations), {'elp': self.north.id})
+        # sites ConfigDB doesn't know aren't assigned
+        self.assertEqual(assign_targets(['cpt', 'xyz'], target_ids, self.now, 3, locations=self.locations),
+                         {'cpt': self.south.id})
+        # nor are sites that can't observe any of the targets left
+        self.assertEqual(assign_targets(['cpt'], [self.north.id], self.now, 3, locations=self.locations), {})
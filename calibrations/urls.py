@@ -1,6 +1,6 @@
 from django.urls import path
 from django.views.generic import TemplateView
-from calibrations.views import CalibrationSubmissionView
+from calibrations.views import CalibrationAgeHeatmapView, CalibrationSubmissionView
 
 app_name = 'calibrations'
 
@@ -8,5 +8,6 @@ urlpatterns = [
     path('', CalibrationSubmissionView.as_view(), name='calibrations_index'),
     path('bias/', TemplateView.as_view(template_name="calibrations/bias_stub.html"), name='bias_home'),
     path('dark/', TemplateView.as_view(template_name="calibrations/dark_stub.html"), name='dark_home'),
+    path('heatmap/', CalibrationAgeHeatmapView.as_view(), name='calibration_age_heatmap'),
     path('flat/', TemplateView.as_view(template_name="calibrations/flat_stub.html"), name='flat_home'),
 ]
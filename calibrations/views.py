@@ -3,12 +3,14 @@ import requests
 from typing import Dict, List
 from datetime import datetime
 
-from django.views.generic import FormView, TemplateView 
+from django.views.generic import FormView, TemplateView, View
 from django.shortcuts import render
-from django.http import HttpResponse, HttpRequest
+from django.http import HttpResponse, HttpRequest, JsonResponse
 
 from tom_targets.models import Target
 
+from calibrations.heatmap import get_heatmap
+
 
 class CalibrationSubmissionView(TemplateView):
     template_name = 'calibrations/index.html'
@@ -42,6 +44,12 @@ class CalibrationsCreateView(FormView):
     pass
 
 
+class CalibrationAgeHeatmapView(View):
+    """The calibration age of every filter on every instrument in the network, as JSON (see build_heatmap)"""
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(get_heatmap())
+
 
 # def floyds_ogg(request: HttpRequest) -> HttpResponse:
 #     context = _get_context_for_index(request)
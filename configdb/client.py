@@ -0,0 +1,165 @@
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+import json
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from configdb.stream import JSONArrayStream
+
+logger = logging.getLogger(__name__)
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class ConfigDBClient(object):
+    """
+    HTTP client for ConfigDB.
+
+    All requests go through one ``requests.Session`` so that connections are pooled and kept alive. Every
+    request has a bounded (connect, read) timeout, and connection errors and 5xx responses are retried with
+    exponential backoff.
+
+    ``get_results`` remembers the ``ETag``/``Last-Modified`` validators and the decoded results of each URL it has
+    fetched. The next request for that URL is conditional, so unchanged results cost a ``304 Not Modified``
+    instead of a full download and re-parse.
+    """
+
+    def __init__(self, connect_timeout: float = 5.0, read_timeout: float = 30.0, max_retries: int = 3,
+                 backoff_factor: float = 0.5, pool_maxsize: int = 10) -> None:
+        self.timeout = (connect_timeout, read_timeout)
+
+        retry = Retry(total=max_retries,
+                      backoff_factor=backoff_factor,
+                      status_forcelist=(HTTPStatus.BAD_GATEWAY, HTTPStatus.SERVICE_UNAVAILABLE,
+                                        HTTPStatus.GATEWAY_TIMEOUT),
+                      allowed_methods=frozenset(['GET', 'HEAD']),
+                      raise_on_status=False)  # hand the last response back so callers can report its status code
+        adapter = HTTPAdapter(max_retries=retry, pool_maxsize=pool_maxsize)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # (url, projection) -> (validator headers, decoded page) of the last 200 response
+        self._validated: Dict[Any, Tuple[Dict[str, str], Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        logger.debug(f'requests.get from {url}')
+        return self.session.get(url, **kwargs)
+
+    def get_results(self, url: str, project: Optional[Callable[[dict], Any]] = None) -> Optional[List[Any]]:
+        """
+        GET ``url`` and return the items of the ``results`` array in its JSON body, or ``None`` if there isn't one.
+
+        The body is parsed as it is downloaded, and each item is passed through ``project`` (if given) as soon as
+        it has been decoded, so only the projected items are ever held in memory, rather than the whole response.
+        Results previously fetched with the same ``project`` are revalidated rather than downloaded again.
+
+        Raises ``requests.exceptions.HTTPError`` for non-2xx responses, and any other
+        ``requests.exceptions.RequestException`` for connection problems or a body that isn't JSON.
+        """
+        return self._get_page(url, project)[0]
+
+    def get_all_results(self, url: str, project: Optional[Callable[[dict], Any]] = None, page_size: int = 100,
+                        max_workers: int = 4) -> Optional[List[Any]]:
+        """
+        Like ``get_results``, but for a paginated (limit/offset) endpoint: return the results of every page.
+
+        The first page gives the total ``count``, and its length the page size the server actually uses, which is
+        less than ``page_size`` if the server caps ``limit``. The remaining pages are then fetched concurrently by up
+        to ``max_workers`` threads, and their results are concatenated in page order. If the last page still has a
+        ``next`` link (because items were added during the fetch), it is followed until there are no more pages.
+        """
+        first_page_results, extras = self._get_page(self._page_url(url, page_size, 0), project)
+        if first_page_results is None:
+            return None
+        results = list(first_page_results)  # pages are kept for revalidation, so don't extend them in place
+
+        count = extras.get('count')
+        step = len(first_page_results)
+        if count is not None and 0 < step < count:
+            offsets = range(step, count, step)
+
+            def get_page(offset):
+                return self._get_page(self._page_url(url, page_size, offset), project)
+
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(offsets)))) as executor:
+                pages = list(executor.map(get_page, offsets))
+            for page_results, extras in pages:
+                results.extend(page_results or [])
+
+        while extras.get('next'):
+            page_results, extras = self._get_page(extras['next'], project)
+            results.extend(page_results or [])
+        return results
+
+    @staticmethod
+    def _page_url(url: str, limit: int, offset: int) -> str:
+        separator = '&' if '?' in url else '?'
+        return f'{url}{separator}{urlencode({"limit": limit, "offset": offset})}'
+
+    def _get_page(self, url: str, project: Optional[Callable[[dict], Any]]) -> Tuple[Optional[List[Any]], dict]:
+        """Fetch ``url`` as described in ``get_results``, returning its results and its other top-level values"""
+        cache_key = (url, project)
+        with self._lock:
+            validators, cached_page = self._validated.get(cache_key, ({}, None))
+
+        with self.get(url, headers=self._conditional_headers(validators), stream=True) as r:
+            if r.status_code == HTTPStatus.NOT_MODIFIED and validators:
+                logger.debug(f'{url} not modified; reusing previous results')
+                return cached_page
+
+            r.raise_for_status()
+            stream = JSONArrayStream(r.iter_content(chunk_size=STREAM_CHUNK_SIZE), key='results')
+            try:
+                results = [project(item) if project else item for item in stream]
+            except json.JSONDecodeError as e:
+                raise requests.exceptions.InvalidJSONError(f'Invalid JSON from {url}: {e}', response=r)
+
+            validators = {header: r.headers[header] for header in ('ETag', 'Last-Modified') if header in r.headers}
+
+        if not stream.found:
+            results = None
+        with self._lock:
+            if validators:
+                self._validated[cache_key] = (validators, (results, stream.extras))
+            else:
+                self._validated.pop(cache_key, None)
+        return results, stream.extras
+
+    @staticmethod
+    def _conditional_headers(validators: Dict[str, str]) -> Dict[str, str]:
+        headers = {}
+        if 'ETag' in validators:
+            headers['If-None-Match'] = validators['ETag']
+        if 'Last-Modified' in validators:
+            headers['If-Modified-Since'] = validators['Last-Modified']
+        return headers
+
+
+_client: Optional[ConfigDBClient] = None
+_client_lock = threading.Lock()
+
+
+def get_configdb_client() -> ConfigDBClient:
+    """Return the process-wide ConfigDBClient, configured from the CONFIGDB_* settings."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ConfigDBClient(
+                    connect_timeout=settings.CONFIGDB_CONNECT_TIMEOUT,
+                    read_timeout=settings.CONFIGDB_READ_TIMEOUT,
+                    max_retries=settings.CONFIGDB_MAX_RETRIES,
+                    backoff_factor=settings.CONFIGDB_RETRY_BACKOFF,
+                    pool_maxsize=settings.CONFIGDB_POOL_MAXSIZE,
+                )
+    return _client
@@ -1,16 +1,32 @@
-from http import HTTPStatus
 import logging
+import threading
+import time
 import requests
 from typing import List, Dict, Any, FrozenSet, Union
 
 from deprecation import deprecated
+from django.conf import settings
 from django.core.cache import cache
+from django.db import DatabaseError, connection
 
+from configdb.client import get_configdb_client
+from configdb.models import SavedSnapshot
 from configdb.site import SiteCode, Instrument, Readout, Location, Overheads, InstrumentInfo
+from configdb.snapshot import ConfigDBSnapshot, InstrumentRecord, VersionedMemo
 from configdb.state import InstrumentState
+from configdb.stream import project_site
 
 logger = logging.getLogger(__name__)
 
+SITE_INFO_CACHE_KEY = 'configdb_site_info'
+SITE_INFO_SNAPSHOT_NAME = 'configdb_site_info'
+SITE_INFO_REFRESH_LOCK_KEY = 'configdb_site_info_refresh'
+SITE_INFO_REFRESH_LOCK_TIMEOUT = 120  # seconds; longer than a ConfigDB fetch can take, including retries
+SITE_INFO_RECHECK_INTERVAL = 10  # seconds
+
+# get_active_instruments_info results, shared by every ConfigDBInterface in the process
+active_instruments_memo = VersionedMemo()
+
 
 class ConfigDBException(Exception):
     pass
@@ -23,12 +39,17 @@ class InstrumentNotFoundException(Exception):
 class ConfigDBInterface(object):
     """
     Class for providing access to information in configdb. Used to replace both the camera_mappings file and
-    the telescopes file. It saves/loads a local file of each from disk to use in case configdb is down.
+    the telescopes file. It saves/loads a snapshot in the database (configdb.models.SavedSnapshot) to use in case
+    configdb is down.
     Proper usage is to call the update_configdb_structures once each scheduling run, then get the loaded
     in data as needed.
     """
 
     site_info: list
+    _snapshot = None
+    _fetched_at = 0.0  # when the loaded site_info was downloaded from ConfigDB
+    _checked_at = 0.0  # when the cache was last checked for a newer copy
+    _refresh_thread = None
 
     def __init__(self, configdb_url):
         self.configdb_url = configdb_url
@@ -40,69 +61,159 @@ class ConfigDBInterface(object):
         """
         Update stored site for the ConfigDBInterface instance by doing the following:
             - Get cached site info
-            - If site info isn't cached, query ConfigDB for new data
-            - If ConfigDBException, don't update site_info
+            - If site info isn't cached, load the snapshot saved in the database if it is recent enough
+            - Otherwise, query ConfigDB for new data
+            - If cached site info is older than CONFIGDB_SITE_INFO_SOFT_TTL, use it, but refresh it in the background
+            - If ConfigDBException, don't update site_info; fall back to the saved snapshot if nothing is loaded
+
+        The cache entry expires after CONFIGDB_SITE_INFO_HARD_TTL, after which it is fetched synchronously again.
         """
-        cached_site_info = cache.get('configdb_site_info')
+        self._checked_at = time.time()
+        cached_site_info = cache.get(SITE_INFO_CACHE_KEY)
+        if not isinstance(cached_site_info, dict):
+            cached_site_info = None  # entries cached before soft expiry was added hold a bare list
+
+        if not cached_site_info and not force_update:
+            # cold start: a recent enough saved snapshot is much faster to load than ConfigDB
+            if self._load_snapshot(max_age=settings.CONFIGDB_SITE_INFO_HARD_TTL):
+                return
 
         if not cached_site_info or force_update:
             try:
-                new_site_info = self._get_all_sites()
-                cache.set('configdb_site_info', new_site_info)
-                cached_site_info = new_site_info
-                self.site_info = cached_site_info
+                self._store_site_info(self._get_all_sites())
             except ConfigDBException as e:
                 logger.warning(f'update_site_info error with URL {self.configdb_url}: {e}. Reusing previous site info')
+                if not hasattr(self, 'site_info'):
+                    self._load_snapshot()
                 return
         else:
-            self.site_info = cached_site_info
+            self._use_site_info(cached_site_info['site_info'], cached_site_info['fetched_at'])
+
+    def _use_site_info(self, site_info, fetched_at):
+        self.site_info = site_info
+        self._fetched_at = fetched_at
+        if self.is_stale():
+            self.refresh_in_background()
+
+    def _store_site_info(self, site_info):
+        fetched_at = time.time()
+        cache.set(SITE_INFO_CACHE_KEY, {'site_info': site_info, 'fetched_at': fetched_at},
+                  timeout=settings.CONFIGDB_SITE_INFO_HARD_TTL)
+        self.site_info = site_info
+        self._fetched_at = fetched_at
+        # drop memoized results if ConfigDB has changed since they were computed
+        active_instruments_memo.set_version(self.snapshot.version)
+
+        if settings.CONFIGDB_SNAPSHOT_ENABLED:
+            try:
+                SavedSnapshot.save_snapshot(SITE_INFO_SNAPSHOT_NAME, {'site_info': site_info, 'fetched_at': fetched_at})
+            except DatabaseError as e:
+                logger.warning(f'Could not save the ConfigDB site info snapshot: {e}')
+
+    def _load_snapshot(self, max_age=None) -> bool:
+        """
+        Load site info from the snapshot saved in the database, unless it is older than max_age seconds. The loaded
+        site info is also cached for the rest of its hard TTL, so other workers don't need to read it again.
+        """
+        if not settings.CONFIGDB_SNAPSHOT_ENABLED:
+            return False
+        try:
+            snapshot = SavedSnapshot.load(SITE_INFO_SNAPSHOT_NAME)
+        except DatabaseError as e:
+            logger.warning(f'Could not load the ConfigDB site info snapshot: {e}')
+            return False
+        if snapshot is None:
+            return False
+
+        site_info, fetched_at = snapshot['site_info'], snapshot['fetched_at']
+        age = time.time() - fetched_at
+        if max_age is not None and age > max_age:
+            logger.info(f'The ConfigDB site info snapshot is {age:.0f}s old; not using it')
+            return False
+
+        logger.info(f'Loaded the ConfigDB site info snapshot, {age:.0f}s old')
+        remaining_ttl = settings.CONFIGDB_SITE_INFO_HARD_TTL - age
+        if remaining_ttl > 0:
+            cache.add(SITE_INFO_CACHE_KEY, {'site_info': site_info, 'fetched_at': fetched_at}, timeout=remaining_ttl)
+        self._use_site_info(site_info, fetched_at)
+        return True
+
+    def is_stale(self) -> bool:
+        return time.time() - self._fetched_at > settings.CONFIGDB_SITE_INFO_SOFT_TTL
+
+    def refresh_if_stale(self):
+        """
+        Pick up a newer site_info once the loaded one has passed its soft expiry. Checking the cache is cheap
+        but not free, so while a refresh is in flight it is only re-checked every SITE_INFO_RECHECK_INTERVAL.
+        """
+        if self.is_stale() and time.time() - self._checked_at > SITE_INFO_RECHECK_INTERVAL:
+            self.get_site_info()
+
+    def refresh_in_background(self):
+        """
+        Refresh the cached site_info in a background thread. Only the worker that takes the refresh lock does
+        the download; everyone else keeps using the stale copy until the new one is cached.
+        """
+        if not cache.add(SITE_INFO_REFRESH_LOCK_KEY, True, timeout=SITE_INFO_REFRESH_LOCK_TIMEOUT):
+            return
+        self._refresh_thread = threading.Thread(target=self._refresh_site_info, daemon=True)
+        self._refresh_thread.start()
+
+    def _refresh_site_info(self):
+        try:
+            self._store_site_info(self._get_all_sites())
+        except ConfigDBException as e:
+            logger.warning(f'Background refresh of site info from {self.configdb_url} failed: {e}. '
+                           f'Reusing previous site info')
+        finally:
+            cache.delete(SITE_INFO_REFRESH_LOCK_KEY)
+            connection.close()  # the snapshot was saved on this thread's own database connection
+
+    @property
+    def snapshot(self) -> ConfigDBSnapshot:
+        """
+        Indexed view of ``site_info``. It is rebuilt the first time it is used after a new ``site_info``
+        has been loaded, and reused until then.
+        """
+        if self._snapshot is None or self._snapshot.site_info is not self.site_info:
+            self._snapshot = ConfigDBSnapshot(self.site_info)
+        return self._snapshot
 
     @deprecated()
     def _get_all_sites(self) -> dict:
         """
-            Function returns the current structure of sites we can use for telescope info
+            Function returns the current structure of sites we can use for telescope info, reduced to the fields
+            the TOM uses (see configdb.stream.project_site)
         """
         try:
-            sites_url = self.configdb_url + 'sites/'
-            logger.debug(f"requests.get from {sites_url}")
-            r = requests.get(sites_url)
+            results = get_configdb_client().get_results(self.configdb_url + 'sites/', project=project_site)
+        except requests.exceptions.HTTPError as e:
+            raise ConfigDBException("get_all_sites failed: ConfigDB status code {}".format(e.response.status_code))
         except requests.exceptions.RequestException as e:
             msg = "{}: {}".format(e.__class__.__name__, 'get_all_sites failed: ConfigDB connection down')
 
             raise ConfigDBException(msg)
 
-        r.encoding = 'UTF-8'
-
-        if not r.status_code == HTTPStatus.OK:
-            raise ConfigDBException("get_all_sites failed: ConfigDB status code {}".format(r.status_code))
-
-        json_results = r.json()
-
-        if 'results' not in json_results:
+        if results is None:
             raise ConfigDBException("get_all_sites failed: ConfigDB returned no results")
 
-        return json_results['results']
+        return results
 
     @deprecated()
     def get_active_telescopes_info(self, site_code='all'):  # noqa
         """ Returns set of telescopes that are currently active """
         active_telescopes = {}
-        for site in self.site_info:
-            if (site['code'] == site_code or site_code == 'all') and site['active']:
-                for enclosure in site['enclosure_set']:
-                    if enclosure['active']:
-                        for telescope in enclosure['telescope_set']:
-                            if telescope['active']:
-                                telcode = '{}.{}.{}'.format(site['code'], enclosure['code'], telescope['code'])
-                                active_telescopes[telcode] = {
-                                    'latitude': site['lat'],
-                                    'longitude': site['long'],
-                                    'restart': site['restart'],
-                                    'timezone': site['tz'],
-                                    'horizon': telescope['horizon'],
-                                    'ha_limit_neg': telescope['ha_limit_neg'],
-                                    'ha_limit_pos': telescope['ha_limit_pos']
-                                }
+        for record in self.snapshot.get_telescopes(site_code):
+            if record.active:
+                active_telescopes[record.telcode] = {
+                    'latitude': record.site['lat'],
+                    'longitude': record.site['long'],
+                    'restart': record.site['restart'],
+                    'timezone': record.site['tz'],
+                    'horizon': record.telescope['horizon'],
+                    'ha_limit_neg': record.telescope['ha_limit_neg'],
+                    'ha_limit_pos': record.telescope['ha_limit_pos']
+                }
         return active_telescopes
 
     def get_instruments_types(self, site_code: str = 'all') -> list:  # noqa
@@ -111,15 +222,11 @@ class ConfigDBInterface(object):
         # TODO: define an site.InstrumentType class
         instrument_types: dict = {}  # use a dict to keep values unique; avoiding duplicates
 
-        for site in self.site_info:
-            if site['code'] == site_code or site_code == 'all':
-                for enclosure in site['enclosure_set']:
-                    for telescope in enclosure['telescope_set']:
-                        for instrument in telescope['instrument_set']:
-                            instrument_types[instrument['instrument_type']['code']] = {
-                                'code': instrument['instrument_type']['code'],
-                                'name': instrument['instrument_type']['name'],
-                                }
+        for record in self.snapshot.find_instruments(site_code=site_code):
+            instrument_types[record.instrument['instrument_type']['code']] = {
+                'code': record.instrument['instrument_type']['code'],
+                'name': record.instrument['instrument_type']['name'],
+                }
         return list(instrument_types.values())  # just return the list of values
 
     @staticmethod
@@ -127,82 +234,93 @@ class ConfigDBInterface(object):
         return everything or state == InstrumentState.SCHEDULABLE or (
                 commissioning and state == InstrumentState.COMMISSIONING) or state == InstrumentState.STANDBY
 
+    @classmethod
+    def included_states(cls, everything: bool, commissioning: bool) -> List[InstrumentState]:
+        return [state for state in InstrumentState if cls.should_include_instrument(state, everything, commissioning)]
+
+    @staticmethod
+    def _instrument_info(record: InstrumentRecord) -> dict:
+        """Build the get_active_instruments_info dictionary for a single instrument"""
+        site, enclosure, telescope, instrument = record.site, record.enclosure, record.telescope, record.instrument
+
+        oegs = []
+        oeg_change_time = 0
+        for science_camera in instrument['science_cameras']:
+            for oeg in science_camera['optical_element_groups']:
+                oeg_change_time = max(oeg['element_change_overhead'], oeg_change_time)
+                oegs.append(oeg)
+
+        named_readout_modes = []
+        default_readout_mode = None
+        for mode_type in instrument['instrument_type']['mode_types']:
+            if mode_type['type'] == 'readout':
+                named_readout_modes = mode_type['modes']
+                default_readout_mode = mode_type['default']
+                break
+
+        config_change_overheads = {
+            config_type['code']: config_type['config_change_overhead'] for config_type in
+            instrument['instrument_type']['configuration_types']}
+
+        return {
+            'state': instrument['state'].upper(),
+            'site': site['code'],
+            'observatory': enclosure['code'],
+            'telescope': telescope['code'],
+            'latitude': site['lat'],
+            'longitude': site['long'],
+            'horizon': telescope['horizon'],
+            'ha_limit_neg': telescope['ha_limit_neg'],
+            'ha_limit_pos': telescope['ha_limit_pos'],
+            'instrument_type': instrument['instrument_type']['code'].upper(),
+            'code': instrument['code'],
+            'camera_codes': [sci_cam['code'] for sci_cam in instrument['science_cameras']],
+            'ag_camera_type': instrument['autoguider_camera']['camera_type']['code'].upper(),
+            'ag_code': instrument['autoguider_camera']['code'],
+            'optical_elements': oegs,
+            'named_readout_modes': named_readout_modes,
+            'default_readout_mode': default_readout_mode,
+            'overheads': {
+                'fixed_overhead_per_exposure': instrument['instrument_type']['fixed_overhead_per_exposure'],
+                'observation_front_padding': instrument['instrument_type']['observation_front_padding'],
+                'config_front_padding': instrument['instrument_type']['config_front_padding'],
+                'filter_change_time': oeg_change_time,
+                'config_change_overhead': config_change_overheads,
+                'acquire_exposure_time': instrument['instrument_type']['acquire_exposure_time']
+            }
+        }
+
     @deprecated()
     def get_active_instruments_info(self, site_code: str = 'all',
                                     instrument_type: str = '',
                                     include_commissioning: bool = True,
                                     include_everything: bool = False) -> dict:
-        """ Returns set of instruments by telescope that are in schedulable or commissioning state """
-        active_instruments = {}
-
-        for site in self.site_info:
-            if site['code'] == site_code or site_code == 'all':
-                for enclosure in site['enclosure_set']:
-                    for telescope in enclosure['telescope_set']:
-                        for instrument in telescope['instrument_set']:
-                            if not instrument_type or case_insensitive_equals(
-                                    instrument['instrument_type']['code'], instrument_type):
-
-                                state = InstrumentState[instrument['state'].upper()]
-
-                                if self.should_include_instrument(state, include_everything, include_commissioning):
-                                    telcode = '{}.{}.{}'.format(site['code'], enclosure['code'], telescope['code'])
-
-                                    if telcode not in active_instruments:
-                                        active_instruments[telcode] = []
-
-                                    oegs = []
-                                    oeg_change_time = 0
-                                    for science_camera in instrument['science_cameras']:
-                                        for oeg in science_camera['optical_element_groups']:
-                                            oeg_change_time = max(oeg['element_change_overhead'], oeg_change_time)
-                                            oegs.append(oeg)
-
-                                    named_readout_modes = []
-                                    default_readout_mode = None
-                                    for mode_type in instrument['instrument_type']['mode_types']:
-                                        if mode_type['type'] == 'readout':
-                                            named_readout_modes = mode_type['modes']
-                                            default_readout_mode = mode_type['default']
-                                            break
-
-                                    config_change_overheads = {
-                                        config_type['code']: config_type['config_change_overhead'] for config_type in
-                                        instrument['instrument_type']['configuration_types']}
-
-                                    active_instruments[telcode].append({
-                                        'state': instrument['state'].upper(),
-                                        'site': site['code'],
-                                        'observatory': enclosure['code'],
-                                        'telescope': telescope['code'],
-                                        'latitude': site['lat'],
-                                        'longitude': site['long'],
-                                        'horizon': telescope['horizon'],
-                                        'ha_limit_neg': telescope['ha_limit_neg'],
-                                        'ha_limit_pos': telescope['ha_limit_pos'],
-                                        'instrument_type': instrument['instrument_type']['code'].upper(),
-                                        'code': instrument['code'],
-                                        'camera_codes': [sci_cam['code'] for sci_cam in instrument['science_cameras']],
-                                        'ag_camera_type': instrument['autoguider_camera']['camera_type'][
-                                            'code'].upper(),
-                                        'ag_code': instrument['autoguider_camera']['code'],
-                                        'optical_elements': oegs,
-                                        'named_readout_modes': named_readout_modes,
-                                        'default_readout_mode': default_readout_mode,
-                                        'overheads': {
-                                            'fixed_overhead_per_exposure': instrument['instrument_type'][
-                                                'fixed_overhead_per_exposure'],
-                                            'observation_front_padding': instrument['instrument_type'][
-                                                'observation_front_padding'],
-                                            'config_front_padding': instrument['instrument_type'][
-                                                'config_front_padding'],
-                                            'filter_change_time': oeg_change_time,
-                                            'config_change_overhead': config_change_overheads,
-                                            'acquire_exposure_time': instrument['instrument_type'][
-                                                'acquire_exposure_time']
-                                        }
-                                    })
-        return active_instruments
+        """ Returns set of instruments by telescope that are in schedulable or commissioning state
+
+        Results are memoized per snapshot version. The returned dict is the caller's own, but the instrument
+        dictionaries in it are shared between callers and must not be modified.
+        """
+        snapshot = self.snapshot
+        key = ('active_instruments_info', site_code, instrument_type.lower(), include_commissioning,
+               include_everything)
+
+        def compute():
+            active_instruments = {}
+            records = snapshot.find_instruments(site_code=site_code,
+                                                instrument_type=instrument_type,
+                                                states=self.included_states(include_everything,
+                                                                            include_commissioning))
+            for record in records:
+                active_instruments.setdefault(record.telcode, []).append(self._memoized_instrument_info(record))
+            return active_instruments
+
+        active_instruments = active_instruments_memo.get_or_compute(snapshot.version, key, compute)
+        return {telcode: list(instruments) for telcode, instruments in active_instruments.items()}
+
+    def _memoized_instrument_info(self, record: InstrumentRecord) -> dict:
+        return active_instruments_memo.get_or_compute(self.snapshot.version,
+                                                      ('instrument_info', record.telcode, record.code),
+                                                      lambda: self._instrument_info(record))
 
     @deprecated()
     def get_matching_instrument(self,
@@ -212,23 +330,43 @@ class ConfigDBInterface(object):
                                 instrument_type='',
                                 instrument_name='',
                                 include_everything=False):
-        active_instruments = self.get_active_instruments_info(site_code=site, include_everything=include_everything)
         telcode = '{}.{}.{}'.format(site, observatory, telescope)
 
-        for resource, active_insts in active_instruments.items():
-            s, enc, tel = resource.split('.')
-            if not observatory or observatory.lower() == enc.lower():
-                if not telescope or telescope.lower() == tel.lower():
-                    for instrument in active_insts:
-                        if not instrument_type or instrument['instrument_type'].upper() == instrument_type.upper():
-                            if not instrument_name or instrument['code'].lower() == instrument_name.lower():
-                                return instrument
+        records = self.snapshot.find_instruments(site_code=site,
+                                                 telescope=telescope,
+                                                 instrument_type=instrument_type,
+                                                 code=instrument_name,
+                                                 states=self.included_states(include_everything, True))
+        for record in records:
+            if not observatory or observatory.lower() == record.enclosure['code'].lower():
+                return self._memoized_instrument_info(record)
 
         raise InstrumentNotFoundException('Active instrument {} - {} not found on telescope {}. Either the instrument '
                                           'is not SCHEDULABLE or COMMISSIONING, or it does not exist.'
                                           .format(instrument_name, instrument_type, telcode))
 
 
+_configdb = None
+_configdb_lock = threading.Lock()
+
+
+def get_configdb() -> ConfigDBInterface:
+    """
+    Return the process-wide ConfigDBInterface for settings.CONFIGDB_URL.
+
+    The interface (and with it the first ConfigDB/cache load) is only created the first time this is called, so
+    importing a module that uses ConfigDB doesn't touch it. Every caller in the process shares the same instance,
+    which picks up refreshed site info once what it holds has passed its soft expiry.
+    """
+    global _configdb
+    if _configdb is None:
+        with _configdb_lock:
+            if _configdb is None:
+                _configdb = ConfigDBInterface(settings.CONFIGDB_URL)
+    _configdb.refresh_if_stale()
+    return _configdb
+
+
 def case_insensitive_equals(str1, str2):
     return str1.lower() == str2.lower()
 
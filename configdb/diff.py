@@ -0,0 +1,120 @@
+import hashlib
+import json
+from typing import Dict, Iterable, List, Optional
+
+from configdb.models import SavedSnapshot
+
+
+def summarize_instrument(instrument: dict) -> dict:
+    """
+    Reduce an instrument from the ConfigDB ``/instruments/`` endpoint to the fields the TOM syncs from it.
+
+    ``optical_elements`` maps each science camera code to the sorted codes of its filters.
+    """
+    site, enclosure, telescope, code = instrument['__str__'].split('.')
+    optical_elements = {}
+    camera_types = {}
+    for camera in instrument.get('science_cameras', []):
+        camera_types[camera['code']] = (camera.get('camera_type', {}).get('code') or '').upper()
+        optical_elements[camera['code']] = sorted(
+            oe['code']
+            for oe_group in camera.get('optical_element_groups', []) if oe_group.get('type') == 'filters'
+            for oe in oe_group.get('optical_elements', [])
+        )
+
+    return {
+        'instrument': instrument['__str__'],
+        'site': site,
+        'enclosure': enclosure,
+        'telescope': telescope,
+        'code': code,
+        'state': instrument.get('state'),
+        'instrument_type': instrument['instrument_type']['code'].upper(),  # the TOM uses ALL CAPS
+        'instrument_category': instrument['instrument_type'].get('instrument_category'),
+        'camera_types': camera_types,
+        'optical_elements': optical_elements,
+    }
+
+
+def summarize_instruments(instruments: Iterable[dict]) -> Dict[str, dict]:
+    """Summaries of ConfigDB instruments, keyed by their full site.enclosure.telescope.code designation"""
+    summaries = {}
+    for instrument in instruments:
+        summary = summarize_instrument(instrument)
+        summaries[summary['instrument']] = summary
+    return summaries
+
+
+def is_schedulable_imager(summary: dict) -> bool:
+    """Whether importinstruments syncs this instrument: only schedulable imagers are imported"""
+    # TODO: include COMMISSIONING
+    # TODO: filter SOAR
+    if summary['instrument_category'] != 'IMAGE' or summary['state'] != 'SCHEDULABLE':
+        return False
+    # TODO: include MuSCAT, exclude guide cameras
+    return not (summary['site'] == 'sor' or any(x in summary['code'] for x in ['mc', 'xx']))
+
+
+def snapshot_hash(summaries: Dict[str, dict]) -> str:
+    return hashlib.sha1(json.dumps(summaries, sort_keys=True).encode('UTF-8')).hexdigest()
+
+
+class InstrumentDelta(object):
+    """
+    Instrument-level difference between two snapshots of instrument summaries.
+
+    Each attribute is a list of summaries from the newer snapshot, except ``removed``, which holds summaries from
+    the older one. An instrument may be in more than one of the ``*_changed`` lists.
+    """
+
+    def __init__(self) -> None:
+        self.added: List[dict] = []
+        self.removed: List[dict] = []
+        self.state_changed: List[dict] = []
+        self.type_changed: List[dict] = []
+        self.optical_elements_changed: List[dict] = []
+
+    @property
+    def changed(self) -> List[dict]:
+        """Instruments that were added or changed in any way, each listed once"""
+        changed = {}
+        for summary in (self.added + self.state_changed + self.type_changed + self.optical_elements_changed):
+            changed[summary['instrument']] = summary
+        return list(changed.values())
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.state_changed or self.type_changed or
+                    self.optical_elements_changed)
+
+    def __str__(self) -> str:
+        return (f'{len(self.added)} added, {len(self.removed)} removed, {len(self.state_changed)} state changed, '
+                f'{len(self.type_changed)} type changed, '
+                f'{len(self.optical_elements_changed)} optical elements changed')
+
+
+def diff_instruments(previous: Dict[str, dict], current: Dict[str, dict]) -> InstrumentDelta:
+    delta = InstrumentDelta()
+    for designation, summary in current.items():
+        old = previous.get(designation)
+        if old is None:
+            delta.added.append(summary)
+            continue
+        if old['state'] != summary['state']:
+            delta.state_changed.append(summary)
+        if old['instrument_type'] != summary['instrument_type']:
+            delta.type_changed.append(summary)
+        if (old['optical_elements'] != summary['optical_elements'] or
+                old['camera_types'] != summary['camera_types']):
+            delta.optical_elements_changed.append(summary)
+
+    delta.removed = [summary for designation, summary in previous.items() if designation not in current]
+    return delta
+
+
+def get_previous_snapshot(name: str) -> Optional[dict]:
+    """The last snapshot saved by ``save_snapshot``, as ``{'hash': ..., 'instruments': ...}``, if there is one"""
+    return SavedSnapshot.load(name)
+
+
+def save_snapshot(name: str, summaries: Dict[str, dict], summaries_hash: Optional[str] = None) -> None:
+    SavedSnapshot.save_snapshot(name, {'hash': summaries_hash or snapshot_hash(summaries), 'instruments': summaries})
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.10 on 2026-10-17 19:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SavedSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('data', models.BinaryField()),
+                ('modified', models.DateTimeField(auto_now=True, help_text='The time which this snapshot was saved in the TOM database.', verbose_name='Last Modified')),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+import logging
+from typing import Optional
+
+from django.db import models
+
+from configdb.snapshot import decode_snapshot, encode_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+class SavedSnapshot(models.Model):
+    """
+    A snapshot of data fetched from ConfigDB, such as the site info to fall back on while ConfigDB is down, saved
+    under a unique ``name``.
+
+    Snapshots are kept in the database rather than on disk so that they are shared by every pod and CronJob of the
+    TOM and outlive them: each pod's /tmp is an in-memory volume that is gone as soon as the pod is.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    data = models.BinaryField()
+    modified = models.DateTimeField(
+        auto_now=True, verbose_name='Last Modified',
+        help_text='The time which this snapshot was saved in the TOM database.'
+    )
+
+    def __str__(self):
+        return f'{self.name} ({self.modified})'
+
+    @classmethod
+    def load(cls, name: str) -> Optional[dict]:
+        """The snapshot saved as ``name``, or None if there isn't one or it can't be read"""
+        data = cls.objects.filter(name=name).values_list('data', flat=True).first()
+        if data is None:
+            return None
+        return decode_snapshot(bytes(data), name=f'snapshot {name}')
+
+    @classmethod
+    def save_snapshot(cls, name: str, snapshot: dict) -> None:
+        """Save ``snapshot`` as ``name``, replacing the one saved before"""
+        cls.objects.update_or_create(name=name, defaults={'data': encode_snapshot(snapshot)})
@@ -0,0 +1,204 @@
+import hashlib
+import json
+import logging
+import pickle
+import threading
+import zlib
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Set
+
+from configdb.state import InstrumentState
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b'CFGDBSNP'
+SNAPSHOT_FORMAT_VERSION = 1
+
+
+class TelescopeRecord(object):
+    """A telescope from the ConfigDB site tree, along with the site and enclosure that contain it.
+    """
+    def __init__(self, site: dict, enclosure: dict, telescope: dict) -> None:
+        self.site = site
+        self.enclosure = enclosure
+        self.telescope = telescope
+
+    @property
+    def telcode(self) -> str:
+        return '{}.{}.{}'.format(self.site['code'], self.enclosure['code'], self.telescope['code'])
+
+    @property
+    def active(self) -> bool:
+        return self.site['active'] and self.enclosure['active'] and self.telescope['active']
+
+
+class InstrumentRecord(TelescopeRecord):
+    """An instrument from the ConfigDB site tree, along with the site, enclosure and telescope it is installed on.
+    """
+    def __init__(self, site: dict, enclosure: dict, telescope: dict, instrument: dict) -> None:
+        super().__init__(site, enclosure, telescope)
+        self.instrument = instrument
+        try:
+            self.state: Optional[InstrumentState] = InstrumentState[instrument['state'].upper()]
+        except KeyError:
+            self.state = None  # a state this TOM doesn't know about; never matched by a state lookup
+
+    @property
+    def code(self) -> str:
+        return self.instrument['code']
+
+    @property
+    def instrument_type(self) -> str:
+        return self.instrument['instrument_type']['code']
+
+
+class ConfigDBSnapshot(object):
+    """
+    Flattened, indexed view of the ConfigDB ``site_info`` tree.
+
+    The site -> enclosure -> telescope -> instrument tree is walked once, when the snapshot is built. Instruments
+    are then indexed by code, site, telescope code, instrument type and state, so that lookups are dictionary hits
+    instead of nested-loop scans. Each index maps a key to the positions of the matching instruments in
+    ``self.instruments``, which keeps ConfigDB ordering when several criteria are intersected.
+
+    Code, telescope and instrument type keys are lower-cased (ConfigDB uses mixed case); site codes are not.
+    """
+
+    def __init__(self, site_info: list) -> None:
+        self.site_info = site_info
+        self._version: Optional[str] = None
+        self.telescopes: List[TelescopeRecord] = []
+        self.instruments: List[InstrumentRecord] = []
+
+        self._telescopes_by_site: Dict[str, List[TelescopeRecord]] = {}
+        self._by_code: Dict[str, List[int]] = {}
+        self._by_site: Dict[str, List[int]] = {}
+        self._by_telescope: Dict[str, List[int]] = {}
+        self._by_type: Dict[str, List[int]] = {}
+        self._by_state: Dict[InstrumentState, List[int]] = {}
+
+        for site in site_info:
+            for enclosure in site['enclosure_set']:
+                for telescope in enclosure['telescope_set']:
+                    telescope_record = TelescopeRecord(site, enclosure, telescope)
+                    self.telescopes.append(telescope_record)
+                    self._telescopes_by_site.setdefault(site['code'], []).append(telescope_record)
+
+                    for instrument in telescope.get('instrument_set', []):
+                        self._add_instrument(InstrumentRecord(site, enclosure, telescope, instrument))
+
+    def _add_instrument(self, record: InstrumentRecord) -> None:
+        position = len(self.instruments)
+        self.instruments.append(record)
+
+        self._by_code.setdefault(record.code.lower(), []).append(position)
+        self._by_site.setdefault(record.site['code'], []).append(position)
+        self._by_telescope.setdefault(record.telescope['code'].lower(), []).append(position)
+        self._by_type.setdefault(record.instrument_type.lower(), []).append(position)
+        if record.state is not None:
+            self._by_state.setdefault(record.state, []).append(position)
+
+    @property
+    def version(self) -> str:
+        """Content hash of ``site_info``; equal snapshots have equal versions wherever they were loaded."""
+        if self._version is None:
+            self._version = hashlib.sha1(json.dumps(self.site_info, sort_keys=True).encode('UTF-8')).hexdigest()
+        return self._version
+
+    def get_telescopes(self, site_code: str = 'all') -> List[TelescopeRecord]:
+        if site_code == 'all':
+            return self.telescopes
+        return self._telescopes_by_site.get(site_code, [])
+
+    def find_instruments(self, site_code: str = 'all', telescope: str = '', instrument_type: str = '',
+                         code: str = '', states: Optional[Iterable[InstrumentState]] = None) -> List[InstrumentRecord]:
+        """Return the instruments matching every given criterion, in ConfigDB order.
+
+        Empty criteria (and a ``site_code`` of 'all') match everything. ``states`` is a collection of
+        ``InstrumentState``; ``None`` matches any state.
+        """
+        candidates: List[Iterable[int]] = []
+        if site_code != 'all':
+            candidates.append(self._by_site.get(site_code, []))
+        if telescope:
+            candidates.append(self._by_telescope.get(telescope.lower(), []))
+        if instrument_type:
+            candidates.append(self._by_type.get(instrument_type.lower(), []))
+        if code:
+            candidates.append(self._by_code.get(code.lower(), []))
+        if states is not None:
+            candidates.append([position for state in states for position in self._by_state.get(state, [])])
+
+        if not candidates:
+            return list(self.instruments)
+
+        # intersect starting from the smallest candidate list
+        candidates.sort(key=len)
+        positions: Set[int] = set(candidates[0])
+        for other in candidates[1:]:
+            if not positions:
+                break
+            positions.intersection_update(other)
+
+        return [self.instruments[position] for position in sorted(positions)]
+
+
+class VersionedMemo(object):
+    """
+    Process-wide memo of results computed from a ConfigDB snapshot.
+
+    Entries are keyed on the caller's key and are only valid for one snapshot ``version``. As soon as a
+    different version is seen, every entry computed from the previous version is evicted.
+    """
+
+    def __init__(self) -> None:
+        self.version: Optional[str] = None
+        self._results: Dict[Hashable, Any] = {}
+        self._lock = threading.Lock()
+
+    def set_version(self, version: str) -> None:
+        with self._lock:
+            if version != self.version:
+                self.version = version
+                self._results = {}
+
+    def get_or_compute(self, version: str, key: Hashable, compute: Callable[[], Any]) -> Any:
+        self.set_version(version)
+        results = self._results
+        try:
+            return results[key]
+        except KeyError:
+            pass
+
+        result = compute()
+        with self._lock:
+            if version == self.version:
+                self._results[key] = result
+        return result
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+
+def encode_snapshot(snapshot: dict) -> bytes:
+    """
+    Serialize a snapshot of ConfigDB data as a zlib-compressed pickle, prefixed by a magic string and a format
+    version (see ``configdb.models.SavedSnapshot``).
+    """
+    return SNAPSHOT_MAGIC + bytes([SNAPSHOT_FORMAT_VERSION]) + zlib.compress(
+        pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def decode_snapshot(data: bytes, name: str = 'snapshot') -> Optional[dict]:
+    """
+    Load a snapshot serialized by ``encode_snapshot``. Returns ``None`` if it can't be read or has another format
+    version; ``name`` is only used to log why.
+    """
+    header = SNAPSHOT_MAGIC + bytes([SNAPSHOT_FORMAT_VERSION])
+    if not data.startswith(header):
+        logger.warning(f'Ignoring ConfigDB {name}: unknown format')
+        return None
+    try:
+        return pickle.loads(zlib.decompress(data[len(header):]))
+    except (zlib.error, pickle.UnpicklingError, EOFError) as e:
+        logger.warning(f'Ignoring corrupt ConfigDB {name}: {e}')
+        return None
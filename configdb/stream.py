@@ -0,0 +1,155 @@
+import codecs
+import json
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+WHITESPACE = ' \t\n\r'
+
+
+class JSONArrayStream(object):
+    """
+    Incrementally parse a JSON object of the form ``{..., "results": [item, item, ...], ...}`` from an iterable
+    of byte chunks, such as ``requests.Response.iter_content()``, yielding the items of the ``key`` array one at a
+    time.
+
+    Only the item being decoded (plus one chunk) is held in memory, so a large response never has to be read or
+    decoded in full. The other top-level values (``count``, ``next``...) are kept in ``extras`` once iteration has
+    finished, and ``found`` says whether the array was there at all.
+
+    Malformed or truncated JSON raises ``json.JSONDecodeError``.
+    """
+
+    def __init__(self, chunks: Iterable[bytes], key: str = 'results', encoding: str = 'UTF-8') -> None:
+        self.key = key
+        self.found = False
+        self.extras: Dict[str, Any] = {}
+
+        self._chunks = iter(chunks)
+        self._text_decoder = codecs.getincrementaldecoder(encoding)()
+        self._json_decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._position = 0
+        self._eof = False
+
+    def _fill(self) -> None:
+        """Drop what has been parsed from the buffer and read the next chunk onto the end of it"""
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._eof = True
+            text = self._text_decoder.decode(b'', final=True)
+        else:
+            text = self._text_decoder.decode(chunk)
+        self._buffer = self._buffer[self._position:] + text
+        self._position = 0
+
+    def _skip_whitespace(self) -> None:
+        while True:
+            while self._position < len(self._buffer) and self._buffer[self._position] in WHITESPACE:
+                self._position += 1
+            if self._position < len(self._buffer) or self._eof:
+                return
+            self._fill()
+
+    def _next_character(self) -> str:
+        self._skip_whitespace()
+        if self._position >= len(self._buffer):
+            raise json.JSONDecodeError('Unexpected end of data', self._buffer, self._position)
+        character = self._buffer[self._position]
+        self._position += 1
+        return character
+
+    def _expect(self, *expected: str) -> str:
+        character = self._next_character()
+        if character not in expected:
+            raise json.JSONDecodeError(f'Expecting one of {expected!r}', self._buffer, self._position - 1)
+        return character
+
+    def _decode_value(self) -> Any:
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+                self._fill()  # the value continues in the next chunk
+                continue
+            if end == len(self._buffer) and not self._eof:
+                # a number cut off by the end of the chunk still decodes; make sure it is complete
+                self._fill()
+                continue
+            self._position = end
+            return value
+
+    def __iter__(self) -> Iterator[Any]:
+        self._expect('{')
+        self._skip_whitespace()
+        if self._buffer[self._position:self._position + 1] == '}':
+            return
+
+        while True:
+            name = self._decode_value()
+            self._expect(':')
+            if name == self.key:
+                self.found = True
+                yield from self._iter_array()
+            else:
+                self.extras[name] = self._decode_value()
+
+            if self._expect(',', '}') == '}':
+                return
+
+    def _iter_array(self) -> Iterator[Any]:
+        self._expect('[')
+        self._skip_whitespace()
+        if self._buffer[self._position:self._position + 1] == ']':
+            self._position += 1
+            return
+        while True:
+            yield self._decode_value()
+            if self._expect(',', ']') == ']':
+                return
+
+
+def _pick(source: Optional[dict], keys: Iterable[str]) -> dict:
+    source = source or {}
+    return {key: source[key] for key in keys if key in source}
+
+
+def project_instrument(instrument: dict) -> dict:
+    """
+    Reduce a ConfigDB instrument to the fields the TOM uses: code, state, type and overheads, readout modes,
+    science cameras with their optical element groups, and the autoguider.
+    """
+    projected = _pick(instrument, ('__str__', 'code', 'state'))
+    projected['instrument_type'] = _pick(instrument.get('instrument_type'), (
+        'code', 'name', 'instrument_category', 'fixed_overhead_per_exposure', 'observation_front_padding',
+        'config_front_padding', 'acquire_exposure_time', 'mode_types'))
+    if 'configuration_types' in instrument.get('instrument_type', {}):
+        projected['instrument_type']['configuration_types'] = [
+            _pick(config_type, ('code', 'config_change_overhead')) if isinstance(config_type, dict) else config_type
+            for config_type in instrument['instrument_type']['configuration_types']]
+    projected['science_cameras'] = [
+        dict(_pick(camera, ('code', 'optical_element_groups')),
+             camera_type=_pick(camera.get('camera_type'), ('code',)))
+        for camera in instrument.get('science_cameras', [])]
+    if 'autoguider_camera' in instrument:
+        projected['autoguider_camera'] = dict(_pick(instrument['autoguider_camera'], ('code',)),
+                                              camera_type=_pick(instrument['autoguider_camera'].get('camera_type'),
+                                                                ('code',)))
+    return projected
+
+
+def project_site(site: dict) -> dict:
+    """Reduce a ConfigDB site, and the enclosures, telescopes and instruments in it, to the fields the TOM uses"""
+    projected = _pick(site, ('code', 'active', 'lat', 'long', 'restart', 'tz'))
+    projected['enclosure_set'] = []
+    for enclosure in site.get('enclosure_set', []):
+        projected_enclosure = _pick(enclosure, ('code', 'active'))
+        projected_enclosure['telescope_set'] = []
+        for telescope in enclosure.get('telescope_set', []):
+            projected_telescope = _pick(telescope, ('code', 'active', 'horizon', 'ha_limit_neg', 'ha_limit_pos'))
+            projected_telescope['instrument_set'] = [project_instrument(instrument)
+                                                     for instrument in telescope.get('instrument_set', [])]
+            projected_enclosure['telescope_set'].append(projected_telescope)
+        projected['enclosure_set'].append(projected_enclosure)
+    return projected
@@ -0,0 +1,108 @@
+import json
+import threading
+import unittest
+from unittest import mock
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from configdb.client import ConfigDBClient
+
+SITES = {'count': 1, 'results': [{'code': 'cpt', 'enclosure_set': []}]}
+INSTRUMENTS = [{'code': f'fa{number:02d}'} for number in range(7)]
+
+
+class StubConfigDBHandler(BaseHTTPRequestHandler):
+    """Serves SITES at /sites/ with an ETag, INSTRUMENTS paginated at /instruments/, and a 503 at /down/."""
+    etag = '"v1"'
+    max_limit = 1000
+
+    def do_GET(self):  # noqa
+        self.server.requests.append((self.path, dict(self.headers)))
+        url = urlparse(self.path)
+        if url.path == '/instruments/':
+            query = parse_qs(url.query)
+            limit, offset = min(int(query['limit'][0]), self.max_limit), int(query['offset'][0])
+            self.send_json({'count': len(INSTRUMENTS), 'results': INSTRUMENTS[offset:offset + limit]})
+        elif self.path == '/down/':
+            self.send_response(HTTPStatus.SERVICE_UNAVAILABLE)
+            self.end_headers()
+        elif self.headers.get('If-None-Match') == self.etag:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header('ETag', self.etag)
+            self.end_headers()
+        else:
+            body = json.dumps(SITES).encode('UTF-8')
+            self.send_response(HTTPStatus.OK)
+            self.send_header('ETag', self.etag)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def send_json(self, document):
+        body = json.dumps(document).encode('UTF-8')
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # noqa
+        pass
+
+
+class TestConfigDBClient(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubConfigDBHandler)
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.client = ConfigDBClient(connect_timeout=1, read_timeout=1, max_retries=2, backoff_factor=0)
+
+    def tearDown(self):  # noqa
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get_results_streams_and_projects(self):
+        def project(site):
+            return site['code']
+
+        results = self.client.get_results(f'{self.url}/sites/', project=project)
+        self.assertEqual(results, ['cpt'])
+
+        self.assertIs(self.client.get_results(f'{self.url}/sites/', project=project), results)  # revalidated
+        self.assertNotIn('If-None-Match', self.server.requests[0][1])
+        self.assertEqual(self.server.requests[1][1]['If-None-Match'], '"v1"')
+
+    def test_get_all_results_fetches_every_page(self):
+        results = self.client.get_all_results(f'{self.url}/instruments/', page_size=3, max_workers=2)
+
+        self.assertEqual(results, INSTRUMENTS)
+        self.assertEqual(sorted(path for path, _ in self.server.requests),
+                         ['/instruments/?limit=3&offset=0', '/instruments/?limit=3&offset=3',
+                          '/instruments/?limit=3&offset=6'])
+
+    @mock.patch.object(StubConfigDBHandler, 'max_limit', 2)
+    def test_get_all_results_steps_by_the_server_page_size(self):
+        results = self.client.get_all_results(f'{self.url}/instruments/', page_size=3, max_workers=2)
+
+        self.assertEqual(results, INSTRUMENTS)
+        self.assertEqual(sorted(path for path, _ in self.server.requests),
+                         ['/instruments/?limit=3&offset=0', '/instruments/?limit=3&offset=2',
+                          '/instruments/?limit=3&offset=4', '/instruments/?limit=3&offset=6'])
+
+    def test_server_errors_are_retried_then_raised(self):
+        with self.assertRaises(requests.exceptions.HTTPError) as context:
+            self.client.get_results(f'{self.url}/down/')
+
+        self.assertEqual(context.exception.response.status_code, HTTPStatus.SERVICE_UNAVAILABLE)
+        self.assertEqual(len(self.server.requests), 3)  # the first attempt and two retries
+
+    def test_connection_errors_are_raised(self):
+        self.server.shutdown()
+        self.server.server_close()
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.client.get_results(f'{self.url}/sites/')
@@ -0,0 +1,54 @@
+import copy
+import json
+import os
+import unittest
+
+from configdb.diff import diff_instruments, is_schedulable_imager, snapshot_hash, summarize_instruments
+
+with open(os.path.join(os.path.dirname(__file__), 'data/test_instrument_sites.json'), 'r') as f:
+    instrument_sites = json.load(f)
+
+# the /instruments/ endpoint returns the same instruments as /sites/, flattened
+instruments = [instrument
+               for site in instrument_sites['results']
+               for enclosure in site['enclosure_set']
+               for telescope in enclosure['telescope_set']
+               for instrument in telescope['instrument_set']]
+
+
+class TestInstrumentDiff(unittest.TestCase):
+    def setUp(self):
+        self.previous = summarize_instruments(instruments)
+
+    def test_summaries(self):
+        fa14 = self.previous['cpt.doma.1m0a.fa14']
+        self.assertEqual(fa14['code'], 'fa14')
+        self.assertEqual(fa14['instrument_type'], '1M0-SCICAM-SINISTRO')
+        self.assertEqual(fa14['optical_elements'], {'fa14': ['B', 'U', 'V', 'ip', 'rp']})
+        self.assertTrue(is_schedulable_imager(fa14))
+        self.assertFalse(is_schedulable_imager(self.previous['cpt.domc.1m0a.nres03']))
+
+    def test_unchanged_snapshots_have_the_same_hash(self):
+        current = summarize_instruments(copy.deepcopy(instruments))
+        self.assertEqual(snapshot_hash(current), snapshot_hash(self.previous))
+        self.assertFalse(diff_instruments(self.previous, current))
+
+    def test_diff_instruments(self):
+        changed = copy.deepcopy(instruments)
+        changed[0]['state'] = 'DISABLED'
+        changed[1]['instrument_type']['code'] = '1m0-NRES-SciCam-2'
+        changed[2]['science_cameras'][0]['optical_element_groups'][0]['optical_elements'].pop()
+        del changed[3]
+        changed.append(dict(changed[4], __str__='ogg.clma.0m4c.kb28'))
+        delta = diff_instruments(self.previous, summarize_instruments(changed))
+
+        self.assertEqual([summary['code'] for summary in delta.state_changed], ['fa14'])
+        self.assertEqual([summary['code'] for summary in delta.type_changed], ['nres03'])
+        self.assertEqual([summary['code'] for summary in delta.optical_elements_changed], ['fa15'])
+        self.assertEqual([summary['code'] for summary in delta.removed], ['kb98'])
+        self.assertEqual([summary['code'] for summary in delta.added], ['kb28'])
+        self.assertEqual(len(delta.changed), 4)
+
+    def test_everything_is_added_without_a_previous_snapshot(self):
+        delta = diff_instruments({}, self.previous)
+        self.assertEqual(len(delta.added), len(instruments))
@@ -0,0 +1,267 @@
+import json
+import os
+import time
+import unittest
+from http import HTTPStatus
+
+import responses
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from configdb import configdb_connections
+from configdb.configdb_connections import (ConfigDBInterface, InstrumentNotFoundException, active_instruments_memo,
+                                           get_configdb)
+from configdb.models import SavedSnapshot
+from configdb.snapshot import ConfigDBSnapshot, VersionedMemo, decode_snapshot, encode_snapshot
+from configdb.state import InstrumentState
+
+with open(os.path.join(os.path.dirname(__file__), 'data/test_instrument_sites.json'), 'r') as f:
+    instrument_sites = json.load(f)
+
+
+class TestConfigDBSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.snapshot = ConfigDBSnapshot(instrument_sites['results'])
+
+    def test_find_instruments_keeps_configdb_order(self):
+        codes = [record.code for record in self.snapshot.find_instruments()]
+        self.assertEqual(codes, ['fa14', 'nres03', 'fa15', 'kb98', 'en06', 'kb27'])
+
+    def test_find_instruments_by_code_is_case_insensitive(self):
+        records = self.snapshot.find_instruments(code='FA14')
+        self.assertEqual([record.telcode for record in records], ['cpt.doma.1m0a'])
+
+    def test_find_instruments_intersects_criteria(self):
+        records = self.snapshot.find_instruments(site_code='lsc', instrument_type='1m0-scicam-sinistro')
+        self.assertEqual([record.code for record in records], ['fa15'])
+
+        records = self.snapshot.find_instruments(telescope='0m4B', states=[InstrumentState.MANUAL])
+        self.assertEqual([record.code for record in records], ['kb27'])
+
+        self.assertEqual(self.snapshot.find_instruments(site_code='ogg', code='fa14'), [])
+
+    def test_get_telescopes_by_site(self):
+        telcodes = [record.telcode for record in self.snapshot.get_telescopes('ogg')]
+        self.assertEqual(telcodes, ['ogg.clma.2m0a', 'ogg.clma.0m4b'])
+        self.assertEqual(self.snapshot.get_telescopes('xyz'), [])
+
+
+class TestVersionedMemo(unittest.TestCase):
+    def test_get_or_compute_memoizes_per_version(self):
+        memo = VersionedMemo()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(memo.get_or_compute('v1', 'key', compute), 1)
+        self.assertEqual(memo.get_or_compute('v1', 'key', compute), 1)
+        self.assertEqual(len(calls), 1)
+
+        # a new version evicts everything computed from the old one
+        self.assertEqual(memo.get_or_compute('v2', 'key', compute), 2)
+        self.assertEqual(len(memo), 1)
+
+    def test_snapshot_version_is_content_hash(self):
+        snapshot = ConfigDBSnapshot(instrument_sites['results'])
+        same_content = ConfigDBSnapshot(json.loads(json.dumps(instrument_sites['results'])))
+        different_content = ConfigDBSnapshot(instrument_sites['results'][:1])
+
+        self.assertEqual(snapshot.version, same_content.version)
+        self.assertNotEqual(snapshot.version, different_content.version)
+
+
+@override_settings(CONFIGDB_SNAPSHOT_ENABLED=False)
+class TestConfigDBInterfaceLookups(SimpleTestCase):
+    def setUp(self):
+        self.config_db_url = 'http://some-url'
+        responses.start()
+        responses.add(responses.GET, f'{self.config_db_url}/sites/', json=instrument_sites, status=HTTPStatus.OK)
+        self.config_db = ConfigDBInterface(self.config_db_url)
+        self.config_db.get_site_info(force_update=True)
+
+    def tearDown(self):  # noqa
+        responses.stop()
+        responses.reset()
+
+    def test_snapshot_rebuilt_for_new_site_info(self):
+        snapshot = self.config_db.snapshot
+        self.assertIs(snapshot, self.config_db.snapshot)
+
+        self.config_db.site_info = instrument_sites['results'][:1]
+        self.assertIsNot(snapshot, self.config_db.snapshot)
+        self.assertEqual(len(self.config_db.snapshot.instruments), 2)
+
+    def test_get_active_instruments_info(self):
+        active_instruments = self.config_db.get_active_instruments_info()
+        self.assertEqual(list(active_instruments.keys()),
+                         ['cpt.doma.1m0a', 'cpt.domc.1m0a', 'lsc.doma.1m0a', 'ogg.clma.2m0a'])
+
+        fa14 = active_instruments['cpt.doma.1m0a'][0]
+        self.assertEqual(fa14['instrument_type'], '1M0-SCICAM-SINISTRO')
+        self.assertEqual(fa14['overheads']['filter_change_time'], 2.0)
+        self.assertEqual(fa14['default_readout_mode'], 'full_frame')
+
+    def test_get_active_instruments_info_filters(self):
+        without_commissioning = self.config_db.get_active_instruments_info(include_commissioning=False)
+        self.assertNotIn('lsc.doma.1m0a', without_commissioning)
+
+        everything = self.config_db.get_active_instruments_info(site_code='lsc', include_everything=True)
+        self.assertEqual(list(everything.keys()), ['lsc.doma.1m0a', 'lsc.aqwa.0m4a'])
+
+        nres = self.config_db.get_active_instruments_info(instrument_type='1m0-nres-scicam')
+        self.assertEqual(list(nres.keys()), ['cpt.domc.1m0a'])
+
+    def test_get_instruments_types_for_site(self):
+        codes = [instrument_type['code'] for instrument_type in self.config_db.get_instruments_types('ogg')]
+        self.assertEqual(codes, ['2M0-FLOYDS-SCICAM', '0M4-SCICAM-SBIG'])
+
+    def test_get_matching_instrument(self):
+        instrument = self.config_db.get_matching_instrument(instrument_name='FA15')
+        self.assertEqual(instrument['site'], 'lsc')
+
+        instrument = self.config_db.get_matching_instrument(site='cpt', observatory='DOMC')
+        self.assertEqual(instrument['code'], 'nres03')
+
+        with self.assertRaises(InstrumentNotFoundException):
+            self.config_db.get_matching_instrument(instrument_name='kb27')  # MANUAL
+
+        instrument = self.config_db.get_matching_instrument(instrument_name='kb27', include_everything=True)
+        self.assertEqual(instrument['telescope'], '0m4b')
+
+    def test_get_active_instruments_info_is_memoized(self):
+        first = self.config_db.get_active_instruments_info(site_code='cpt')
+        first['cpt.doma.1m0a'].clear()  # callers get their own lists...
+        second = self.config_db.get_active_instruments_info(site_code='cpt')
+
+        self.assertEqual(len(second['cpt.doma.1m0a']), 1)
+        # ...but share the memoized instrument dictionaries
+        self.assertIs(second['cpt.domc.1m0a'][0], first['cpt.domc.1m0a'][0])
+        self.assertIs(self.config_db.get_matching_instrument(instrument_name='nres03'), second['cpt.domc.1m0a'][0])
+
+    def test_force_update_with_new_site_info_evicts_memo(self):
+        self.config_db.get_active_instruments_info()
+        self.assertEqual(active_instruments_memo.version, self.config_db.snapshot.version)
+
+        changed_sites = json.loads(json.dumps(instrument_sites))
+        changed_sites['results'][0]['enclosure_set'][0]['telescope_set'][0]['instrument_set'][0]['state'] = 'DISABLED'
+        responses.replace(responses.GET, f'{self.config_db_url}/sites/', json=changed_sites, status=HTTPStatus.OK)
+        self.config_db.get_site_info(force_update=True)
+
+        self.assertEqual(len(active_instruments_memo), 0)
+        self.assertNotIn('cpt.doma.1m0a', self.config_db.get_active_instruments_info())
+
+
+@override_settings(CONFIGDB_SNAPSHOT_ENABLED=False)
+class TestGetConfigDB(SimpleTestCase):
+    def setUp(self):
+        configdb_connections._configdb = None
+        responses.start()
+        responses.add(responses.GET, 'http://some-url/sites/', json=instrument_sites, status=HTTPStatus.OK)
+
+    def tearDown(self):  # noqa
+        configdb_connections._configdb = None
+        responses.stop()
+        responses.reset()
+
+    @override_settings(CONFIGDB_URL='http://some-url')
+    def test_get_configdb_is_created_once(self):
+        self.assertIsNone(configdb_connections._configdb)  # nothing is loaded until it is first used
+
+        configdb = get_configdb()
+        self.assertIs(get_configdb(), configdb)
+        self.assertEqual(configdb.configdb_url, 'http://some-url/')
+
+
+@override_settings(CONFIGDB_SITE_INFO_SOFT_TTL=60, CONFIGDB_SNAPSHOT_ENABLED=False)
+class TestSiteInfoRefresh(SimpleTestCase):
+    def setUp(self):
+        self.config_db_url = 'http://some-url'
+        responses.start()
+        responses.add(responses.GET, f'{self.config_db_url}/sites/', json=instrument_sites, status=HTTPStatus.OK)
+        cache.delete(configdb_connections.SITE_INFO_REFRESH_LOCK_KEY)
+        self.stale_site_info = instrument_sites['results'][:1]
+        cache.set(configdb_connections.SITE_INFO_CACHE_KEY,
+                  {'site_info': self.stale_site_info, 'fetched_at': time.time() - 120})
+
+    def tearDown(self):  # noqa
+        cache.delete(configdb_connections.SITE_INFO_CACHE_KEY)
+        cache.delete(configdb_connections.SITE_INFO_REFRESH_LOCK_KEY)
+        responses.stop()
+        responses.reset()
+
+    def test_stale_site_info_is_served_while_refreshing(self):
+        config_db = ConfigDBInterface(self.config_db_url)
+        self.assertEqual(config_db.site_info, self.stale_site_info)
+
+        config_db._refresh_thread.join()
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(config_db.site_info, instrument_sites['results'])
+        self.assertFalse(config_db.is_stale())
+        self.assertEqual(cache.get(configdb_connections.SITE_INFO_CACHE_KEY)['site_info'], instrument_sites['results'])
+        self.assertIsNone(cache.get(configdb_connections.SITE_INFO_REFRESH_LOCK_KEY))
+
+    def test_only_the_lock_holder_refreshes(self):
+        cache.add(configdb_connections.SITE_INFO_REFRESH_LOCK_KEY, True)  # another worker is refreshing
+        config_db = ConfigDBInterface(self.config_db_url)
+
+        self.assertEqual(config_db.site_info, self.stale_site_info)
+        self.assertIsNone(config_db._refresh_thread)
+        self.assertEqual(len(responses.calls), 0)
+
+
+@override_settings(CONFIGDB_SNAPSHOT_ENABLED=True)
+class TestSavedSnapshot(TestCase):
+    def setUp(self):
+        cache.delete(configdb_connections.SITE_INFO_CACHE_KEY)
+        responses.start()
+
+    def tearDown(self):  # noqa
+        cache.delete(configdb_connections.SITE_INFO_CACHE_KEY)
+        responses.stop()
+        responses.reset()
+
+    def save_site_info(self, fetched_at):
+        SavedSnapshot.save_snapshot(configdb_connections.SITE_INFO_SNAPSHOT_NAME,
+                                    {'site_info': instrument_sites['results'], 'fetched_at': fetched_at})
+
+    def test_snapshot_round_trip(self):
+        snapshot = {'site_info': instrument_sites['results'], 'fetched_at': 1234.5}
+        self.assertEqual(decode_snapshot(encode_snapshot(snapshot)), snapshot)
+
+        SavedSnapshot.save_snapshot('test', snapshot)
+        SavedSnapshot.save_snapshot('test', dict(snapshot, fetched_at=2345.6))
+        self.assertEqual(SavedSnapshot.objects.count(), 1)
+        self.assertEqual(SavedSnapshot.load('test'), dict(snapshot, fetched_at=2345.6))
+
+    def test_unreadable_snapshots_are_ignored(self):
+        self.assertIsNone(SavedSnapshot.load('test'))
+
+        SavedSnapshot.objects.create(name='test', data=b'{"results": []}')
+        self.assertIsNone(SavedSnapshot.load('test'))
+
+    def test_successful_fetch_saves_snapshot(self):
+        responses.add(responses.GET, 'http://some-url/sites/', json=instrument_sites, status=HTTPStatus.OK)
+        ConfigDBInterface('http://some-url')
+
+        snapshot = SavedSnapshot.load(configdb_connections.SITE_INFO_SNAPSHOT_NAME)
+        self.assertEqual(snapshot['site_info'], instrument_sites['results'])
+
+    def test_cold_start_loads_recent_snapshot_without_configdb(self):
+        self.save_site_info(time.time())
+        config_db = ConfigDBInterface('http://some-url')
+
+        self.assertEqual(len(responses.calls), 0)
+        self.assertEqual(config_db.site_info, instrument_sites['results'])
+        self.assertEqual(cache.get(configdb_connections.SITE_INFO_CACHE_KEY)['site_info'], instrument_sites['results'])
+
+    @override_settings(CONFIGDB_SITE_INFO_SOFT_TTL=3 * 24 * 3600)  # not refreshed on another database connection
+    def test_old_snapshot_is_used_when_configdb_is_down(self):
+        # a new pod, with nothing cached, starting while ConfigDB is down
+        self.save_site_info(time.time() - 2 * 24 * 3600)
+        responses.add(responses.GET, 'http://some-url/sites/', status=HTTPStatus.SERVICE_UNAVAILABLE)
+        config_db = ConfigDBInterface('http://some-url')
+
+        self.assertEqual(config_db.site_info, instrument_sites['results'])
@@ -0,0 +1,59 @@
+import copy
+import json
+import os
+import unittest
+
+from configdb.configdb_connections import ConfigDBInterface
+from configdb.snapshot import ConfigDBSnapshot
+from configdb.stream import JSONArrayStream, project_site
+
+with open(os.path.join(os.path.dirname(__file__), 'data/test_instrument_sites.json'), 'r') as f:
+    instrument_sites = json.load(f)
+
+
+def chunked(data: bytes, size: int):
+    return (data[i:i + size] for i in range(0, len(data), size))
+
+
+class TestJSONArrayStream(unittest.TestCase):
+    def test_items_are_parsed_across_chunk_boundaries(self):
+        document = {'count': 3, 'next': None, 'results': [{'code': 'ogg', 'lat': 20.7}, 12345, 'sité'], 'x': [1]}
+        data = json.dumps(document, ensure_ascii=False).encode('UTF-8')
+
+        for size in (1, 2, 7, len(data)):
+            stream = JSONArrayStream(chunked(data, size))
+            self.assertEqual(list(stream), document['results'])
+            self.assertTrue(stream.found)
+            self.assertEqual(stream.extras, {'count': 3, 'next': None, 'x': [1]})
+
+    def test_missing_results(self):
+        stream = JSONArrayStream([b'{"detail": "Not found."}'])
+        self.assertEqual(list(stream), [])
+        self.assertFalse(stream.found)
+
+    def test_malformed_json_raises(self):
+        for data in (b'{"results": [1, 2', b'{"results": [1 2]}', b'[1, 2]'):
+            with self.assertRaises(json.JSONDecodeError):
+                list(JSONArrayStream(chunked(data, 3)))
+
+
+class TestProjection(unittest.TestCase):
+    def test_projected_sites_give_the_same_instrument_info(self):
+        sites = copy.deepcopy(instrument_sites['results'])
+        for site in sites:
+            site['timezone_name'] = 'unused'
+            for enclosure in site['enclosure_set']:
+                for telescope in enclosure['telescope_set']:
+                    for instrument in telescope['instrument_set']:
+                        instrument['science_cameras'][0]['camera_type']['pscale'] = 0.389  # unused
+        projected = [project_site(site) for site in sites]
+        self.assertNotIn('timezone_name', projected[0])
+        self.assertNotIn('pscale', projected[0]['enclosure_set'][0]['telescope_set'][0]['instrument_set'][0]
+                         ['science_cameras'][0]['camera_type'])
+
+        full, reduced = ConfigDBSnapshot(sites), ConfigDBSnapshot(projected)
+        for full_record, reduced_record in zip(full.instruments, reduced.instruments):
+            self.assertEqual(ConfigDBInterface._instrument_info(full_record),
+                             ConfigDBInterface._instrument_info(reduced_record))
+        self.assertEqual([record.telcode for record in full.telescopes if record.active],
+                         [record.telcode for record in reduced.telescopes if record.active])
@@ -1,4 +1,6 @@
 import logging
+from typing import List
+
 from .models import Instrument
 
 logger = logging.getLogger(__name__)
@@ -6,3 +8,7 @@ logger = logging.getLogger(__name__)
 def instrument_post_save(instrument: Instrument, created: bool):
     logger.info(f'instrument_post_save hook: {instrument} created={created}')
 
+
+def instrument_post_bulk_save(created: List[Instrument], updated: List[Instrument]):
+    logger.info(f'instrument_post_bulk_save hook: created={[str(i) for i in created]} '
+                f'updated={[str(i) for i in updated]}')
@@ -0,0 +1,116 @@
+from contextlib import contextmanager
+import logging
+import time
+from typing import Dict, Iterable, Optional
+
+from django.conf import settings
+from django.db import transaction
+
+from calibrations.sync import sync_instrument_filters, sync_instruments
+from configdb.client import get_configdb_client
+from configdb.diff import (InstrumentDelta, diff_instruments, get_previous_snapshot, is_schedulable_imager,
+                           save_snapshot, snapshot_hash, summarize_instrument)
+from network.utils import bulk_upsert_instruments
+
+logger = logging.getLogger(__name__)
+
+INSTRUMENTS_SNAPSHOT_NAME = 'importinstruments_snapshot'
+
+
+class InstrumentImporter(object):
+    """
+    Imports instruments from the ConfigDB ``/instruments/`` endpoint into both instrument tables.
+
+    The endpoint is fetched once. The instruments that changed since the last import, whose snapshot is saved in
+    the database (see ``configdb.models.SavedSnapshot``), are then written to ``network.models.Instrument``, and
+    ``calibrations.models.Instrument`` and ``calibrations.models.InstrumentFilter`` are reconciled with every
+    schedulable imager, all in a single transaction. How long each stage took is kept in ``timings``.
+    """
+
+    def __init__(self, configdb_url: Optional[str] = None, page_size: Optional[int] = None,
+                 max_workers: Optional[int] = None, full: bool = False, prune_filters: bool = False) -> None:
+        self.configdb_url = configdb_url or settings.CONFIGDB_URL
+        self.page_size = page_size or settings.CONFIGDB_PAGE_SIZE
+        self.max_workers = max_workers or settings.CONFIGDB_FETCH_WORKERS
+        self.full = full
+        self.prune_filters = prune_filters
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = time.perf_counter() - start
+
+    def timing_summary(self) -> str:
+        total = sum(self.timings.values())
+        lines = [f'{name:<25} {seconds:8.3f}s' for name, seconds in self.timings.items()]
+        lines.append(f'{"total":<25} {total:8.3f}s')
+        return '\n'.join(lines)
+
+    def run(self) -> Optional[InstrumentDelta]:
+        """Run the import. Returns the instrument changes that were applied, or None if ConfigDB didn't change."""
+        logger.info(f'Getting instruments from {self.configdb_url}')
+        with self.stage('fetch'):
+            instruments_info = get_configdb_client().get_all_results(f'{self.configdb_url}/instruments/',
+                                                                     project=summarize_instrument,
+                                                                     page_size=self.page_size,
+                                                                     max_workers=self.max_workers)
+
+        with self.stage('diff'):
+            summaries = {summary['instrument']: summary for summary in instruments_info or []}
+            summaries_hash = snapshot_hash(summaries)
+            previous = None if self.full else get_previous_snapshot(INSTRUMENTS_SNAPSHOT_NAME)
+            if previous and previous['hash'] == summaries_hash:
+                logger.info('No instrument changes in ConfigDB since the last import')
+                delta = None
+            else:
+                delta = diff_instruments(previous['instruments'] if previous else {}, summaries)
+                logger.info(f'Instrument changes in ConfigDB: {delta}')
+
+        with transaction.atomic():
+            if delta is not None:
+                with self.stage('network instruments'):
+                    self.sync_network_instruments(delta)
+            # the calibrations instruments and their filters are reconciled with every instrument on every run, in a
+            # constant number of queries, so that Filters added and rows deleted locally are picked up as well
+            imagers = [inst for inst in summaries.values() if is_schedulable_imager(inst)]
+            with self.stage('calibrations instruments'):
+                instrument_ids = sync_instruments(self.calibrations_instruments(imagers))
+            with self.stage('instrument filters'):
+                instrument_filters = {instrument_ids[inst['code']]: inst['optical_elements'][inst['code']]
+                                      for inst in imagers
+                                      if inst['code'] in instrument_ids and inst['code'] in inst['optical_elements']}
+                sync_instrument_filters(instrument_filters, prune=self.prune_filters)
+            if delta is not None:
+                # saved along with the changes, so that the next import (in a new pod) diffs against what was synced
+                save_snapshot(INSTRUMENTS_SNAPSHOT_NAME, summaries, summaries_hash)
+        return delta
+
+    @staticmethod
+    def sync_network_instruments(delta: InstrumentDelta) -> None:
+        imported = {}  # instrument fields to create or update, by code
+        states = {}  # instruments that are no longer imported keep their row, but it should show their current state
+        for inst in delta.changed:
+            if is_schedulable_imager(inst):
+                imported[inst['code']] = {'instrument': inst['instrument'],
+                                          'instrument_type': inst['instrument_type'],
+                                          'state': inst['state']}
+            elif inst in delta.state_changed:
+                states[inst['code']] = {'state': inst['state']}
+
+        created, updated = bulk_upsert_instruments(imported)
+        _, state_updated = bulk_upsert_instruments(states, create=False)
+        logger.info(f'Created {len(created)} and updated {len(updated) + len(state_updated)} network instruments')
+
+    @staticmethod
+    def calibrations_instruments(imagers: Iterable[dict]) -> Dict[str, dict]:
+        instruments = {}
+        for inst in imagers:
+            instruments[inst['code']] = {'site': inst['site'], 'enclosure': inst['enclosure'],
+                                         'telescope': inst['telescope']}
+            if inst['code'] in inst['camera_types']:
+                instruments[inst['code']]['type'] = inst['camera_types'][inst['code']]
+        return instruments
@@ -1,3 +1,137 @@
-from django.test import TestCase
+import copy
+from http import HTTPStatus
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import responses
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from calibrations.models import Filter, Instrument as CalibrationsInstrument
+from configdb.models import SavedSnapshot
+from configdb.tests.test_diff import instruments
+from network.importer import INSTRUMENTS_SNAPSHOT_NAME, InstrumentImporter
+from network.models import Instrument
+from network.utils import bulk_upsert_instruments
+
+
+@override_settings(CONFIGDB_URL='http://configdb')
+class TestImportInstruments(TestCase):
+    def setUp(self):
+        responses.start()
+        self.set_configdb_instruments(instruments)
+
+    def tearDown(self):  # noqa
+        responses.stop()
+        responses.reset()
+
+    def set_configdb_instruments(self, results):
+        responses.reset()
+        responses.add(responses.GET, 'http://configdb/instruments/', json={'results': results}, status=HTTPStatus.OK)
+
+    def test_import_fills_both_instrument_tables(self):
+        Filter.objects.create(name='rp', exposure_time=10, exposure_count=1)
+        stdout = StringIO()
+        call_command('importinstruments', stdout=stdout)
+
+        self.assertEqual(list(Instrument.objects.values_list('instrument', 'state')),
+                         [('cpt.doma.1m0a.fa14', 'SCHEDULABLE')])
+        fa14 = CalibrationsInstrument.objects.get(code='fa14')
+        self.assertEqual((fa14.site, fa14.enclosure, fa14.telescope), ('cpt', 'doma', '1m0a'))
+        self.assertEqual(list(fa14.instrumentfilter_set.values_list('filter__name', flat=True)), ['rp'])
+        self.assertIn('instrument filters', stdout.getvalue())
+
+    def test_import_only_applies_changes(self):
+        call_command('importinstruments', stdout=StringIO())
+
+        # the snapshot is read and the calibrations instruments and filters reconciled, without writing anything
+        with CaptureQueriesContext(connection) as queries:
+            call_command('importinstruments', stdout=StringIO())
+        self.assertEqual([query['sql'] for query in queries.captured_queries
+                          if not query['sql'].startswith(('SELECT', 'SAVEPOINT', 'RELEASE SAVEPOINT'))], [])
+
+        changed = copy.deepcopy(instruments)
+        changed[0]['state'] = 'DISABLED'
+        self.set_configdb_instruments(changed)
+        call_command('importinstruments', stdout=StringIO())
+        self.assertEqual(Instrument.objects.get(code='fa14').state, 'DISABLED')
+
+    def test_snapshot_survives_between_runs(self):
+        call_command('importinstruments', stdout=StringIO())
+        self.assertTrue(SavedSnapshot.objects.filter(name=INSTRUMENTS_SNAPSHOT_NAME).exists())
+
+        # the next run is a new CronJob pod, with an empty /tmp and so an empty cache
+        cache.clear()
+        changed = copy.deepcopy(instruments)
+        changed[0]['state'] = 'DISABLED'
+        self.set_configdb_instruments(changed)
+        delta = InstrumentImporter().run()
+
+        # only the changed instrument was synced, not every one as without a previous snapshot
+        self.assertEqual(delta.added, [])
+        self.assertEqual([summary['code'] for summary in delta.changed], ['fa14'])
+        self.assertEqual(Instrument.objects.get(code='fa14').state, 'DISABLED')
+        self.assertEqual(SavedSnapshot.load(INSTRUMENTS_SNAPSHOT_NAME)['instruments']['cpt.doma.1m0a.fa14']['state'],
+                         'DISABLED')
+
+    def test_local_changes_are_picked_up_without_configdb_changes(self):
+        call_command('importinstruments', stdout=StringIO())
+        fa14 = CalibrationsInstrument.objects.get(code='fa14')
+        self.assertFalse(fa14.instrumentfilter_set.exists())
+
+        # a Filter added in the admin, and an instrument deleted locally, between two imports of the same instruments
+        Filter.objects.create(name='rp', exposure_time=10, exposure_count=1)
+        call_command('importinstruments', stdout=StringIO())
+        self.assertEqual(list(fa14.instrumentfilter_set.values_list('filter__name', flat=True)), ['rp'])
+
+        fa14.delete()
+        call_command('importinstruments', stdout=StringIO())
+        self.assertEqual(list(CalibrationsInstrument.objects.get(code='fa14').instrumentfilter_set.values_list(
+            'filter__name', flat=True)), ['rp'])
+
+    def test_full_import(self):
+        call_command('importinstruments', stdout=StringIO())
+        Instrument.objects.all().delete()
+
+        call_command('importinstruments', full=True, stdout=StringIO())
+        self.assertTrue(Instrument.objects.filter(code='fa14').exists())
+
+
+class TestBulkUpsertInstruments(TestCase):
+    def setUp(self):
+        self.fa14 = Instrument.objects.create(code='fa14', instrument='cpt.doma.1m0a.fa14',
+                                              instrument_type='1M0-SCICAM-SINISTRO', state='SCHEDULABLE')
+
+    @mock.patch('network.utils.run_hook')
+    def test_only_changed_rows_are_written(self, run_hook):
+        instruments = {
+            'fa14': {'instrument': 'cpt.doma.1m0a.fa14', 'instrument_type': '1M0-SCICAM-SINISTRO',
+                     'state': 'SCHEDULABLE'},
+            'fa15': {'instrument': 'lsc.doma.1m0a.fa15', 'instrument_type': '1M0-SCICAM-SINISTRO',
+                     'state': 'SCHEDULABLE'},
+        }
+        created, updated = bulk_upsert_instruments(instruments)
+        self.assertEqual([instrument.code for instrument in created], ['fa15'])
+        self.assertEqual(updated, [])
+        run_hook.assert_called_once_with('instrument_post_bulk_save', created=created, updated=[])
+
+        run_hook.reset_mock()
+        with self.assertNumQueries(1):
+            self.assertEqual(bulk_upsert_instruments(instruments), ([], []))
+        run_hook.assert_not_called()
+
+    @mock.patch('network.utils.run_hook')
+    def test_update_without_create(self, run_hook):
+        created, updated = bulk_upsert_instruments({'fa14': {'state': 'DISABLED'}, 'kb98': {'state': 'DISABLED'}},
+                                                   create=False)
+        self.assertEqual(created, [])
+        self.assertEqual(updated, [self.fa14])
+
+        fa14 = Instrument.objects.get(code='fa14')
+        self.assertEqual(fa14.state, 'DISABLED')
+        self.assertGreater(fa14.modified, self.fa14.created)
+        self.assertFalse(Instrument.objects.filter(code='kb98').exists())
+        run_hook.assert_called_once_with('instrument_post_bulk_save', created=[], updated=updated)
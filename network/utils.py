@@ -4,6 +4,11 @@ import csv
 from .models import Instrument
 from io import StringIO
 
+from django.db import transaction
+from django.utils import timezone
+
+from tom_common.hooks import run_hook
+
 
 # NOTE: This saves locally. To avoid this, create file buffer.
 # referenced https://www.codingforentrepreneurs.com/blog/django-queryset-to-csv-files-datasets/
@@ -74,3 +79,51 @@ def import_instruments(instruments):
             errors.append(error)
 
     return {'instruments': instruments, 'errors': errors}
+
+
+def bulk_upsert_instruments(instruments, create=True):
+    """
+    Creates or updates a batch of instruments, writing only the rows whose fields changed.
+
+    The existing rows are read in one query and compared with ``instruments``; new rows are then created with one
+    ``bulk_create`` and changed rows updated with one ``bulk_update``, in a single transaction. Rather than
+    ``instrument_post_save`` for each instrument, the ``instrument_post_bulk_save`` hook is run once for the batch.
+
+    :param instruments: Field values for each instrument, keyed by instrument code, e.g.
+        ``{'fa14': {'instrument': 'cpt.doma.1m0a.fa14', 'instrument_type': '1M0-SCICAM-SINISTRO', ...}}``
+    :type instruments: dict
+
+    :param create: Whether to create instruments that don't exist yet, or only update existing ones
+    :type create: bool
+
+    :returns: The created and the updated instruments
+    :rtype: tuple
+    """
+    existing = {instrument.code: instrument for instrument in Instrument.objects.filter(code__in=instruments.keys())}
+    now = timezone.now()
+
+    created = []
+    updated = []
+    updated_fields = set()
+    for code, fields in instruments.items():
+        instrument = existing.get(code)
+        if instrument is None:
+            if create:
+                created.append(Instrument(code=code, created=now, modified=now, **fields))
+            continue
+
+        changed_fields = [field for field, value in fields.items() if getattr(instrument, field) != value]
+        if changed_fields:
+            for field in changed_fields:
+                setattr(instrument, field, fields[field])
+            instrument.modified = now  # bulk_update doesn't apply auto_now
+            updated_fields.update(changed_fields)
+            updated.append(instrument)
+
+    if created or updated:
+        with transaction.atomic():
+            Instrument.objects.bulk_create(created)
+            Instrument.objects.bulk_update(updated, sorted(updated_fields) + ['modified'])
+        run_hook('instrument_post_bulk_save', created=created, updated=updated)
+
+    return created, updated
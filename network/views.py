@@ -4,7 +4,6 @@ from datetime import datetime
 from io import StringIO
 from urllib.parse import urlencode
 
-from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.models import Group
@@ -32,8 +31,6 @@ from tom_common.hooks import run_hook
 from tom_observations.observation_template import ApplyObservationTemplateForm
 from tom_observations.models import ObservationTemplate
 
-from configdb.configdb_connections import ConfigDBInterface
-
 from network.groups import (
     add_all_to_group, add_selected_to_group, remove_all_from_group, remove_selected_from_group,
     move_all_to_group, move_selected_to_group
@@ -43,8 +40,6 @@ from network.utils import import_instruments, export_instruments
 
 logger = logging.getLogger(__name__)
 
-configdb = ConfigDBInterface(settings.CONFIGDB_URL)  # TODO: rethink how we store this property
-
 
 class InstrumentListView(ListView):
     """
@@ -146,8 +141,8 @@ class InstrumentDetailView(DetailView):
     def get(self, request, *args, **kwargs):
         """
         Handles the GET requests to this view. If update_status is passed into the query parameters, calls the
-        updatestatus management command to query for new statuses for ``ObservationRecord`` objects associated with this
-        instrument.
+        updatecalibrationstatuses management command to query for new statuses for ``ObservationRecord`` objects
+        associated with this instrument.
 
         :param request: the request object passed to this view
         :type request: HTTPRequest
@@ -158,7 +153,7 @@ class InstrumentDetailView(DetailView):
                 return redirect(reverse('login'))
             instrument_id = kwargs.get('pk', None)
             out = StringIO()
-            call_command('updatestatus', instrument_id=instrument_id, stdout=out)
+            call_command('updatecalibrationstatuses', instrument_code=self.get_object().code, stdout=out)
             messages.info(request, out.getvalue())
             add_hint(request, mark_safe(
                               'Did you know updating observation statuses can be automated? Learn how in'
@@ -6,6 +6,9 @@ from django.urls import reverse
 
 from tom_targets.models import Target
 
+from calibrations.extras import TargetExtrasCache
+from calibrations.seasons import in_season
+
 
 class NRESCadenceSubmissionForm(forms.Form):
     site = forms.ChoiceField(required=True,
@@ -19,14 +22,13 @@ class NRESCadenceSubmissionForm(forms.Form):
         super().__init__(*args, **kwargs)
 
         # target_id choices must  be defined here in the __init__ rather than in the class definition
-        # because the target_is_in_season method used below is added dynamically to the Target class
-        # and it doesn't yet exist at the time of class interpretation, but it does when the instance
-        # is made (and __init__ is called)
-        self.fields['target_id'] = forms.ChoiceField(  # Create choices for standard_types of targets currently in season
-            choices=[(target.id,
-                      f"{target.targetextra_set.filter(key='standard_type').first().value} (currently {target.name})")
-                     for target in Target.objects.filter(targetextra__key='calibration_type', targetextra__value='NRES')
-                     if target.target_is_in_season()],
+        # because they're read from the database, which isn't available when the class is interpreted
+        targets = in_season(Target.objects.filter(targetextra__key='calibration_type', targetextra__value='NRES'))
+        target_extras = TargetExtrasCache(targets)
+        # Create choices for standard_types of targets currently in season
+        self.fields['target_id'] = forms.ChoiceField(
+            choices=[(target.id, f"{target_extras[target].standard_type} (currently {target.name})")
+                     for target in targets],
             label=False
         )
         self.helper = FormHelper()
@@ -11,6 +11,7 @@ from guardian.shortcuts import get_objects_for_user
 from plotly import offline
 import plotly.graph_objs as go
 
+from calibrations.extras import TargetExtrasCache
 from nres_calibrations.forms import NRESCadenceSubmissionForm
 from tom_common.templatetags.tom_common_extras import truncate_number
 from tom_dataproducts.models import ReducedDatum
@@ -65,13 +66,15 @@ def nres_cadence_list() -> dict:
                      .order_by('site', '-target_id'))
 
     # Construct cadence_data for the template context
+    targets = Target.objects.in_bulk({int(cadence.target_id) for cadence in nres_cadences if cadence.target_id})
+    target_extras = TargetExtrasCache(targets.values())
     cadences_data = []
     for cadence in nres_cadences:
-        target = Target.objects.filter(pk=cadence.target_id).first()
+        target = targets.get(int(cadence.target_id or 0))
         cadences_data.append({
             'cadence': cadence,
             'target': target,
-            'standard_type': target.targetextra_set.filter(key='standard_type').first().value,
+            'standard_type': target_extras[target].standard_type,
             'prev_obs': cadence.observation_group.observation_records.filter(status='COMPLETED').order_by('-scheduled_end').first(),
             'next_obs': cadence.observation_group.observation_records.filter(status='PENDING').order_by('scheduled_start').first()
             })
@@ -9,15 +9,14 @@ from django.urls import reverse_lazy
 from django.views.generic import DeleteView, DetailView, ListView, RedirectView, TemplateView
 from django.views.generic.edit import FormView
 
-from configdb.configdb_connections import ConfigDBInterface
+from calibrations.extras import TargetExtras
+from configdb.configdb_connections import get_configdb
 from nres_calibrations.forms import NRESCadenceSubmissionForm
 from tom_observations.models import DynamicCadence, ObservationGroup
 from tom_targets.models import Target
 
 logger = logging.getLogger(__name__)
 
-configdb = ConfigDBInterface(settings.CONFIGDB_URL)  # TODO: rethink how we store this property
-
 
 class InstrumentTypeListView(ListView):
     # if not overridden, template_name is <app name>/<model name>_list.html
@@ -43,7 +42,7 @@ class InstrumentTypeListView(ListView):
 
         :return: [{'name': "NAME", 'code': "code"}, ... ]
         """
-        queryset = configdb.get_instruments_types('all')
+        queryset = get_configdb().get_instruments_types('all')
 
         # process queryset here before returning
 
@@ -72,7 +71,7 @@ class InstrumentListView(ListView):
         :return:
         """
         instrument_type = self.kwargs['instrument_type']  # from URL via instance kwargs
-        instrument_infos = configdb.get_active_instruments_info(instrument_type=instrument_type)
+        instrument_infos = get_configdb().get_active_instruments_info(instrument_type=instrument_type)
 
         queryset = []
         for instrument_info in instrument_infos.values():
@@ -172,7 +171,7 @@ class NRESCalibrationSubmissionView(FormView):
         :return: list of site-code strings which are both active (SCHEDULABLE or COMMISSIONING) and requested by the form.
         """
         active_sites = []  # the sites with active (SCHEDULABLE or COMMISSIONING) NRES instruments
-        for telcode, instruments in configdb.get_active_instruments_info(
+        for telcode, instruments in get_configdb().get_active_instruments_info(
                 instrument_type=settings.NRES_INSTRUMENT_TYPE,
                 include_commissioning=True).items():
             active_sites.append(instruments[0]['site'])
@@ -196,7 +195,7 @@ class NRESCalibrationSubmissionView(FormView):
         active_requested_nres_sites = self._get_active_requested_nres_sites(requested_sites)
 
         # Get standard type of this dynamic cadence
-        standard_type = target.targetextra_set.filter(key='standard_type').first().value
+        standard_type = TargetExtras.for_target(target).standard_type
         # we have the target_id so we shouldn't need this
         targets_for_standard_type = Target.objects.filter(targetextra__key='standard_type',
                                                           targetextra__value=standard_type)
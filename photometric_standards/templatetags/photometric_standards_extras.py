@@ -5,7 +5,8 @@ from django.db.models.functions import Cast
 from django.db.models.fields.json import KeyTextTransform
 from tom_observations.models import DynamicCadence
 
-from calibrations.models import Instrument, InstrumentFilter
+from calibrations.heatmap import get_heatmap
+from calibrations.models import InstrumentFilter
 
 from tom_targets.models import Target
 
@@ -56,31 +57,18 @@ def submitted_filters(obsr):
 
 @register.inclusion_tag('photometric_standards/partials/instrument_filter_site_table.html')
 def instrument_filter_site_table(site):
-    instruments_at_site = Instrument.objects.filter(site=site)
-    filters_at_site = InstrumentFilter.objects.filter(instrument__site=site).distinct('filter__name').values_list('filter__name', flat=True)
-    inst_filter_data = {}
-    for f in filters_at_site:
-        inst_filter_data[f] = []
-
-        for inst in instruments_at_site:
-            try:
-                inst_filter_data[f].append(
-                    InstrumentFilter.objects.get(instrument__code=inst.code, filter__name=f).get_last_calibration_age()
-                )
-            except ObjectDoesNotExist:
-                inst_filter_data[f].append('')
-
+    site_heatmap = get_heatmap()['sites'].get(site, {'instruments': [], 'filters': [], 'ages': []})
     return {
         'site': site,
-        'instruments_at_site': instruments_at_site,
-        'inst_filter_data': inst_filter_data
+        'instruments_at_site': site_heatmap['instruments'],
+        'inst_filter_data': dict(zip(site_heatmap['filters'], site_heatmap['ages']))
     }
 
 
 @register.inclusion_tag('photometric_standards/partials/instrument_filters_at_site.html')
 def instrument_filter_at_site(instrument):  # TODO: make this take context
     instrument_data = {'instrument': instrument, 'filter_data': {}}
-    inst_filters = InstrumentFilter.objects.filter(instrument=instrument)
+    inst_filters = InstrumentFilter.objects.filter(instrument=instrument).with_last_calibration_age()
     instrument_data['filter_data'] = inst_filters
     return instrument_data
 